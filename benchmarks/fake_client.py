@@ -0,0 +1,63 @@
+# In-process stand-in for the Telethon client, serving a SyntheticDataset.
+#
+# scrape_all_channels only needs an async-iterable iter_messages and an
+# awaitable download_media, so the scraper's whole transform (dedupe against
+# the partition index, preprocessing, NDJSON segments, photo store, links) can
+# be timed without Telegram. `latency` adds a per-call delay to mimic the
+# network; it defaults to none so the numbers measure our own code.
+
+import os
+import asyncio
+from types import SimpleNamespace
+from telethon.tl.types import MessageMediaPhoto
+from .synthetic import image_bytes
+
+class FakeMessage:
+    def __init__(self, record):
+        self.id = record["id"]
+        self.date = record["date"]
+        self.text = record["text"]
+        self.sender_id = record["sender_id"]
+        self.is_reply = record["is_reply"]
+        if record["photo_id"] is not None:
+            self.photo = SimpleNamespace(id=record["photo_id"])
+            self.media = MessageMediaPhoto()
+        else:
+            self.photo = None
+            self.media = None
+
+class FakeTelegramClient:
+    def __init__(self, dataset, limit_per_channel=None, latency=0.0):
+        self.dataset = dataset
+        self.latency = latency
+        # Telethon returns messages newest first.
+        self.messages = {
+            dataset.channel_url(name): [FakeMessage(m) for m in dataset.iter_messages(name, limit_per_channel)][::-1]
+            for name in dataset.channel_names
+        }
+        self._images = {}
+        self.downloads = 0
+
+    async def iter_messages(self, channel_url, limit=None, min_id=0, offset_date=None):
+        count = 0
+        for message in self.messages[channel_url]:
+            if offset_date is not None and message.date >= offset_date:
+                continue
+            if message.id <= min_id or (limit is not None and count >= limit):
+                break
+            count += 1
+            if self.latency and count % 100 == 1:
+                await asyncio.sleep(self.latency)  # one request per page of 100
+            yield message
+
+    async def download_media(self, message, file):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        pid = message.photo.id
+        if pid not in self._images:
+            self._images[pid] = image_bytes(pid, self.dataset.seed)
+        os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+        with open(file, "wb") as f:
+            f.write(self._images[pid])
+        self.downloads += 1
+        return file
@@ -0,0 +1,381 @@
+# End-to-end benchmark suite on synthetic data.
+#
+# Each run generates a SyntheticDataset of the requested scale in a scratch
+# directory and a dedicated database (recreated per run) and times the stages:
+#
+#   scrape    scrape_all_channels through the fake client (at most --scrape-messages)
+#   load      preprocessed partitions -> raw_telegram_messages (the rest of the
+#             dataset is written straight to the partitions first)
+#   products  product_mentions extraction
+#   clusters  text_clusters clustering
+#   dbt       `dbt run`, per model from run_results.json
+#   yolo      detect_files per image on fresh synthetic photos
+#   api       every endpoint under --concurrency concurrent requests (in-process
+#             through httpx's ASGI transport, or --base-url for a running server)
+#
+# Every metric is appended to benchmarks/history.jsonl with the commit, scale
+# and machine. A metric more than --threshold worse than the median of its last
+# BASELINE_RUNS values on the same machine and scale is reported as a
+# regression, and the run exits non-zero.
+#
+#   python -m benchmarks.run --scale 10k
+#   python -m benchmarks.run --scale 1m --stages load products clusters dbt api
+#   python -m benchmarks.run --scale 10M --stages load --keep --workdir /data/bench
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import asyncio
+import platform
+import argparse
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from dotenv import load_dotenv
+from .synthetic import SyntheticDataset, parse_count, write_images, write_partitions
+
+STAGES = ["scrape", "load", "products", "clusters", "dbt", "yolo", "api"]
+HISTORY_PATH = os.path.join(REPO_DIR, "benchmarks", "history.jsonl")
+BASELINE_RUNS = 5  # previous values a metric is compared with
+REGRESSION_THRESHOLD = 0.2
+SCRAPE_MESSAGES = 50_000  # the fake client holds its messages in memory
+
+# (name, path); {channel} is a synthetic channel.
+ENDPOINTS = [
+    ("top-media", "/api/reports/top-media?limit=10"),
+    ("top-products", "/api/reports/top-products?limit=10"),
+    ("top-questions", "/api/reports/top-questions?limit=10"),
+    ("channels", "/api/channels"),
+    ("channels-overview", "/api/channels/overview"),
+    ("channel-activity", "/api/channels/{channel}/activity"),
+    ("channel-timeseries", "/api/channels/{channel}/activity/timeseries?bucket=week"),
+    ("channels-activity", "/api/channels/activity?{channels}"),
+    ("search", "/api/search/messages?query=paracetamol&limit=50"),
+    ("messages", "/api/messages?limit=1000"),
+    ("export", "/api/messages/export?channel_name={channel}"),
+]
+
+def metric(name, value, unit, better="lower"):
+    return {"metric": name, "value": round(value, 4), "unit": unit, "better": better}
+
+def rate_metrics(prefix, count, seconds, unit):
+    return [
+        metric(f"{prefix}_seconds", seconds, "s"),
+        metric(f"{prefix}_per_second", count / seconds if seconds else 0, f"{unit}/s", "higher"),
+    ]
+
+def reset_database(name):
+    """Drop and recreate the benchmark database."""
+    import psycopg2
+    from psycopg2 import sql
+    conn = psycopg2.connect(dbname="postgres", user=os.getenv("POSTGRES_USER"),
+                            password=os.getenv("POSTGRES_PASSWORD"),
+                            host=os.getenv("POSTGRES_HOST", "localhost"), port=os.getenv("POSTGRES_PORT", "5432"))
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("DROP DATABASE IF EXISTS {} WITH (FORCE)").format(sql.Identifier(name)))
+            cur.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(name)))
+    finally:
+        conn.close()
+
+def stage_scrape(ctx):
+    from src import scrape_telegram
+    from .fake_client import FakeTelegramClient
+    dataset = ctx["dataset"]
+    per_channel = -(-min(ctx["scrape_messages"], dataset.messages) // len(dataset.channel_names))
+    client = FakeTelegramClient(dataset, per_channel)
+    # One run takes every message the fake channels hold.
+    scrape_telegram.DEFAULT_CHANNEL_LIMITS.update(messages=per_channel, images=per_channel)
+    urls = list(client.messages)
+    started = time.perf_counter()
+    summaries = asyncio.run(scrape_telegram.scrape_all_channels(client, urls, date_str=ctx["scrape_day"]))
+    seconds = time.perf_counter() - started
+    errors = [s for s in summaries if "error" in s]
+    if errors:
+        raise RuntimeError(f"scrape failed: {errors}")
+    scraped = sum(s["messages"] for s in summaries)
+    ctx["scraped_per_channel"] = per_channel
+    return rate_metrics("scrape", scraped, seconds, "messages") + [
+        metric("scrape_images", sum(s["images"] for s in summaries), "images", "none"),
+        metric("scrape_downloads", client.downloads, "images", "none"),
+    ]
+
+def stage_load(ctx):
+    from src.database import connect
+    from src.load_to_postgres import load_preprocessed
+    # The messages the scrape stage didn't cover go straight to the partitions.
+    started = time.perf_counter()
+    generated = write_partitions(ctx["dataset"], skip=ctx.get("scraped_per_channel", 0))
+    generate_seconds = time.perf_counter() - started
+    conn = connect()
+    try:
+        totals = load_preprocessed(conn)
+    finally:
+        conn.close()
+    return [metric("generate_seconds", generate_seconds, "s", "none"),
+            metric("generated_messages", generated, "messages", "none")] + \
+        rate_metrics("load", totals["rows"], totals["seconds"], "rows") + [
+            metric("load_rows", totals["rows"], "rows", "none"),
+            metric("load_media_links", totals["media"], "rows", "none"),
+        ]
+
+def stage_products(ctx):
+    from src.database import connect
+    from src.product_mentions import extract_product_mentions, DICTIONARY_PATH
+    conn = connect()
+    try:
+        totals = extract_product_mentions(conn, os.path.join(REPO_DIR, DICTIONARY_PATH))
+    finally:
+        conn.close()
+    return rate_metrics("products", totals["messages"], totals["seconds"], "messages") + [
+        metric("product_mentions", totals["mentions"], "rows", "none")]
+
+def stage_clusters(ctx):
+    from src.database import connect
+    from src.text_clusters import cluster_messages
+    conn = connect()
+    try:
+        totals = cluster_messages(conn)
+    finally:
+        conn.close()
+    return rate_metrics("clusters", totals["messages"], totals["seconds"], "messages") + [
+        metric("clusters_created", totals["clusters"], "clusters", "none")]
+
+def stage_dbt(ctx):
+    if shutil.which("dbt") is None:
+        raise RuntimeError("dbt is not installed")
+    dbt_dir = os.path.abspath("dbt")
+    os.makedirs(dbt_dir, exist_ok=True)
+    with open(os.path.join(dbt_dir, "profiles.yml"), "w") as f:
+        json.dump({"telegram_analytics": {"target": "bench", "outputs": {"bench": {
+            "type": "postgres", "threads": 1, "host": os.getenv("POSTGRES_HOST", "localhost"),
+            "port": int(os.getenv("POSTGRES_PORT", "5432")), "user": os.getenv("POSTGRES_USER"),
+            "pass": os.getenv("POSTGRES_PASSWORD"), "dbname": os.getenv("POSTGRES_DB"), "schema": "public",
+        }}}}, f)  # JSON is valid YAML
+    target = os.path.join(dbt_dir, "target")
+    options = ["--project-dir", os.path.join(REPO_DIR, "telegram_analytics"), "--profiles-dir", dbt_dir,
+               "--target-path", target, "--log-path", dbt_dir]
+    subprocess.run(["dbt", "seed", *options], check=True, stdout=subprocess.DEVNULL)
+    started = time.perf_counter()
+    subprocess.run(["dbt", "run", *options], check=True, stdout=subprocess.DEVNULL)
+    seconds = time.perf_counter() - started
+    with open(os.path.join(target, "run_results.json")) as f:
+        results = json.load(f)["results"]
+    return [metric("dbt_seconds", seconds, "s")] + [
+        metric(f"dbt_{r['unique_id'].split('.')[-1]}_seconds", r["execution_time"], "s") for r in results
+    ]
+
+def stage_yolo(ctx):
+    try:
+        from src.yolo_detection import detect_files, get_model, BATCH_SIZE
+        from src.detection_cache import DetectionCache
+        from src.inference_backend import BACKEND, INT8, backend_tag
+    except ImportError as e:
+        raise RuntimeError(f"YOLO dependencies missing: {e}")
+    # Photos of their own, so every one is a cache miss.
+    paths = write_images("yolo_images", ctx["yolo_images"], ctx["dataset"].seed, first_id=5_000_000)
+    started = time.perf_counter()
+    get_model()
+    load_seconds = time.perf_counter() - started
+    cache = DetectionCache("data/bench_detection_cache.sqlite")
+    try:
+        started = time.perf_counter()
+        for i in range(0, len(paths), BATCH_SIZE):
+            detect_files(paths[i:i + BATCH_SIZE], cache, save_detected=False)
+        seconds = time.perf_counter() - started
+    finally:
+        cache.close()
+    metrics = [
+        metric("yolo_model_load_seconds", load_seconds, "s"),
+        metric("yolo_ms_per_image", seconds * 1000 / len(paths), "ms"),
+        metric("yolo_images_per_second", len(paths) / seconds, "images/s", "higher"),
+    ]
+    for m in metrics:
+        m["backend"] = backend_tag(BACKEND, INT8)  # compared only with runs of the same backend
+    return metrics
+
+async def load_endpoint(client, path, requests, concurrency):
+    # `concurrency` clients issue `requests` requests in total.
+    latencies, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            started = time.perf_counter()
+            try:
+                response = await client.get(path)
+                await response.aread()
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+async def run_api(ctx, base_url=None):
+    import httpx
+    if base_url:
+        client = httpx.AsyncClient(base_url=base_url, timeout=60)
+    else:
+        from src.main import app
+        # Server errors come back as 500s and are counted, as over HTTP.
+        transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+        client = httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60)
+    channel = ctx["dataset"].channel_names[0]
+    channels = "&".join(f"channel_name={name}" for name in ctx["dataset"].channel_names)
+    results = []
+    async with client:
+        for name, template in ENDPOINTS:
+            path = template.format(channel=channel, channels=channels)
+            await client.get(path)  # warm-up: connection pool, cache, query plans
+            latencies, errors, seconds = await load_endpoint(client, path, ctx["api_requests"], ctx["concurrency"])
+            latencies.sort()
+            results += [
+                metric(f"api_{name}_p50_ms", statistics.median(latencies) * 1000, "ms"),
+                metric(f"api_{name}_p95_ms", latencies[int(0.95 * (len(latencies) - 1))] * 1000, "ms"),
+                metric(f"api_{name}_requests_per_second", len(latencies) / seconds, "requests/s", "higher"),
+                metric(f"api_{name}_errors", errors, "requests"),
+            ]
+    return results
+
+def stage_api(ctx):
+    return asyncio.run(run_api(ctx, ctx.get("base_url")))
+
+STAGE_FUNCS = {
+    "scrape": stage_scrape, "load": stage_load, "products": stage_products, "clusters": stage_clusters,
+    "dbt": stage_dbt, "yolo": stage_yolo, "api": stage_api,
+}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def read_history(path=HISTORY_PATH):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def append_history(records, path=HISTORY_PATH):
+    with open(path, "a") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+def find_regressions(records, history, threshold=REGRESSION_THRESHOLD, runs=BASELINE_RUNS):
+    """Records worse than the median of the last `runs` comparable values by more than `threshold`."""
+    previous = {}
+    for h in history:
+        key = (h["machine"], h["scale"], h["stage"], h["metric"], h.get("backend"))
+        previous.setdefault(key, []).append(h["value"])
+    regressions = []
+    for r in records:
+        values = previous.get((r["machine"], r["scale"], r["stage"], r["metric"], r.get("backend")), [])[-runs:]
+        if not values or r["better"] not in ("lower", "higher"):
+            continue
+        baseline = statistics.median(values)
+        if r["better"] == "lower":
+            worse = r["value"] > baseline * (1 + threshold) and r["value"] - baseline > 1e-3
+        else:
+            worse = r["value"] < baseline * (1 - threshold)
+        if worse:
+            regressions.append({**r, "baseline": baseline})
+    return regressions
+
+def run(args):
+    scale = parse_count(args.scale)
+    dataset = SyntheticDataset(scale, args.channels, args.days, seed=args.seed)
+    ctx = {
+        "dataset": dataset, "scrape_messages": args.scrape_messages, "scrape_day": "2025-02-01",
+        "yolo_images": args.yolo_images, "api_requests": args.api_requests, "concurrency": args.concurrency,
+        "base_url": args.base_url,
+    }
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    common = {
+        "run_id": run_id, "commit": git_commit(), "machine": args.machine, "scale": scale,
+        "python": platform.python_version(), "cpus": os.cpu_count(),
+    }
+    records = []
+    for stage in [s for s in STAGES if s in args.stages]:
+        started = time.perf_counter()
+        try:
+            metrics = STAGE_FUNCS[stage](ctx)
+        except Exception as e:
+            print(f"[{stage}] failed: {e}")
+            records.append({**common, "stage": stage, **metric("failed", 1, "", "none"), "error": str(e)})
+            continue
+        print(f"[{stage}] {time.perf_counter() - started:.2f}s")
+        for m in metrics:
+            print(f"    {m['metric']:<48}{m['value']:>14} {m['unit']}")
+            records.append({**common, "stage": stage, **m})
+    return records
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the end-to-end benchmarks on synthetic data.")
+    parser.add_argument("--scale", default="10k", help="messages to generate: 10k ... 10M")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scrape-messages", type=lambda v: parse_count(v), default=SCRAPE_MESSAGES,
+                        help="messages served through the fake client; the rest is written directly")
+    parser.add_argument("--yolo-images", type=int, default=64)
+    parser.add_argument("--api-requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--base-url", help="load a running API server instead of the in-process app")
+    parser.add_argument("--database", help="benchmark database, recreated on every run "
+                                           "(default: BENCH_POSTGRES_DB or <POSTGRES_DB>_bench)")
+    parser.add_argument("--workdir", help="scratch directory (default: a temporary one)")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--machine", default=socket.gethostname(), help="label results are compared under")
+    parser.add_argument("--history", default=HISTORY_PATH)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="relative slowdown reported as a regression")
+    parser.add_argument("--no-history", action="store_true", help="don't append this run to the history")
+    parser.add_argument("--no-fail", action="store_true", help="exit 0 even when regressions are found")
+    args = parser.parse_args()
+
+    load_dotenv(os.path.join(REPO_DIR, ".env"))
+    database = args.database or os.getenv("BENCH_POSTGRES_DB") or f"{os.getenv('POSTGRES_DB')}_bench"
+    if database == os.getenv("POSTGRES_DB"):
+        sys.exit("The benchmark database is dropped on every run; it can't be the pipeline's own")
+    os.environ["POSTGRES_DB"] = database  # read by src.database on import
+    os.environ.setdefault("PARQUET_LAKE", "false")
+    reset_database(database)
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="telegram-bench-"))
+    # The stores and the scraper's log use paths relative to the working directory.
+    os.makedirs(os.path.join(workdir, "data", "raw", "telegram_messages"), exist_ok=True)
+    os.chdir(workdir)
+    print(f"Benchmarking {parse_count(args.scale)} messages in {workdir} against database {database}")
+    try:
+        records = run(args)
+    finally:
+        os.chdir(REPO_DIR)
+        if not args.keep and not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    regressions = find_regressions(records, read_history(args.history), args.threshold)
+    if not args.no_history:
+        append_history(records, args.history)
+        print(f"Appended {len(records)} results to {args.history}")
+    for r in regressions:
+        print(f"REGRESSION {r['stage']}/{r['metric']}: {r['value']} {r['unit']} "
+              f"(median of previous runs {r['baseline']})")
+    failed = [r for r in records if r["metric"] == "failed"]
+    if (regressions or failed) and not args.no_fail:
+        sys.exit(f"{len(regressions)} regressions, {len(failed)} failed stages")
@@ -0,0 +1,198 @@
+# Synthetic Telegram channels for the benchmarks.
+#
+# Messages look like the real channels' posts: promos naming products from
+# data/products.csv with a price and the channel's fixed footer, customer
+# questions, reposts and short Amharic notes, about a third of them with a
+# photo. Photos are drawn from a pool, so reposted photos share a photo id as
+# they do on Telegram. Everything is derived from the seed: the same
+# arguments always give the same dataset, and messages are generated lazily,
+# channel by channel, so 10M messages never sit in memory at once.
+#
+#   python -m benchmarks.synthetic --messages 1m --out /tmp/synthetic   # preprocessed partitions + photos
+
+import os
+import sys
+import csv
+import random
+import argparse
+from datetime import datetime, timedelta, timezone
+
+DEFAULT_PRODUCTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "products.csv")
+START_DATE = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+AMHARIC_NOTES = [
+    "አዲስ እቃ ገብቷል", "ዋጋ ቀንሰናል", "በቅናሽ ዋጋ", "ለበለጠ መረጃ ይደውሉ", "ዛሬ ብቻ",
+    "ኦሪጅናል ምርት", "በአካል መጥተው ይግዙ", "ዴሊቨሪ አለን",
+]
+QUESTIONS = [
+    "Do you have {product}?", "How much is {product}?", "Is {product} available in Bole?",
+    "{product} አላችሁ?", "የ{product} ዋጋ ስንት ነው?", "Where can I find {product}?",
+]
+PROMOS = [
+    "{product} available now! Price {price} birr",
+    "New stock: {product} {size}ml only {price} ETB",
+    "{product} ገብቷል ዋጋ {price} ብር",
+    "Special offer on {product} and {other}, {price} birr each",
+    "Original {product} from {country}, {price} birr",
+]
+COUNTRIES = ["Korea", "France", "USA", "India", "Turkey", "Germany"]
+
+def parse_count(value):
+    """'10k', '2.5m', '10M' or a plain number."""
+    value = str(value).strip().lower().replace("_", "")
+    for suffix, factor in (("k", 1_000), ("m", 1_000_000)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+def load_aliases(path=DEFAULT_PRODUCTS):
+    with open(path, newline="", encoding="utf-8") as f:
+        return [row["alias"] for row in csv.DictReader(f)]
+
+class SyntheticDataset:
+    def __init__(self, messages, channels=10, days=30, photo_ratio=0.3, photo_pool=200,
+                 repost_ratio=0.2, seed=42, products_path=DEFAULT_PRODUCTS):
+        self.messages = messages
+        self.channel_names = [f"synthetic_channel_{i:03d}" for i in range(channels)]
+        self.days = days
+        self.photo_ratio = photo_ratio
+        self.photo_pool = photo_pool
+        self.repost_ratio = repost_ratio
+        self.seed = seed
+        self.aliases = load_aliases(products_path)
+
+    def channel_url(self, channel_name):
+        return f"https://t.me/{channel_name}"
+
+    def channel_size(self, index):
+        # Remainder messages go to the first channels.
+        base, extra = divmod(self.messages, len(self.channel_names))
+        return base + (index < extra)
+
+    def footer(self, rng, channel_name):
+        return "\n".join([
+            f"📍 {channel_name.replace('_', ' ').title()}, Bole Medhanialem, 2nd floor",
+            f"☎️ 09{rng.randint(10000000, 99999999)} / 09{rng.randint(10000000, 99999999)}",
+            "ሰኞ - ቅዳሜ 2:00 - 12:00",
+        ])
+
+    def text(self, rng, footer, previous):
+        kind = rng.random()
+        product, other = rng.choice(self.aliases), rng.choice(self.aliases)
+        if previous and kind < self.repost_ratio:
+            return previous  # repost
+        if kind < 0.55:
+            body = rng.choice(PROMOS).format(product=product, other=other, price=rng.randint(50, 5000),
+                                             size=rng.choice([50, 100, 200, 400]), country=rng.choice(COUNTRIES))
+            return f"{body}\n{rng.choice(AMHARIC_NOTES)}\n{footer}"
+        if kind < 0.8:
+            return rng.choice(QUESTIONS).format(product=product)
+        if kind < 0.95:
+            return rng.choice(AMHARIC_NOTES)
+        return ""  # photo-only or service messages
+
+    def iter_messages(self, channel_name, limit=None):
+        """Message dicts of one channel, oldest first, in the scraper's message_to_dict format
+        plus a photo_id (None without a photo)."""
+        index = self.channel_names.index(channel_name)
+        rng = random.Random(f"{self.seed}:{channel_name}")
+        footer = self.footer(rng, channel_name)
+        count = self.channel_size(index) if limit is None else min(limit, self.channel_size(index))
+        span = timedelta(days=self.days).total_seconds()
+        step = span / max(1, self.channel_size(index))
+        previous = None
+        for i in range(count):
+            text = self.text(rng, footer, previous)
+            previous = text or previous
+            has_photo = rng.random() < self.photo_ratio
+            yield {
+                "id": i + 1,
+                "date": START_DATE + timedelta(seconds=int(i * step)),
+                "text": text,
+                "media": has_photo,
+                "channel_name": channel_name,
+                "channel_url": self.channel_url(channel_name),
+                "sender_id": None,
+                "is_reply": rng.random() < 0.05,
+                "photo_id": 1_000_000 + rng.randrange(self.photo_pool) if has_photo else None,
+            }
+
+def stored_message(message):
+    # The stored record: message_to_dict writes the date with str().
+    record = {k: v for k, v in message.items() if k != "photo_id"}
+    record["date"] = str(record["date"])
+    return record
+
+def write_partitions(dataset, channels=None, skip=0, raw=False):
+    """Append the messages of `channels` after the first `skip` of each to the
+    preprocessed partitions (and the raw ones with raw=True); returns the count."""
+    from src.raw_store import RAW_DATA_DIR, PREPROCESSED_DIR, partition_dir, append_messages
+
+    def flush(day, channel_name, messages):
+        preprocessed = [m for m in messages if m["text"] not in (None, "") and m["media"] is True]
+        append_messages(partition_dir(PREPROCESSED_DIR, day, channel_name), preprocessed, index=False)
+        if raw:
+            append_messages(partition_dir(RAW_DATA_DIR, day, channel_name), messages)
+
+    written = 0
+    for channel_name in channels or dataset.channel_names:
+        # Messages come oldest first, so a day is complete once the next one starts.
+        day, messages = None, []
+        for i, message in enumerate(dataset.iter_messages(channel_name)):
+            if i < skip:
+                continue
+            message_day = message["date"].strftime("%Y-%m-%d")
+            if message_day != day and messages:
+                flush(day, channel_name, messages)
+                messages = []
+            day = message_day
+            messages.append(stored_message(message))
+            written += 1
+        if messages:
+            flush(day, channel_name, messages)
+    return written
+
+def make_image(rng, width=640, height=480):
+    """JPEG bytes of a random scene of rectangles and circles."""
+    import cv2
+    import numpy as np
+    img = np.full((height, width, 3), rng.randint(120, 255), dtype=np.uint8)
+    for _ in range(rng.randint(3, 8)):
+        color = tuple(rng.randint(0, 255) for _ in range(3))
+        x, y = rng.randint(0, width - 40), rng.randint(0, height - 40)
+        if rng.random() < 0.5:
+            cv2.rectangle(img, (x, y), (x + rng.randint(20, 200), y + rng.randint(20, 200)), color, -1)
+        else:
+            cv2.circle(img, (x, y), rng.randint(10, 100), color, -1)
+    return cv2.imencode(".jpg", img)[1].tobytes()
+
+def image_bytes(photo_id, seed=42):
+    return make_image(random.Random(f"{seed}:photo:{photo_id}"))
+
+def write_images(out_dir, count, seed=42, first_id=1_000_000):
+    """Write `count` distinct JPEGs to out_dir; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for pid in range(first_id, first_id + count):
+        path = os.path.join(out_dir, f"{pid}.jpg")
+        with open(path, "wb") as f:
+            f.write(image_bytes(pid, seed))
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a synthetic Telegram dataset.")
+    parser.add_argument("--messages", default="10k", help="total messages, e.g. 10k, 1m, 10M")
+    parser.add_argument("--channels", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", required=True, help="directory to write data/ and media/ under")
+    parser.add_argument("--raw", action="store_true", help="also write the raw partitions")
+    args = parser.parse_args()
+    dataset = SyntheticDataset(parse_count(args.messages), args.channels, args.days, seed=args.seed)
+    repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs(args.out, exist_ok=True)
+    os.chdir(args.out)  # the stores use paths relative to the working directory
+    sys.path.insert(0, repo)
+    print(f"Wrote {write_partitions(dataset, raw=args.raw)} messages, "
+          f"{len(write_images('media/photos', dataset.photo_pool, args.seed))} photos to {args.out}")
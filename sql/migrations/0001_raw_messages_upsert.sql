@@ -0,0 +1,34 @@
+-- Make raw_telegram_messages safe to reload: one row per message id, a load
+-- timestamp for incremental downstream models, and a manifest of loaded files.
+
+CREATE TABLE IF NOT EXISTS raw_telegram_messages (
+    id BIGINT,
+    date TIMESTAMPTZ,
+    text TEXT,
+    media BOOLEAN,
+    channel_name TEXT,
+    channel_url TEXT,
+    sender_id BIGINT,
+    is_reply BOOLEAN
+);
+
+ALTER TABLE raw_telegram_messages
+    ADD COLUMN IF NOT EXISTS loaded_at TIMESTAMPTZ NOT NULL DEFAULT now();
+
+-- Earlier loads appended every file on every run; keep a single row per id.
+DELETE FROM raw_telegram_messages a
+USING raw_telegram_messages b
+WHERE a.id = b.id
+  AND a.ctid < b.ctid;
+
+CREATE UNIQUE INDEX IF NOT EXISTS raw_telegram_messages_id_key
+    ON raw_telegram_messages (id);
+
+CREATE TABLE IF NOT EXISTS load_manifest (
+    target TEXT NOT NULL,
+    path TEXT NOT NULL,
+    checksum TEXT NOT NULL,
+    row_count BIGINT NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (target, path)
+);
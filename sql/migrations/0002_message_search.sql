@@ -0,0 +1,28 @@
+-- Indexed search over raw_telegram_messages.text for /api/search/messages.
+
+-- Tables created by the old pandas loader stored date as text; the date
+-- filters and ordering need a real timestamp.
+ALTER TABLE raw_telegram_messages
+    ALTER COLUMN date TYPE TIMESTAMPTZ USING date::timestamptz;
+
+-- 'simple' config: no stemming or stop words, which suits mixed Amharic/English text.
+ALTER TABLE raw_telegram_messages
+    ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', coalesce(text, ''))) STORED;
+
+CREATE INDEX IF NOT EXISTS raw_telegram_messages_search_idx
+    ON raw_telegram_messages USING gin (search_vector);
+
+CREATE INDEX IF NOT EXISTS raw_telegram_messages_channel_date_idx
+    ON raw_telegram_messages (channel_name, date);
+
+-- Trigram index for substring matches (partial words), when pg_trgm is installed.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS raw_telegram_messages_text_trgm_idx
+            ON raw_telegram_messages USING gin (text gin_trgm_ops);
+    END IF;
+END
+$$;
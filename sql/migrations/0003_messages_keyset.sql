@@ -0,0 +1,3 @@
+-- Keyset pagination and range exports of /api/messages walk (date, id).
+CREATE INDEX IF NOT EXISTS raw_telegram_messages_date_id_idx
+    ON raw_telegram_messages (date, id);
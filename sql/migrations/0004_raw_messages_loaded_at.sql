@@ -0,0 +1,4 @@
+-- Incremental dbt models select rows loaded since their last run.
+
+CREATE INDEX IF NOT EXISTS raw_telegram_messages_loaded_at_idx
+    ON raw_telegram_messages (loaded_at);
@@ -0,0 +1,17 @@
+-- Photo of each message, copied from the media store manifest. Detections
+-- join it on media_path to get the exact (channel, message id).
+
+CREATE TABLE IF NOT EXISTS message_media (
+    channel_name TEXT NOT NULL,
+    message_id BIGINT NOT NULL,
+    photo_id BIGINT NOT NULL,
+    media_path TEXT NOT NULL,
+    loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (channel_name, message_id)
+);
+
+CREATE INDEX IF NOT EXISTS message_media_media_path_idx
+    ON message_media (media_path);
+
+CREATE INDEX IF NOT EXISTS message_media_photo_id_idx
+    ON message_media (photo_id);
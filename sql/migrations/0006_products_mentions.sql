@@ -0,0 +1,18 @@
+-- Product mentions extracted from message text by src/product_mentions.py:
+-- one row per message and product.
+
+CREATE TABLE IF NOT EXISTS products_mentions (
+    message_id BIGINT NOT NULL,
+    channel_name TEXT,
+    product TEXT NOT NULL,
+    mention_count INTEGER NOT NULL,
+    message_date TIMESTAMPTZ,
+    PRIMARY KEY (message_id, product)
+);
+
+CREATE INDEX IF NOT EXISTS products_mentions_product_idx
+    ON products_mentions (product);
+
+-- The extractor pages through raw messages in (loaded_at, id) order.
+CREATE INDEX IF NOT EXISTS raw_telegram_messages_loaded_at_id_idx
+    ON raw_telegram_messages (loaded_at, id);
@@ -0,0 +1,42 @@
+-- Near-duplicate clusters of message text, maintained by src/text_clusters.py.
+
+CREATE TABLE IF NOT EXISTS text_clusters (
+    cluster_id BIGINT PRIMARY KEY,  -- fingerprint of the text that founded it
+    representative TEXT NOT NULL,
+    signature BYTEA NOT NULL,       -- MinHash of the representative
+    message_count BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS text_clusters_message_count_idx
+    ON text_clusters (message_count DESC);
+
+-- LSH band buckets of each cluster's signature.
+CREATE TABLE IF NOT EXISTS text_cluster_bands (
+    band SMALLINT NOT NULL,
+    bucket BIGINT NOT NULL,
+    cluster_id BIGINT NOT NULL,
+    PRIMARY KEY (band, bucket, cluster_id)
+);
+
+-- Normalized-text fingerprint -> cluster, so repeated texts skip MinHash.
+CREATE TABLE IF NOT EXISTS text_fingerprints (
+    fingerprint BIGINT PRIMARY KEY,
+    cluster_id BIGINT NOT NULL
+);
+
+-- Number of distinct texts each normalized line occurs in; frequent lines
+-- are boilerplate and left out of the signatures.
+CREATE TABLE IF NOT EXISTS text_lines (
+    line_hash BIGINT PRIMARY KEY,
+    text_count BIGINT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS message_clusters (
+    message_id BIGINT PRIMARY KEY,
+    fingerprint BIGINT NOT NULL,
+    cluster_id BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS message_clusters_cluster_id_idx
+    ON message_clusters (cluster_id);
@@ -0,0 +1,35 @@
+-- Job queue for the YOLO workers (src/detection_queue.py): one job per media
+-- path, claimed with FOR UPDATE SKIP LOCKED.
+
+CREATE TABLE IF NOT EXISTS detection_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    channel_name TEXT,
+    message_id BIGINT,
+    media_path TEXT NOT NULL UNIQUE,
+    status TEXT NOT NULL DEFAULT 'pending',  -- pending | running | done | dead
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    locked_by TEXT,
+    locked_at TIMESTAMPTZ,
+    last_error TEXT,
+    created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ
+);
+
+CREATE INDEX IF NOT EXISTS detection_jobs_pending_idx
+    ON detection_jobs (available_at, id) WHERE status = 'pending';
+
+CREATE INDEX IF NOT EXISTS detection_jobs_running_idx
+    ON detection_jobs (locked_at) WHERE status = 'running';
+
+-- Written by the workers as well as by load_image_detections; the workers
+-- replace an image's rows by media_path.
+CREATE TABLE IF NOT EXISTS image_detections (
+    message_id BIGINT,
+    media_path TEXT,
+    detected_object_class TEXT,
+    confidence_score DOUBLE PRECISION
+);
+
+CREATE INDEX IF NOT EXISTS image_detections_media_path_idx
+    ON image_detections (media_path);
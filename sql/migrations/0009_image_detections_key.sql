@@ -0,0 +1,32 @@
+-- One row per detection: image_detections is keyed by (media_path,
+-- detected_object_class, box), the box being the detection's corners in the
+-- original image's pixels (rounded to 0.1 px). Both writers
+-- (load_image_detections and the detection_queue workers) upsert on it.
+
+ALTER TABLE image_detections
+    ADD COLUMN IF NOT EXISTS box_x1 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS box_y1 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS box_x2 DOUBLE PRECISION,
+    ADD COLUMN IF NOT EXISTS box_y2 DOUBLE PRECISION;
+
+-- Rows written before boxes were stored can't be keyed, and the old loader
+-- appended the whole detections file on every run, so repeated loads can't be
+-- told apart from genuinely equal detections. They are dropped: re-running
+-- src.yolo_detection (its cache version changed with the boxes) writes them
+-- again.
+DELETE FROM image_detections
+WHERE box_x1 IS NULL OR media_path IS NULL OR detected_object_class IS NULL;
+
+ALTER TABLE image_detections
+    ALTER COLUMN media_path SET NOT NULL,
+    ALTER COLUMN detected_object_class SET NOT NULL,
+    ALTER COLUMN box_x1 SET NOT NULL,
+    ALTER COLUMN box_y1 SET NOT NULL,
+    ALTER COLUMN box_x2 SET NOT NULL,
+    ALTER COLUMN box_y2 SET NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS image_detections_key
+    ON image_detections (media_path, detected_object_class, box_x1, box_y1, box_x2, box_y2);
+
+-- Covered by the key's leading column.
+DROP INDEX IF EXISTS image_detections_media_path_idx;
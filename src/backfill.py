@@ -0,0 +1,213 @@
+# Resumable historical backfill of Telegram channels.
+#
+# A channel's message-id range is split into shards that are fetched
+# concurrently, one page at a time, newest first. Every request goes through
+# one shared token bucket, and a FloodWait pauses all shards for as long as
+# Telegram asks. Each shard's position is checkpointed after every saved page in
+# data/backfill/<channel>.json, so an interrupted run resumes where it stopped.
+# Messages land in the raw/preprocessed partition of the day they were posted.
+#
+#   python -m src.backfill --channel tikvahpharma --shards 8
+#   python -m src.backfill --channel tikvahpharma --with-media --rate 2
+
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+from collections import defaultdict
+from telethon.sync import TelegramClient
+from telethon.errors import FloodWaitError
+from .scrape_telegram import (
+    API_ID, API_HASH, CHANNELS, is_photo, group_by_day, save_by_day, worker_session,
+)
+from .raw_store import RAW_DATA_DIR, partition_dir, filter_new_messages
+from .media_store import MediaStore, photo_id
+from .detection_queue import enqueue_media
+
+CHECKPOINT_DIR = os.path.join("data", "backfill")
+PAGE_SIZE = 100  # Telegram's maximum per history request
+BACKFILL_RATE = float(os.getenv("BACKFILL_RATE", "3"))  # requests per second, shared by all shards
+BACKFILL_SHARDS = int(os.getenv("BACKFILL_SHARDS", "8"))
+
+class TokenBucket:
+    """Async token bucket: `rate` requests per second with bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds):
+        # FloodWait applies to the account, so every shard waits.
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+def checkpoint_path(channel_name):
+    return os.path.join(CHECKPOINT_DIR, f"{channel_name}.json")
+
+def save_checkpoint(plan):
+    path = checkpoint_path(plan["channel"])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp, path)
+
+def split_range(min_id, max_id, shards):
+    # Shards cover (lo, hi]; fetching starts just above hi and walks down to lo.
+    step = max(1, -(-(max_id - min_id) // shards))
+    bounds = []
+    lo = min_id
+    while lo < max_id:
+        hi = min(max_id, lo + step)
+        bounds.append({"lo": lo, "hi": hi, "next": hi + 1, "fetched": 0, "done": False})
+        lo = hi
+    return bounds
+
+def load_plan(channel_name, min_id, max_id, shards):
+    path = checkpoint_path(channel_name)
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    plan = {
+        "channel": channel_name,
+        "min_id": min_id,
+        "max_id": max_id,
+        "shards": split_range(min_id, max_id, shards),
+    }
+    save_checkpoint(plan)
+    return plan
+
+def unstored_messages(channel_name, messages):
+    # The (date_str, message) pairs of a page that the raw index doesn't hold yet.
+    unstored = []
+    for date_str, day_messages in group_by_day(messages):
+        pending = filter_new_messages(
+            partition_dir(RAW_DATA_DIR, date_str, channel_name), [{"id": m.id} for m in day_messages]
+        )
+        pending_ids = {m["id"] for m in pending}
+        unstored.extend((date_str, m) for m in day_messages if m.id in pending_ids)
+    return unstored
+
+async def call_limited(limiter, func, *args, **kwargs):
+    # Waits for a token, retrying for as long as Telegram answers with FloodWait.
+    while True:
+        await limiter.acquire()
+        try:
+            return await func(*args, **kwargs)
+        except FloodWaitError as e:
+            logging.warning(f"FloodWait: pausing all shards for {e.seconds}s")
+            limiter.pause(e.seconds)
+
+async def backfill_shard(client, channel_url, plan, shard, limiter, store=None, photo_locks=None):
+    channel_name = plan["channel"]
+    while not shard["done"]:
+        page = await call_limited(
+            limiter, client.get_messages, channel_url,
+            limit=PAGE_SIZE, offset_id=shard["next"], min_id=shard["lo"],
+        )
+        if not page:
+            shard["done"] = True
+        else:
+            # Photos are fetched before the page is stored: once the raw index
+            # holds a message, a resumed run no longer treats it as new.
+            new = unstored_messages(channel_name, page)
+            if store is not None:
+                for date_str, message in new:
+                    if is_photo(message):
+                        pid = photo_id(message)
+                        try:
+                            async with photo_locks[pid]:  # another shard may be fetching the same photo
+                                if not store.has_photo(pid):
+                                    tmp_path = await call_limited(
+                                        limiter, client.download_media, message, file=store.download_target(pid)
+                                    )
+                                    store.add_photo(pid, tmp_path)
+                            store.link_message(pid, channel_name, message.id, date_str)
+                        except Exception as e:
+                            logging.error(f"Failed to download image {message.id}: {e}")
+                enqueue_media(store.take_linked())
+            save_by_day(channel_name, channel_url, [m for _, m in new])
+            shard["next"] = min(m.id for m in page)
+            shard["fetched"] += len(page)
+            shard["done"] = shard["next"] <= shard["lo"] + 1
+        # Checkpoint after the page is stored: a crash before this line only
+        # refetches a page whose messages the raw index already holds.
+        save_checkpoint(plan)
+
+async def backfill_channel(client, channel_url, shards=BACKFILL_SHARDS, rate=BACKFILL_RATE,
+                           min_id=0, max_id=None, with_media=False, limiter=None):
+    """Backfill one channel; returns (messages fetched this run, seconds).
+
+    The client only needs awaitable ``get_messages`` and ``download_media``.
+    """
+    channel_name = channel_url.split('/')[-1]
+    limiter = limiter or TokenBucket(rate)
+    if not os.path.exists(checkpoint_path(channel_name)) and max_id is None:
+        latest = await call_limited(limiter, client.get_messages, channel_url, limit=1)
+        max_id = latest[0].id if latest else 0
+    plan = load_plan(channel_name, min_id, max_id or 0, shards)
+    pending = [s for s in plan["shards"] if not s["done"]]
+    before = sum(s["fetched"] for s in plan["shards"])
+    print(f"{channel_name}: ids {plan['min_id']}..{plan['max_id']}, "
+          f"{len(pending)}/{len(plan['shards'])} shards to go")
+    started = time.perf_counter()
+    store = MediaStore() if with_media else None
+    photo_locks = defaultdict(asyncio.Lock)
+    try:
+        await asyncio.gather(*(
+            backfill_shard(client, channel_url, plan, s, limiter, store, photo_locks) for s in pending
+        ))
+    finally:
+        if store is not None:
+            store.close()
+    elapsed = time.perf_counter() - started
+    return sum(s["fetched"] for s in plan["shards"]) - before, elapsed
+
+async def main_async(channels, shards=BACKFILL_SHARDS, rate=BACKFILL_RATE, with_media=False):
+    # flood_sleep_threshold=0: FloodWaits reach the shared limiter instead of
+    # being slept off by the one request that hit them.
+    async with TelegramClient(worker_session(), API_ID, API_HASH, flood_sleep_threshold=0) as client:
+        limiter = TokenBucket(rate)
+        for channel_url in channels:
+            fetched, elapsed = await backfill_channel(
+                client, channel_url, shards, rate, with_media=with_media, limiter=limiter
+            )
+            print(f"Backfilled {channel_url}: {fetched} messages in {elapsed:.1f}s "
+                  f"({fetched / elapsed if elapsed else 0:.0f} messages/s)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill the full history of Telegram channels.")
+    parser.add_argument("--channel", action="append",
+                        help="channel name or URL (repeatable; default: all configured channels)")
+    parser.add_argument("--shards", type=int, default=BACKFILL_SHARDS, help="id-range shards fetched concurrently")
+    parser.add_argument("--rate", type=float, default=BACKFILL_RATE, help="requests per second across all shards")
+    parser.add_argument("--with-media", action="store_true", help="also download photos")
+    parser.add_argument("--restart", action="store_true", help="discard saved checkpoints and start over")
+    args = parser.parse_args()
+    channels = [c if c.startswith("http") else f"https://t.me/{c}" for c in (args.channel or CHANNELS)]
+    if args.restart:
+        for channel_url in channels:
+            path = checkpoint_path(channel_url.split('/')[-1])
+            if os.path.exists(path):
+                os.remove(path)
+    asyncio.run(main_async(channels, args.shards, args.rate, args.with_media))
@@ -0,0 +1,129 @@
+# Response cache for the report endpoints.
+#
+# Results are kept as ready-to-send JSON bytes with their ETag, either in an
+# in-process LRU with TTL or, when CACHE_REDIS_URL is set, in Redis (or any
+# Redis-compatible server) so all API workers share them.
+#
+# Every key embeds the current data generation. The loaders call invalidate()
+# when they finish, which bumps the generation: a stamp file for the local
+# backend (the loaders run as separate processes), or a counter in Redis.
+
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "3600"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "512"))
+# Browsers can't see invalidations, so they keep responses for less time and revalidate with the ETag.
+CACHE_CLIENT_MAX_AGE = int(os.getenv("CACHE_CLIENT_MAX_AGE", "60"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+CACHE_STAMP_FILE = os.getenv("CACHE_STAMP_FILE", "data/.cache_generation")
+GENERATION_KEY = "telegram_analytics:cache_generation"
+GENERATION_CHECK_INTERVAL = 1.0  # seconds between generation lookups
+
+class TTLCache:
+    """Thread-safe LRU mapping with a per-entry expiry time."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+class LocalBackend:
+    def __init__(self, stamp_file=CACHE_STAMP_FILE):
+        self.entries = TTLCache()
+        self.stamp_file = stamp_file
+
+    async def get(self, key):
+        return self.entries.get(key)
+
+    async def set(self, key, value, ttl):
+        self.entries.set(key, value, ttl)
+
+    async def generation(self):
+        try:
+            return str(os.stat(self.stamp_file).st_mtime_ns)
+        except FileNotFoundError:
+            return "0"
+
+class RedisBackend:
+    def __init__(self, url=CACHE_REDIS_URL):
+        import redis.asyncio as aioredis
+        self.client = aioredis.from_url(url)
+
+    async def get(self, key):
+        payload = await self.client.get(key)
+        if payload is None:
+            return None
+        etag, _, body = payload.partition(b"\n")
+        return etag.decode(), body
+
+    async def set(self, key, value, ttl):
+        etag, body = value
+        await self.client.set(key, etag.encode() + b"\n" + body, ex=ttl)
+
+    async def generation(self):
+        value = await self.client.get(GENERATION_KEY)
+        return value.decode() if value else "0"
+
+backend = RedisBackend() if CACHE_REDIS_URL else LocalBackend()
+_generation = {"value": None, "checked_at": 0.0}
+
+async def current_generation():
+    now = time.monotonic()
+    if _generation["value"] is None or now - _generation["checked_at"] > GENERATION_CHECK_INTERVAL:
+        _generation["value"] = await backend.generation()
+        _generation["checked_at"] = now
+    return _generation["value"]
+
+def invalidate():
+    """Mark all cached responses stale; called by the loaders after new data lands."""
+    os.makedirs(os.path.dirname(CACHE_STAMP_FILE) or ".", exist_ok=True)
+    with open(CACHE_STAMP_FILE, "w") as f:
+        f.write(str(time.time_ns()))
+    if CACHE_REDIS_URL:
+        import redis
+        redis.from_url(CACHE_REDIS_URL).incr(GENERATION_KEY)
+
+def encode_json(result):
+    return json.dumps(result, default=str, ensure_ascii=False).encode()
+
+async def get_or_compute(namespace, compute, *args, ttl=CACHE_TTL_SECONDS, encode=encode_json):
+    """Return (etag, body bytes) for encode(compute(*args)), computing it on a miss.
+
+    Bodies in other encodings need their own namespace.
+    """
+    key = f"{namespace}:{await current_generation()}:{json.dumps(args, default=str)}"
+    hit = await backend.get(key)
+    if hit is not None:
+        return hit
+    body = encode(await compute(*args))
+    value = (f'"{hashlib.sha1(body).hexdigest()}"', body)
+    await backend.set(key, value, ttl)
+    return value
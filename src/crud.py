@@ -1,7 +1,86 @@
+import json
+import time
+import base64
+import asyncio
+import logging
+from datetime import datetime
 from sqlalchemy import text
-from .database import engine
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from .database import engine, async_engine
+from .metrics import observe_query, log_plan
 
-def get_top_products(limit: int):
+# All queries go through fetch_all/fetch_one/stream_rows: with DB_ASYNC they run
+# on the asyncpg engine, otherwise on the psycopg2 pool in a worker thread.
+# `name` labels the statement's latency histogram (see metrics.py); slow
+# statements get their plan logged.
+
+_explain_tasks = set()
+
+def _observe(name, seconds, sql, params):
+    if name is not None and observe_query(name, seconds):
+        # Plain EXPLAIN, in the background: the response doesn't wait for it.
+        task = asyncio.get_running_loop().create_task(_explain(name, seconds, sql, params))
+        _explain_tasks.add(task)
+        task.add_done_callback(_explain_tasks.discard)
+
+async def _explain(name, seconds, sql, params):
+    try:
+        rows = await fetch_all(f"EXPLAIN {sql}", params, name=None)
+    except Exception as e:
+        logging.warning(f"Could not EXPLAIN slow query {name}: {e}")
+        return
+    log_plan(name, seconds, sql, [row["QUERY PLAN"] for row in rows])
+
+def _fetch_all_sync(sql, params):
+    with engine.connect() as conn:
+        return conn.execute(text(sql), params).mappings().fetchall()
+
+async def fetch_all(sql: str, params: dict | None = None, name: str | None = "other"):
+    started = time.perf_counter()
+    if async_engine is not None:
+        async with async_engine.connect() as conn:
+            result = await conn.execute(text(sql), params or {})
+            rows = result.mappings().fetchall()
+    else:
+        rows = await run_in_threadpool(_fetch_all_sync, sql, params or {})
+    _observe(name, time.perf_counter() - started, sql, params)
+    return rows
+
+async def fetch_one(sql: str, params: dict | None = None, name: str | None = "other"):
+    rows = await fetch_all(sql, params, name)
+    return rows[0] if rows else None
+
+def _stream_rows_sync(sql, params, batch_size):
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, yield_per=batch_size)
+        for row in conn.execute(text(sql), params).mappings():
+            yield row
+
+async def _stream(sql, params, batch_size):
+    if async_engine is not None:
+        async with async_engine.connect() as conn:
+            conn = await conn.execution_options(yield_per=batch_size)
+            result = await conn.stream(text(sql), params)
+            async for row in result.mappings():
+                yield row
+    else:
+        async for row in iterate_in_threadpool(_stream_rows_sync(sql, params, batch_size)):
+            yield row
+
+async def stream_rows(sql: str, params: dict | None = None, batch_size: int = 5000, name: str | None = "other"):
+    # Server-side cursor: only `batch_size` rows are held in memory at a time.
+    # The statement's latency is the time to its first row; the rest depends on the client.
+    started = time.perf_counter()
+    first = True
+    async for row in _stream(sql, params or {}, batch_size):
+        if first:
+            _observe(name, time.perf_counter() - started, sql, params)
+            first = False
+        yield row
+    if first:
+        _observe(name, time.perf_counter() - started, sql, params)
+
+async def get_top_products(limit: int):
     sql = """
         SELECT product, COUNT(*) AS mentions
         FROM products_mentions
@@ -9,59 +88,191 @@ def get_top_products(limit: int):
         ORDER BY mentions DESC
         LIMIT :limit
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql), {"limit": limit})
-        return [{"product": row.product, "mentions": row.mentions} for row in result]
+    result = await fetch_all(sql, {"limit": limit}, name="get_top_products")
+    return [{"product": row["product"], "mentions": row["mentions"]} for row in result]
 
-def get_channel_activity(channel_name: str):
-    sql = """
+# Channel statistics come from the channel_daily_activity dbt model (one row
+# per channel per day), so they cost O(channels x days), not O(messages).
+ROLLUP_TABLE = "channel_daily_activity"
+
+async def get_channel_activity(channel_name: str):
+    return (await get_channels_activity([channel_name]))[0]
+
+async def get_channels_activity(channel_names: list[str]):
+    """Activity totals of each channel in one query, in the order asked; unknown channels get zeros."""
+    sql = f"""
         SELECT
             channel_name,
-            COUNT(*) AS post_count,
-            MAX(date) AS last_post_date,
-            COUNT(CASE WHEN media THEN 1 END) AS image_count,
-            COUNT(CASE WHEN is_reply THEN 1 END) AS reply_count
-        FROM raw_telegram_messages
-        WHERE channel_name = :channel_name
+            SUM(post_count)::bigint AS post_count,
+            MAX(last_post_at) AS last_post_date,
+            SUM(media_count)::bigint AS image_count,
+            SUM(reply_count)::bigint AS reply_count
+        FROM {ROLLUP_TABLE}
+        WHERE channel_name = ANY(:channel_names)
         GROUP BY channel_name
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql), {"channel_name": channel_name}).fetchone()
-        if result:
-            return {
-                "channel_name": result.channel_name,
-                "post_count": result.post_count,
-                "last_post_date": result.last_post_date,
-                "image_count": result.image_count,
-                "reply_count": result.reply_count
-            }
-        return {
-            "channel_name": channel_name,
-            "post_count": 0,
-            "last_post_date": None,
-            "image_count": 0,
-            "reply_count": 0
+    result = await fetch_all(sql, {"channel_names": list(channel_names)}, name="get_channels_activity")
+    found = {row["channel_name"]: row for row in result}
+    activity = []
+    for channel_name in channel_names:
+        row = found.get(channel_name)
+        if row is None:
+            activity.append({
+                "channel_name": channel_name,
+                "post_count": 0,
+                "last_post_date": None,
+                "image_count": 0,
+                "reply_count": 0
+            })
+            continue
+        activity.append({
+            "channel_name": row["channel_name"],
+            "post_count": row["post_count"],
+            "last_post_date": str(row["last_post_date"]) if row["last_post_date"] is not None else None,
+            "image_count": row["image_count"],
+            "reply_count": row["reply_count"]
+        })
+    return activity
+
+async def get_channel_timeseries(channel_name: str, bucket: str = "day", date_from=None, date_to=None):
+    """Post/media/reply counts per `bucket` ('day', 'week' or 'month'), oldest first."""
+    rows = await get_channels_timeseries([channel_name], bucket, date_from, date_to)
+    for row in rows:
+        del row["channel_name"]
+    return rows
+
+async def get_channels_timeseries(channel_names: list[str], bucket: str = "day", date_from=None, date_to=None):
+    """get_channel_timeseries for several channels in one query, ordered by channel then bucket."""
+    filters = ["channel_name = ANY(:channel_names)"]
+    params = {"channel_names": list(channel_names), "bucket": bucket}
+    if date_from:
+        filters.append("activity_date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        filters.append("activity_date < :date_to")
+        params["date_to"] = date_to
+    sql = f"""
+        SELECT
+            channel_name,
+            date_trunc(:bucket, activity_date::timestamp)::date AS bucket_start,
+            SUM(post_count)::bigint AS post_count,
+            SUM(media_count)::bigint AS media_count,
+            SUM(reply_count)::bigint AS reply_count
+        FROM {ROLLUP_TABLE}
+        WHERE {" AND ".join(filters)}
+        GROUP BY channel_name, bucket_start
+        ORDER BY channel_name, bucket_start
+    """
+    result = await fetch_all(sql, params, name="get_channels_timeseries")
+    return [
+        {
+            "channel_name": row["channel_name"],
+            "bucket_start": str(row["bucket_start"]),
+            "post_count": row["post_count"],
+            "media_count": row["media_count"],
+            "reply_count": row["reply_count"]
         }
+        for row in result
+    ]
 
-def search_messages(query: str):
-    sql = """
-        SELECT id AS message_id, channel_name, text AS content
-        FROM raw_telegram_messages
-        WHERE text ILIKE :query
-        LIMIT 50
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str, size: int):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError) as e:
+        raise ValueError("Invalid cursor") from e
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError("Invalid cursor")
+    return values
+
+_trigram_index = None
+
+async def has_trigram_index():
+    # Substring matching is only offered when it can use the pg_trgm index.
+    global _trigram_index
+    if _trigram_index is None:
+        sql = "SELECT 1 FROM pg_indexes WHERE indexname = 'raw_telegram_messages_text_trgm_idx'"
+        _trigram_index = await fetch_one(sql, name="has_trigram_index") is not None
+    return _trigram_index
+
+async def search_messages(query: str, channel_name: str | None = None, date_from=None, date_to=None,
+                          cursor: str | None = None, limit: int = 50):
+    """Ranked full-text search; returns (results, next_cursor).
+
+    Matches on the indexed search_vector (plus indexed substring matches when
+    pg_trgm is installed), ordered by rank then id. `next_cursor` is None on
+    the last page.
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql), {"query": f"%{query}%"}).fetchall()
-        return [
-            {
-                "message_id": str(row.message_id) if row.message_id is not None else "",
-                "channel_name": str(row.channel_name) if row.channel_name is not None else "",
-                "content": row.content if row.content is not None else ""
-            }
-            for row in result
-        ]
-
-def get_top_media(limit: int):
+    query = query.strip()
+    if not query:
+        raise ValueError("Empty search query")
+    params = {"query": query, "limit": limit + 1}
+    page_filter = ""
+    if cursor:
+        rank, message_id = decode_cursor(cursor, 2)
+        try:
+            params["cursor_rank"], params["cursor_id"] = float(rank), int(message_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+        page_filter = "WHERE (rank, message_id) < (:cursor_rank, :cursor_id)"
+    match = "m.search_vector @@ q.tsq"
+    if await has_trigram_index():
+        match = f"({match} OR m.text ILIKE :pattern)"
+        params["pattern"] = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    filters = [match]
+    if channel_name:
+        filters.append("m.channel_name = :channel_name")
+        params["channel_name"] = channel_name
+    if date_from:
+        filters.append("m.date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        filters.append("m.date < :date_to")
+        params["date_to"] = date_to
+    sql = f"""
+        SELECT *
+        FROM (
+            SELECT
+                m.id AS message_id,
+                m.channel_name,
+                m.text AS content,
+                m.date,
+                m.media,
+                m.channel_url,
+                m.sender_id,
+                m.is_reply,
+                ts_rank_cd(m.search_vector, q.tsq)::float8 AS rank
+            FROM raw_telegram_messages m,
+                 websearch_to_tsquery('simple', :query) AS q(tsq)
+            WHERE {" AND ".join(filters)}
+        ) hits
+        {page_filter}
+        ORDER BY rank DESC, message_id DESC
+        LIMIT :limit
+    """
+    result = await fetch_all(sql, params, name="search_messages")
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        next_cursor = encode_cursor(result[-1]["rank"], result[-1]["message_id"])
+    return [
+        {
+            "message_id": str(row["message_id"]) if row["message_id"] is not None else "",
+            "channel_name": str(row["channel_name"]) if row["channel_name"] is not None else "",
+            "content": row["content"] if row["content"] is not None else "",
+            "date": str(row["date"]) if row["date"] is not None else "",
+            "media": bool(row["media"]),
+            "channel_url": row["channel_url"],
+            "sender_id": row["sender_id"],
+            "is_reply": row["is_reply"],
+            "image_path": None,
+        }
+        for row in result
+    ], next_cursor
+
+async def get_top_media(limit: int):
     sql = """
         SELECT media_path, COUNT(*) AS mentions
         FROM image_detections
@@ -69,84 +280,117 @@ def get_top_media(limit: int):
         ORDER BY mentions DESC
         LIMIT :limit
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql), {"limit": limit})
-        return [{"media_path": row.media_path, "mentions": row.mentions} for row in result]
+    result = await fetch_all(sql, {"limit": limit}, name="get_top_media")
+    return [{"media_path": row["media_path"], "mentions": row["mentions"]} for row in result]
 
-def list_channels():
+async def list_channels():
     sql = """
         SELECT DISTINCT channel_name
         FROM raw_telegram_messages
         WHERE channel_name IS NOT NULL
         ORDER BY channel_name
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql)).fetchall()
-        return [row.channel_name for row in result]
+    result = await fetch_all(sql, name="list_channels")
+    return [row["channel_name"] for row in result]
 
-def get_top_questions(limit: int):
+async def get_top_questions(limit: int):
+    # Near-duplicate clusters kept by src/text_clusters.py; the representative
+    # is the first text seen in each cluster.
     sql = """
-        SELECT text, COUNT(*) AS count
-        FROM raw_telegram_messages
-        WHERE text IS NOT NULL AND TRIM(text) <> ''
-        GROUP BY text
-        ORDER BY count DESC
+        SELECT representative AS text, message_count AS count
+        FROM text_clusters
+        WHERE message_count > 0
+        ORDER BY message_count DESC
         LIMIT :limit
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql), {"limit": limit})
-        return [{"text": row.text, "count": row.count} for row in result]
+    result = await fetch_all(sql, {"limit": limit}, name="get_top_questions")
+    return [{"text": row["text"], "count": row["count"]} for row in result]
 
-def get_channel_overview():
-    sql = """
+async def get_channel_overview():
+    sql = f"""
         SELECT
             channel_name,
-            COUNT(*) AS message_count,
-            COUNT(CASE WHEN media = TRUE THEN 1 END) AS media_post_count,
-            COUNT(CASE WHEN is_reply = TRUE THEN 1 END) AS reply_count
-        FROM raw_telegram_messages
-        WHERE channel_name IS NOT NULL
+            SUM(post_count)::bigint AS message_count,
+            SUM(media_count)::bigint AS media_post_count,
+            SUM(reply_count)::bigint AS reply_count
+        FROM {ROLLUP_TABLE}
         GROUP BY channel_name
         ORDER BY message_count DESC
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql)).fetchall()
-        return [
-            {
-                "channel_name": str(row.channel_name) if row.channel_name is not None else "",
-                "message_count": row.message_count,
-                "media_post_count": row.media_post_count,
-                "reply_count": row.reply_count
-            }
-            for row in result
-        ]
-
-def get_all_messages():
-    sql = """
-        SELECT
-            id,
-            date,
-            text,
-            media,
-            channel_name,
-            channel_url,
-            sender_id,
-            is_reply
+    result = await fetch_all(sql, name="get_channel_overview")
+    return [
+        {
+            "channel_name": str(row["channel_name"]) if row["channel_name"] is not None else "",
+            "message_count": row["message_count"],
+            "media_post_count": row["media_post_count"],
+            "reply_count": row["reply_count"]
+        }
+        for row in result
+    ]
+
+MESSAGE_COLUMNS = "id, date, text, media, channel_name, channel_url, sender_id, is_reply"
+
+def message_to_dict(row):
+    return {
+        "id": row["id"],
+        "date": str(row["date"]) if row["date"] is not None else "",
+        "text": row["text"] if row["text"] is not None else "",
+        "media": bool(row["media"]) if row["media"] is not None else False,
+        "channel_name": row["channel_name"] if row["channel_name"] is not None else "",
+        "channel_url": row["channel_url"] if row["channel_url"] is not None else "",
+        "sender_id": row["sender_id"] if row["sender_id"] is not None else None,
+        "is_reply": bool(row["is_reply"]) if row["is_reply"] is not None else False
+    }
+
+def _message_filters(channel_name=None, date_from=None, date_to=None):
+    # Rows without a date can't be placed on the (date, id) keyset and are left out.
+    filters = ["date IS NOT NULL"]
+    params = {}
+    if channel_name:
+        filters.append("channel_name = :channel_name")
+        params["channel_name"] = channel_name
+    if date_from:
+        filters.append("date >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        filters.append("date < :date_to")
+        params["date_to"] = date_to
+    return filters, params
+
+async def get_messages_page(limit: int = 1000, cursor: str | None = None, channel_name: str | None = None,
+                            date_from=None, date_to=None):
+    """One page of messages ordered by (date, id); returns (messages, next_cursor)."""
+    filters, params = _message_filters(channel_name, date_from, date_to)
+    if cursor:
+        cursor_date, cursor_id = decode_cursor(cursor, 2)
+        try:
+            params["cursor_date"], params["cursor_id"] = datetime.fromisoformat(cursor_date), int(cursor_id)
+        except (TypeError, ValueError) as e:
+            raise ValueError("Invalid cursor") from e
+        filters.append("(date, id) > (:cursor_date, :cursor_id)")
+    params["limit"] = limit + 1
+    sql = f"""
+        SELECT {MESSAGE_COLUMNS}
         FROM raw_telegram_messages
-        LIMIT 1000
+        WHERE {" AND ".join(filters)}
+        ORDER BY date, id
+        LIMIT :limit
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(sql)).mappings().fetchall()
-        return [
-            {
-                "id": row["id"],
-                "date": str(row["date"]) if row["date"] is not None else "",
-                "text": row["text"] if row["text"] is not None else "",
-                "media": bool(row["media"]) if row["media"] is not None else False,
-                "channel_name": row["channel_name"] if row["channel_name"] is not None else "",
-                "channel_url": row["channel_url"] if row["channel_url"] is not None else "",
-                "sender_id": row["sender_id"] if row["sender_id"] is not None else None,
-                "is_reply": bool(row["is_reply"]) if row["is_reply"] is not None else False
-            }
-            for row in result
-        ]
\ No newline at end of file
+    result = await fetch_all(sql, params, name="get_messages_page")
+    next_cursor = None
+    if len(result) > limit:
+        result = result[:limit]
+        next_cursor = encode_cursor(result[-1]["date"].isoformat(), result[-1]["id"])
+    return [message_to_dict(row) for row in result], next_cursor
+
+async def iter_messages(channel_name: str | None = None, date_from=None, date_to=None, batch_size: int = 5000):
+    """Yield every matching message in (date, id) order from a server-side cursor."""
+    filters, params = _message_filters(channel_name, date_from, date_to)
+    sql = f"""
+        SELECT {MESSAGE_COLUMNS}
+        FROM raw_telegram_messages
+        WHERE {" AND ".join(filters)}
+        ORDER BY date, id
+    """
+    async for row in stream_rows(sql, params, batch_size, name="iter_messages"):
+        yield message_to_dict(row)
@@ -1,6 +1,8 @@
 import os
+import psycopg2
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
 
 load_dotenv()
 PGUSER = os.getenv("POSTGRES_USER")
@@ -9,5 +11,66 @@ PGDB = os.getenv("POSTGRES_DB")
 PGHOST = os.getenv("POSTGRES_HOST", "localhost")
 PGPORT = os.getenv("POSTGRES_PORT", "5432")
 
-DATABASE_URL = f"postgresql+psycopg2://{PGUSER}:{PGPASS}@{PGHOST}:{PGPORT}/{PGDB}"
-engine = create_engine(DATABASE_URL)
\ No newline at end of file
+# Pool settings for the API engine; batch scripts pass their own.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))  # 0 disables
+# Serve the API through asyncpg instead of psycopg2 on the threadpool.
+DB_ASYNC = os.getenv("DB_ASYNC", "false").lower() in ("1", "true", "yes")
+
+def database_url(driver="psycopg2"):
+    # URL.create escapes credentials, so passwords may contain '@' or '/'.
+    return URL.create(
+        f"postgresql+{driver}",
+        username=PGUSER,
+        password=PGPASS,
+        host=PGHOST,
+        port=int(PGPORT),
+        database=PGDB,
+    )
+
+DATABASE_URL = database_url()
+
+def create_db_engine(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                     statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS, **kwargs):
+    return create_engine(
+        DATABASE_URL,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args={"options": f"-c statement_timeout={statement_timeout_ms}"},
+        **kwargs,
+    )
+
+def create_async_db_engine(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW,
+                           statement_timeout_ms=DB_STATEMENT_TIMEOUT_MS, **kwargs):
+    # Imported here so asyncpg is only needed when DB_ASYNC is enabled.
+    from sqlalchemy.ext.asyncio import create_async_engine
+    return create_async_engine(
+        database_url("asyncpg"),
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=True,
+        connect_args={"server_settings": {"statement_timeout": str(statement_timeout_ms)}},
+        **kwargs,
+    )
+
+def connect(statement_timeout_ms=0):
+    """Plain psycopg2 connection for batch jobs (COPY, migrations); no timeout by default."""
+    return psycopg2.connect(
+        dbname=PGDB,
+        user=PGUSER,
+        password=PGPASS,
+        host=PGHOST,
+        port=PGPORT,
+        options=f"-c statement_timeout={statement_timeout_ms}",
+    )
+
+engine = create_db_engine()
+async_engine = create_async_db_engine() if DB_ASYNC else None
@@ -0,0 +1,143 @@
+# Persistent YOLO detection cache keyed by image content.
+#
+# Detections are stored per (sha256 of the image bytes, model name, model
+# version), so byte-identical copies such as "photo_... (1).jpg" share one
+# entry and a new model only misses the entries it hasn't produced yet.
+# File hashes are remembered by (path, size, mtime), so files that haven't
+# changed since the last run are not read again. `emitted` remembers which
+# image content and model each detection output has been given, so a run
+# only writes out the images that are new to it.
+
+import os
+import json
+import sqlite3
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+CACHE_PATH = os.getenv("DETECTION_CACHE_PATH", "data/detection_cache.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    sha256 TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS detections (
+    sha256 TEXT NOT NULL,
+    model_name TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    detections TEXT NOT NULL,
+    created_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (sha256, model_name, model_version)
+);
+CREATE TABLE IF NOT EXISTS emitted (
+    output TEXT NOT NULL,
+    path TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    model_version TEXT NOT NULL,
+    PRIMARY KEY (output, path)
+);
+"""
+
+def sha256_file(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class DetectionCache:
+    def __init__(self, path=CACHE_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # WAL and a busy timeout let parallel partition runs share the cache file.
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def hash_files(self, paths, workers=4):
+        """Return {path: sha256} for the readable, non-empty files in `paths`."""
+        hashes = {}
+        stale = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if st.st_size == 0:
+                continue
+            row = self.conn.execute(
+                "SELECT sha256 FROM file_hashes WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, st.st_size, st.st_mtime_ns),
+            ).fetchone()
+            if row:
+                hashes[path] = row[0]
+            else:
+                stale.append((path, st))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            digests = pool.map(lambda item: sha256_file(item[0]), stale)
+            for (path, st), digest in zip(stale, digests):
+                hashes[path] = digest
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO file_hashes (path, size, mtime_ns, sha256) VALUES (?, ?, ?, ?)",
+                    (path, st.st_size, st.st_mtime_ns, digest),
+                )
+        self.conn.commit()
+        return hashes
+
+    def get_many(self, hashes, model_name, model_version):
+        found = {}
+        hashes = list(hashes)
+        for start in range(0, len(hashes), 500):  # stay under SQLite's bound-parameter limit
+            chunk = hashes[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT sha256, detections FROM detections WHERE model_name = ? AND model_version = ? "
+                f"AND sha256 IN ({', '.join('?' * len(chunk))})",
+                [model_name, model_version, *chunk],
+            )
+            for digest, payload in rows:
+                found[digest] = json.loads(payload)
+        return found
+
+    def put(self, digest, model_name, model_version, detections):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO detections (sha256, model_name, model_version, detections) VALUES (?, ?, ?, ?)",
+            (digest, model_name, model_version, json.dumps(detections)),
+        )
+
+    def unemitted(self, output, hashes, model_version):
+        """Paths of `hashes` ({path: sha256}) whose detections `output` hasn't been given yet."""
+        pending = []
+        for path, digest in hashes.items():
+            row = self.conn.execute(
+                "SELECT 1 FROM emitted WHERE output = ? AND path = ? AND sha256 = ? AND model_version = ?",
+                (output, path, digest, model_version),
+            ).fetchone()
+            if row is None:
+                pending.append(path)
+        return pending
+
+    def mark_emitted(self, output, hashes, model_version):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO emitted (output, path, sha256, model_version) VALUES (?, ?, ?, ?)",
+            [(output, path, digest, model_version) for path, digest in hashes.items()],
+        )
+        self.conn.commit()
+
+    def commit(self):
+        self.conn.commit()
+
+    def prune(self, model_name, model_version):
+        """Drop entries of other models and hashes of deleted files; returns detections removed."""
+        cur = self.conn.execute(
+            "DELETE FROM detections WHERE NOT (model_name = ? AND model_version = ?)",
+            (model_name, model_version),
+        )
+        gone = [(path,) for (path,) in self.conn.execute("SELECT path FROM file_hashes") if not os.path.exists(path)]
+        self.conn.executemany("DELETE FROM file_hashes WHERE path = ?", gone)
+        self.conn.executemany("DELETE FROM emitted WHERE path = ?", gone)
+        self.conn.commit()
+        return cur.rowcount
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,259 @@
+# Postgres job queue feeding continuous YOLO workers.
+#
+# The scraper and the backfill enqueue every photo they link into a message
+# partition (one detection_jobs row per media path) and NOTIFY the workers.
+# Each worker process claims a batch with FOR UPDATE SKIP LOCKED, so workers
+# never wait on each other, runs the detector on it and commits the batch's
+# detections together with the jobs' completion. A failed job is retried with
+# exponential backoff; after MAX_ATTEMPTS it is parked as 'dead' until
+# requeued. A job whose worker died is reclaimed once its lease runs out.
+#
+#   python -m src.detection_queue work --workers 4
+#   python -m src.detection_queue enqueue-manifest   # queue everything in the media manifest
+#   python -m src.detection_queue status
+#   python -m src.detection_queue requeue-dead
+
+import os
+import time
+import socket
+import select
+import logging
+import argparse
+import multiprocessing
+import psycopg2
+from .database import connect
+from .migrate import apply_migrations
+from .load_image_detections import detection_records, upsert_detections
+from .media_store import MANIFEST_PATH, MediaStore
+from .cache import invalidate as invalidate_cache
+from .inference_backend import BACKEND, model_path
+
+JOBS_TABLE = "detection_jobs"
+CHANNEL = "detection_jobs"  # LISTEN/NOTIFY channel
+QUEUE_BATCH_SIZE = int(os.getenv("DETECTION_QUEUE_BATCH_SIZE", "16"))
+QUEUE_WORKERS = int(os.getenv("DETECTION_QUEUE_WORKERS", "2"))
+MAX_ATTEMPTS = int(os.getenv("DETECTION_QUEUE_MAX_ATTEMPTS", "5"))
+RETRY_DELAY_SECONDS = 30  # doubled after every failed attempt
+LEASE_SECONDS = int(os.getenv("DETECTION_QUEUE_LEASE_SECONDS", "600"))
+POLL_SECONDS = 30  # wait between polls when no NOTIFY arrives
+
+ENQUEUE_SQL = f"""
+    INSERT INTO {JOBS_TABLE} (channel_name, message_id, media_path)
+    SELECT * FROM unnest(%s::text[], %s::bigint[], %s::text[])
+    ON CONFLICT (media_path) DO NOTHING
+"""
+
+# Jobs still 'running' after their lease belong to a worker that died.
+RECLAIM_SQL = f"""
+    UPDATE {JOBS_TABLE}
+    SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'dead' ELSE 'pending' END,
+        last_error = 'lease expired', locked_by = NULL, available_at = now()
+    WHERE status = 'running' AND locked_at < now() - make_interval(secs => %(lease)s)
+"""
+
+CLAIM_SQL = f"""
+    UPDATE {JOBS_TABLE} j
+    SET status = 'running', attempts = j.attempts + 1, locked_by = %(worker)s, locked_at = now()
+    FROM (
+        SELECT id FROM {JOBS_TABLE}
+        WHERE status = 'pending' AND available_at <= now()
+        ORDER BY available_at, id
+        LIMIT %(limit)s
+        FOR UPDATE SKIP LOCKED
+    ) claimed
+    WHERE j.id = claimed.id
+    RETURNING j.id, j.message_id, j.media_path
+"""
+
+FAIL_SQL = f"""
+    UPDATE {JOBS_TABLE}
+    SET status = CASE WHEN attempts >= %(max_attempts)s THEN 'dead' ELSE 'pending' END,
+        available_at = now() + make_interval(secs => %(delay)s * power(2, attempts - 1)),
+        last_error = %(error)s, locked_by = NULL
+    WHERE id = ANY(%(ids)s)
+"""
+
+def enqueue(conn, items):
+    """Queue (channel_name, message_id, media_path) items; returns how many were new."""
+    items = list(items)
+    if not items:
+        return 0
+    with conn.cursor() as cur:
+        cur.execute(ENQUEUE_SQL, tuple(list(column) for column in zip(*items)))
+        added = cur.rowcount
+        if added:
+            cur.execute(f"NOTIFY {CHANNEL}")
+    conn.commit()
+    return added
+
+def enqueue_media(items):
+    # Called by the scrapers. The photos are already in the media manifest,
+    # so a database hiccup only delays detection: enqueue-manifest catches up.
+    items = list(items)
+    if not items:
+        return 0
+    try:
+        conn = connect()
+        try:
+            apply_migrations(conn)
+            return enqueue(conn, items)
+        finally:
+            conn.close()
+    except psycopg2.Error as e:
+        logging.warning(f"Could not queue {len(items)} images for detection ({e}); "
+                        f"run `python -m src.detection_queue enqueue-manifest` later")
+        return 0
+
+def enqueue_manifest(conn, manifest_path=MANIFEST_PATH):
+    store = MediaStore(manifest_path)
+    try:
+        items = [(channel, message_id, path) for _, channel, message_id, _, path in store.iter_message_media()]
+    finally:
+        store.close()
+    return enqueue(conn, items)
+
+def claim(conn, worker, limit):
+    with conn.cursor() as cur:
+        cur.execute(RECLAIM_SQL, {"max_attempts": MAX_ATTEMPTS, "lease": LEASE_SECONDS})
+        cur.execute(CLAIM_SQL, {"worker": worker, "limit": limit})
+        jobs = cur.fetchall()
+    conn.commit()
+    return jobs
+
+def complete(conn, jobs, found):
+    """Upsert the detections of the jobs' images and mark the jobs done, in one transaction."""
+    records = [
+        record
+        for _, message_id, path in jobs
+        for record in detection_records(message_id, path, found[path])
+    ]
+    with conn.cursor() as cur:
+        upsert_detections(cur, records, [path for _, _, path in jobs])
+        cur.execute(
+            f"UPDATE {JOBS_TABLE} SET status = 'done', finished_at = now(), last_error = NULL, locked_by = NULL "
+            f"WHERE id = ANY(%s)",
+            ([job_id for job_id, _, _ in jobs],),
+        )
+    conn.commit()
+    return len(records)
+
+def fail(conn, jobs, error):
+    with conn.cursor() as cur:
+        cur.execute(FAIL_SQL, {"max_attempts": MAX_ATTEMPTS, "delay": RETRY_DELAY_SECONDS,
+                               "error": error[:1000], "ids": [job_id for job_id, _, _ in jobs]})
+    conn.commit()
+
+def process(conn, jobs, detect):
+    # Returns (jobs done, detections written). A batch that raises is retried
+    # one job at a time, so a single bad image doesn't fail its neighbours.
+    try:
+        found = detect([path for _, _, path in jobs])
+    except Exception as e:
+        if len(jobs) > 1:
+            results = [process(conn, [job], detect) for job in jobs]
+            return sum(r[0] for r in results), sum(r[1] for r in results)
+        logging.error(f"Detection failed for {jobs[0][2]}: {e}")
+        fail(conn, jobs, repr(e))
+        return 0, 0
+    missing = [job for job in jobs if job[2] not in found]
+    if missing:
+        fail(conn, missing, "missing or unreadable image")
+    done = [job for job in jobs if job[2] in found]
+    return len(done), complete(conn, done, found) if done else 0
+
+def wait_for_jobs(conn, timeout=POLL_SECONDS):
+    if select.select([conn], [], [], timeout)[0]:
+        conn.poll()
+        conn.notifies.clear()
+
+def run_worker(worker_no=0, batch_size=QUEUE_BATCH_SIZE, threads=None, save_detected=True, until_empty=False):
+    """Claim and process batches until stopped (or, with until_empty, until the queue is drained)."""
+    # Imported here: only worker processes load the model.
+    from .yolo_detection import detect_files, get_model, get_model_key
+    from .detection_cache import DetectionCache
+    get_model(threads)
+    worker = f"{socket.gethostname()}:{os.getpid()}"
+    model_key = get_model_key()
+    cache = DetectionCache()
+    conn = connect()
+    with conn.cursor() as cur:
+        cur.execute(f"LISTEN {CHANNEL}")
+    conn.commit()
+
+    def detect(paths):
+        return detect_files(paths, cache, model_key, save_detected=save_detected)
+
+    total = 0
+    try:
+        while True:
+            jobs = claim(conn, worker, batch_size)
+            if not jobs:
+                if until_empty:
+                    break
+                wait_for_jobs(conn)
+                continue
+            started = time.perf_counter()
+            done, detections = process(conn, jobs, detect)
+            total += done
+            if detections:
+                invalidate_cache()
+            print(f"[worker {worker_no}] {done}/{len(jobs)} images, {detections} detections "
+                  f"in {time.perf_counter() - started:.2f}s ({total} so far)")
+    finally:
+        cache.close()
+        conn.close()
+    return total
+
+def run_pool(workers=QUEUE_WORKERS, batch_size=QUEUE_BATCH_SIZE, save_detected=True, until_empty=False):
+    # One process per worker, splitting the cores between their inference threads.
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    if BACKEND != "torch":
+        model_path()  # export once, before the workers load it
+    ctx = multiprocessing.get_context("spawn")
+    procs = [
+        ctx.Process(target=run_worker, args=(i, batch_size, threads, save_detected, until_empty))
+        for i in range(workers)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    return [p.exitcode for p in procs]
+
+def queue_status(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT status, COUNT(*) FROM {JOBS_TABLE} GROUP BY status ORDER BY status")
+        return dict(cur.fetchall())
+
+def requeue_dead(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"UPDATE {JOBS_TABLE} SET status = 'pending', attempts = 0, available_at = now() "
+                    f"WHERE status = 'dead'")
+        count = cur.rowcount
+        if count:
+            cur.execute(f"NOTIFY {CHANNEL}")
+    conn.commit()
+    return count
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="YOLO detection job queue.")
+    parser.add_argument("command", choices=["work", "enqueue-manifest", "status", "requeue-dead"])
+    parser.add_argument("--workers", type=int, default=QUEUE_WORKERS, help="worker processes")
+    parser.add_argument("--batch-size", type=int, default=QUEUE_BATCH_SIZE, help="jobs claimed at a time")
+    parser.add_argument("--no-save", action="store_true", help="don't write annotated images")
+    parser.add_argument("--until-empty", action="store_true", help="exit once the queue is drained")
+    args = parser.parse_args()
+    conn = connect()
+    try:
+        apply_migrations(conn)
+        if args.command == "enqueue-manifest":
+            print(f"Queued {enqueue_manifest(conn)} new images")
+        elif args.command == "requeue-dead":
+            print(f"Requeued {requeue_dead(conn)} dead jobs")
+        elif args.command == "status":
+            print(queue_status(conn))
+    finally:
+        conn.close()
+    if args.command == "work":
+        if any(run_pool(args.workers, args.batch_size, not args.no_save, args.until_empty)):
+            raise SystemExit("A detection worker exited with an error")
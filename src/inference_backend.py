@@ -0,0 +1,284 @@
+# CPU inference backends for the YOLO detector.
+#
+# YOLO_BACKEND picks how the weights are run: "torch" (PyTorch eager, the
+# reference), "onnx" (ONNX Runtime) or "openvino". YOLO_INT8=true quantizes the
+# exported model: OpenVINO through NNCF post-training quantization calibrated
+# on YOLO_INT8_DATA, ONNX with onnxruntime's dynamic weight quantization.
+# Exports are made once and kept in data/models under a name carrying the
+# weights hash, backend, precision and image size, so a new checkpoint or
+# setting gets its own export. Models are exported with a dynamic batch axis
+# because the detector feeds whole batches.
+#
+# An exported model must agree with the PyTorch one within TOLERANCE: the
+# benchmark below checks it on the sample images alongside latency and
+# throughput.
+#
+#   python -m src.inference_backend export --backend openvino --int8
+#   python -m src.inference_backend benchmark --backends torch onnx openvino --int8 --max-images 64
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+
+BACKENDS = ("torch", "onnx", "openvino")
+MODEL_WEIGHTS = os.getenv("YOLO_WEIGHTS", "yolov8n.pt")
+BACKEND = os.getenv("YOLO_BACKEND", "torch")
+INT8 = os.getenv("YOLO_INT8", "false").lower() == "true"
+INT8_DATA = os.getenv("YOLO_INT8_DATA", "coco8.yaml")  # calibration set for OpenVINO INT8
+MODELS_DIR = os.getenv("YOLO_MODELS_DIR", "data/models")
+IMG_SIZE = 640
+CONF_THRESHOLD = 0.25  # ultralytics' default, used by every backend
+
+# How far an exported model may drift from PyTorch eager on the same images.
+# Boxes are paired by class and IoU >= MATCH_IOU. Every box scoring at least
+# CONF_THRESHOLD + max_conf_delta on one side must have a partner on the other
+# (weaker boxes may legitimately fall under the threshold), for at least
+# min_agreement of those boxes, and paired confidences may differ by at most
+# max_conf_delta.
+MATCH_IOU = 0.5
+TOLERANCE = {
+    "fp32": {"min_agreement": 0.99, "max_conf_delta": 0.02},
+    "int8": {"min_agreement": 0.90, "max_conf_delta": 0.10},
+}
+
+def check_backend(backend, int8=False):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown YOLO backend {backend!r}; expected one of {', '.join(BACKENDS)}")
+    if int8 and backend == "torch":
+        raise ValueError("INT8 needs an exported backend (onnx or openvino)")
+
+def backend_tag(backend=BACKEND, int8=INT8):
+    return f"{backend}-int8" if int8 else backend
+
+def export_path(weights_hash, backend, int8=INT8, imgsz=IMG_SIZE, weights=MODEL_WEIGHTS):
+    stem = os.path.splitext(os.path.basename(weights))[0]
+    name = f"{stem}-{weights_hash}-{backend_tag(backend, int8)}-{imgsz}"
+    return os.path.join(MODELS_DIR, name + (".onnx" if backend == "onnx" else "_openvino_model"))
+
+def quantize_onnx(src, dst):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    import onnx
+    quantize_dynamic(src, dst, weight_type=QuantType.QUInt8)
+    # ultralytics reads the class names and image size from the model metadata.
+    quantized, original = onnx.load(dst), onnx.load(src)
+    del quantized.metadata_props[:]
+    quantized.metadata_props.extend(original.metadata_props)
+    onnx.save(quantized, dst)
+
+def export_model(weights, weights_hash, backend, int8=INT8, imgsz=IMG_SIZE):
+    """Path of the exported model, exporting it first if it isn't in MODELS_DIR yet."""
+    from ultralytics import YOLO
+    target = export_path(weights_hash, backend, int8, imgsz, weights)
+    if os.path.exists(target):
+        return target
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    # Export next to a private copy of the weights (ultralytics writes beside
+    # them) and rename into place, so concurrent workers never see half a model.
+    with tempfile.TemporaryDirectory(dir=MODELS_DIR) as tmp:
+        local = shutil.copy(weights, tmp)
+        kwargs = {"format": backend, "imgsz": imgsz, "dynamic": True}
+        if backend == "openvino" and int8:
+            kwargs.update(int8=True, data=INT8_DATA)
+        exported = YOLO(local).export(**kwargs)
+        if backend == "onnx" and int8:
+            quantized = os.path.join(tmp, "quantized.onnx")
+            quantize_onnx(exported, quantized)
+            exported = quantized
+        try:
+            os.rename(exported, target)
+        except OSError:
+            if not os.path.exists(target):
+                raise
+    return target
+
+def model_path(backend=BACKEND, int8=INT8, weights=MODEL_WEIGHTS, imgsz=IMG_SIZE):
+    """File the backend loads: the weights themselves for torch, otherwise their export."""
+    from ultralytics import YOLO
+    from .detection_cache import sha256_file
+    check_backend(backend, int8)
+    if backend == "torch":
+        return weights
+    if not os.path.exists(weights):
+        weights = YOLO(weights).ckpt_path  # downloads the official checkpoints
+    return export_model(weights, sha256_file(weights)[:12], backend, int8, imgsz)
+
+def limit_threads(model, backend, path, threads, imgsz=IMG_SIZE):
+    # ultralytics runs pre- and post-processing (and the torch backend) in
+    # torch, but creates the ONNX Runtime session or OpenVINO compiled model
+    # on the first predict with the runtime's default of one thread per core.
+    # Warm the model up, then rebuild that with the runtime's own setting.
+    import numpy as np
+    import torch
+    torch.set_num_threads(threads)
+    if backend == "torch":
+        return
+    model.predict(np.zeros((imgsz, imgsz, 3), dtype=np.uint8), imgsz=imgsz, verbose=False)
+    runtime = model.predictor.model  # ultralytics' AutoBackend
+    if backend == "onnx":
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        runtime.session = onnxruntime.InferenceSession(path, options, providers=runtime.session.get_providers())
+    else:
+        import openvino as ov
+        core = ov.Core()
+        xml = next(f for f in sorted(os.listdir(path)) if f.endswith(".xml"))
+        hint = "THROUGHPUT" if "THROUGHPUT" in runtime.inference_mode else "LATENCY"
+        runtime.ov_compiled_model = core.compile_model(
+            core.read_model(os.path.join(path, xml)), "CPU",
+            {"PERFORMANCE_HINT": hint, "INFERENCE_NUM_THREADS": threads},
+        )
+
+def load_model(backend=BACKEND, int8=INT8, weights=MODEL_WEIGHTS, imgsz=IMG_SIZE, threads=None):
+    """Load the detector for `backend`, exporting the weights on first use.
+
+    `threads` caps the CPU threads inference uses, through the backend's own
+    setting: torch's intra-op pool, ONNX Runtime's intra_op_num_threads or
+    OpenVINO's INFERENCE_NUM_THREADS.
+    """
+    from ultralytics import YOLO
+    path = model_path(backend, int8, weights, imgsz)
+    model = YOLO(path) if backend == "torch" else YOLO(path, task="detect")
+    if threads:
+        limit_threads(model, backend, path, threads, imgsz)
+    return model
+
+def boxes_of(result):
+    """(class, confidence, xyxy) per box of an ultralytics result."""
+    b = result.boxes
+    return list(zip(map(int, b.cls.tolist()), b.conf.tolist(), b.xyxy.tolist()))
+
+def iou(a, b):
+    w = min(a[2], b[2]) - max(a[0], b[0])
+    h = min(a[3], b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / ((a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter)
+
+def match_boxes(reference, candidate):
+    # Greedy pairing, strongest reference boxes first: [(ref index, cand index)].
+    pairs, used = [], set()
+    for i in sorted(range(len(reference)), key=lambda i: -reference[i][1]):
+        cls, _, box = reference[i]
+        best, best_iou = None, MATCH_IOU
+        for j, (c_cls, _, c_box) in enumerate(candidate):
+            if j not in used and c_cls == cls:
+                overlap = iou(box, c_box)
+                if overlap >= best_iou:
+                    best, best_iou = j, overlap
+        if best is not None:
+            used.add(best)
+            pairs.append((i, best))
+    return pairs
+
+def compare(reference, candidate, int8=False):
+    """Agreement of a backend's boxes with the reference's, image by image, against TOLERANCE."""
+    tolerance = TOLERANCE["int8" if int8 else "fp32"]
+    floor = CONF_THRESHOLD + tolerance["max_conf_delta"]
+    required = found = 0
+    max_delta = 0.0
+    for ref, cand in zip(reference, candidate):
+        pairs = match_boxes(ref, cand)
+        paired_ref, paired_cand = {i for i, _ in pairs}, {j for _, j in pairs}
+        for boxes, paired in ((ref, paired_ref), (cand, paired_cand)):
+            strong = [k for k, (_, conf, _) in enumerate(boxes) if conf >= floor]
+            required += len(strong)
+            found += sum(k in paired for k in strong)
+        for i, j in pairs:
+            max_delta = max(max_delta, abs(ref[i][1] - cand[j][1]))
+    agreement = found / required if required else 1.0
+    return {
+        "agreement": round(agreement, 4),
+        "max_conf_delta": round(max_delta, 4),
+        "within_tolerance": agreement >= tolerance["min_agreement"] and max_delta <= tolerance["max_conf_delta"],
+    }
+
+def benchmark_backend(backend, int8, images, batch_size, latency_images):
+    """Load/export time, single-image latency and batch throughput on letterboxed `images`."""
+    started = time.perf_counter()
+    model = load_model(backend, int8)
+    load_seconds = time.perf_counter() - started
+    model.predict(images[:1], imgsz=IMG_SIZE, verbose=False)  # warm-up
+
+    latencies = []
+    for img in images[:latency_images]:
+        t = time.perf_counter()
+        model.predict([img], imgsz=IMG_SIZE, verbose=False)
+        latencies.append((time.perf_counter() - t) * 1000)
+
+    results = []
+    started = time.perf_counter()
+    for i in range(0, len(images), batch_size):
+        results.extend(model.predict(images[i:i + batch_size], imgsz=IMG_SIZE, verbose=False))
+    seconds = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "backend": backend_tag(backend, int8),
+        "load_seconds": round(load_seconds, 2),
+        "latency_ms_p50": round(statistics.median(latencies), 1),
+        "latency_ms_p95": round(latencies[int(0.95 * (len(latencies) - 1))], 1),
+        "images_per_second": round(len(images) / seconds, 1),
+    }, [boxes_of(r) for r in results]
+
+def run_benchmark(backends, int8=False, media_dir="media", max_images=64, batch_size=16, latency_images=32):
+    from .yolo_detection import iter_image_paths, load_image
+    from .media_store import PHOTOS_DIR
+    paths = list(iter_image_paths(media_dir, exclude_dirs=[os.path.join(media_dir, "detected"), PHOTOS_DIR]))
+    images = [item[1] for item in map(load_image, paths[:max_images]) if item is not None]
+    if not images:
+        raise SystemExit(f"No readable images under {media_dir}")
+    variants = [(b, False) for b in backends]
+    if int8:
+        variants += [(b, True) for b in backends if b != "torch"]
+    if ("torch", False) in variants:
+        variants.remove(("torch", False))
+    variants.insert(0, ("torch", False))  # the reference the others are compared with
+
+    rows, reference = [], None
+    for backend, quantized in variants:
+        row, boxes = benchmark_backend(backend, quantized, images, batch_size, latency_images)
+        if reference is None:
+            reference = boxes
+        else:
+            row.update(compare(reference, boxes, quantized))
+        rows.append(row)
+        print(json.dumps(row))
+    print(f"\n{len(images)} images, batch size {batch_size}, {os.cpu_count()} CPUs")
+    print(f"{'backend':<16}{'load s':>8}{'p50 ms':>9}{'p95 ms':>9}{'img/s':>8}{'agree':>8}{'max dconf':>11}")
+    for row in rows:
+        print(f"{row['backend']:<16}{row['load_seconds']:>8}{row['latency_ms_p50']:>9}{row['latency_ms_p95']:>9}"
+              f"{row['images_per_second']:>8}{row.get('agreement', '-'):>8}{row.get('max_conf_delta', '-'):>11}")
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and benchmark YOLO CPU inference backends.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    export = sub.add_parser("export", help="export the weights for a backend")
+    export.add_argument("--backend", choices=BACKENDS[1:], default=BACKEND if BACKEND != "torch" else "onnx")
+    export.add_argument("--int8", action="store_true", default=INT8)
+    bench = sub.add_parser("benchmark", help="compare latency, throughput and agreement per backend")
+    bench.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    bench.add_argument("--int8", action="store_true", help="also benchmark INT8 exports")
+    bench.add_argument("--media-dir", default="media")
+    bench.add_argument("--max-images", type=int, default=64)
+    bench.add_argument("--batch-size", type=int, default=16)
+    bench.add_argument("--latency-images", type=int, default=32, help="images timed one at a time")
+    bench.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+    if args.command == "export":
+        print(model_path(args.backend, args.int8))
+    else:
+        rows = run_benchmark(args.backends, args.int8, args.media_dir, args.max_images,
+                             args.batch_size, args.latency_images)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(rows, f, indent=2)
+        if not all(row.get("within_tolerance", True) for row in rows):
+            sys.exit("A backend drifted from PyTorch beyond TOLERANCE")
@@ -1,17 +1,7 @@
 import pandas as pd
-import psycopg2
-from sqlalchemy import create_engine
-import os
-from dotenv import load_dotenv
+from .database import create_db_engine
 
-load_dotenv()
-PGUSER = os.getenv("POSTGRES_USER")
-PGPASS = os.getenv("POSTGRES_PASSWORD")
-PGDB = os.getenv("POSTGRES_DB")
-PGHOST = os.getenv("POSTGRES_HOST", "localhost")
-PGPORT = os.getenv("POSTGRES_PORT", "5432")
-
-engine = create_engine(f"postgresql+psycopg2://{PGUSER}:{PGPASS}@{PGHOST}:{PGPORT}/{PGDB}")
+engine = create_db_engine(pool_size=1, max_overflow=0, statement_timeout_ms=0)
 
 # Load channels.csv into channels table
 def load_channels():
@@ -1,16 +1,243 @@
-import pandas as pd
-import sqlalchemy
+# Loads YOLO detection files (src/yolo_detection.py's output) into image_detections.
+#
+# Records are streamed from the file in chunks of DETECTION_CHUNK_ROWS; each
+# chunk is COPYed into a temp staging table and upserted on the table's key,
+# (media_path, detected_object_class, box), the box being the detection's
+# corners in the original image. Rows that haven't changed are left alone,
+# and an image's rows that its current detections no longer have are deleted,
+# so reloading a file never duplicates a detection. The detection_queue
+# workers write through upsert_detections() as well.
+#
+# Each detection run writes a new file holding only the images that are new
+# to its output directory (see yolo_detection.py), and files are recorded in
+# load_manifest by path and checksum, so a run loads just the detections
+# produced since the last one. An image without detections is listed as one
+# record without a class, so its old rows are still cleared. Media paths are
+# normalized to the media store's relative, '/'-separated form, which
+# message_media (and fct_image_detections' join) use. Records without a box
+# (files written before boxes were stored) can't be keyed and are skipped.
+#
+# --from-parquet loads the detections dataset of the Parquet lake instead.
+# Each detection run replaces a lake partition's part files, so a partition
+# is loaded as a whole and recorded in load_manifest under its directory,
+# with a checksum over its files.
+#
+#   python -m src.load_image_detections                            # every file under data/image_detections
+#   python -m src.load_image_detections data/image_detections.json # other files or directories
+#   python -m src.load_image_detections --from-parquet --day-from 2025-07-01
+
 import os
-from dotenv import load_dotenv
+import time
+import hashlib
+import logging
+import argparse
+import posixpath
+from .database import connect
+from .raw_store import iter_file
+from .parquet_lake import iter_file_batches, iter_files as iter_lake_files, require_pyarrow
+from .migrate import apply_migrations
+from .load_to_postgres import copy_records, file_checksum, is_loaded, record_loaded
+from .cache import invalidate as invalidate_cache
+from .metrics import observe_stage
+
+DETECTIONS_TABLE = "image_detections"
+DETECTIONS_STAGE_TABLE = "stage_image_detections"
+BOX_COLUMNS = ["box_x1", "box_y1", "box_x2", "box_y2"]
+KEY_COLUMNS = ["media_path", "detected_object_class", *BOX_COLUMNS]
+DETECTION_COLUMNS = [*KEY_COLUMNS, "message_id", "confidence_score"]
+DETECTIONS_DIR = "data/image_detections"
+DETECTION_CHUNK_ROWS = 10000  # records per COPY and upsert
+
+_key_list = ", ".join(KEY_COLUMNS)
+_update_columns = ["message_id", "confidence_score"]
+
+# DISTINCT ON: a file listing an image twice keeps the last copy.
+UPSERT_SQL = f"""
+    INSERT INTO {DETECTIONS_TABLE} ({", ".join(DETECTION_COLUMNS)})
+    SELECT DISTINCT ON ({_key_list}) {", ".join(DETECTION_COLUMNS)}
+    FROM {DETECTIONS_STAGE_TABLE}
+    ORDER BY {_key_list}, ctid DESC
+    ON CONFLICT ({_key_list}) DO UPDATE SET
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in _update_columns)}
+    WHERE ({", ".join(f"{DETECTIONS_TABLE}.{c}" for c in _update_columns)})
+        IS DISTINCT FROM ({", ".join(f"EXCLUDED.{c}" for c in _update_columns)})
+"""
+
+# Detections the images' latest results no longer have.
+DELETE_STALE_SQL = f"""
+    DELETE FROM {DETECTIONS_TABLE} d
+    WHERE d.media_path = ANY(%s)
+      AND NOT EXISTS (
+          SELECT 1 FROM {DETECTIONS_STAGE_TABLE} s
+          WHERE {" AND ".join(f"s.{c} = d.{c}" for c in KEY_COLUMNS)}
+      )
+"""
+
+def normalize_media_path(path):
+    """'media\\2025-01-01\\chan\\1.jpg' or './media/...' -> 'media/2025-01-01/chan/1.jpg'."""
+    return posixpath.normpath(path.replace("\\", "/"))
+
+def detection_records(message_id, media_path, detections):
+    """Rows of one image's detections (dicts with the class, confidence and box columns)."""
+    media_path = normalize_media_path(media_path)
+    return [{"message_id": message_id, "media_path": media_path, **detection} for detection in detections]
+
+def upsert_detections(cur, records, paths):
+    """Make `records` the detections of the images in `paths`; returns (rows copied, rows changed).
+
+    `paths` lists every image whose complete detections are in `records`,
+    including images without any. Runs in the caller's transaction.
+    """
+    cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {DETECTIONS_STAGE_TABLE} "
+                f"(LIKE {DETECTIONS_TABLE} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+    copied = copy_records(cur, records, DETECTIONS_STAGE_TABLE, DETECTION_COLUMNS)
+    changed = 0
+    if copied:
+        cur.execute(UPSERT_SQL)
+        changed = cur.rowcount
+    cur.execute(DELETE_STALE_SQL, ([normalize_media_path(p) for p in paths],))
+    return copied, changed + cur.rowcount
+
+def message_id_of(value):
+    # Older files carried Telethon's photo_<timestamp> file names here.
+    if isinstance(value, int) or (isinstance(value, str) and value.isdigit()):
+        return int(value)
+    return None
+
+def iter_keyed_records(records, source):
+    # Records list each image's detections together.
+    unkeyed = 0
+    for record in records:
+        if record.get("detected_object_class") is None:
+            yield {"message_id": None, "media_path": normalize_media_path(record["media_path"]),
+                   "detected_object_class": None}
+            continue
+        if any(record.get(c) is None for c in BOX_COLUMNS):
+            unkeyed += 1
+            continue
+        yield {
+            "message_id": message_id_of(record.get("message_id")),
+            "media_path": normalize_media_path(record["media_path"]),
+            "detected_object_class": record["detected_object_class"],
+            "confidence_score": record["confidence_score"],
+            **{c: record[c] for c in BOX_COLUMNS},
+        }
+    if unkeyed:
+        logging.warning(f"{source}: skipped {unkeyed} detections without a box; "
+                        f"re-run `python -m src.yolo_detection` to detect their images again")
+
+def iter_file_records(path):
+    return iter_keyed_records(iter_file(path), path)
+
+def iter_lake_records(files):
+    for batch in iter_file_batches("detections", files, columns=DETECTION_COLUMNS,
+                                   batch_size=DETECTION_CHUNK_ROWS):
+        yield from batch.to_pylist()
+
+def iter_chunks(records, chunk_rows=DETECTION_CHUNK_ROWS):
+    # Chunks end between images, so an image's rows are upserted together.
+    chunk = []
+    for record in records:
+        if len(chunk) >= chunk_rows and record["media_path"] != chunk[-1]["media_path"]:
+            yield chunk
+            chunk = []
+        chunk.append(record)
+    if chunk:
+        yield chunk
+
+def load_records(conn, path, checksum, records, chunk_rows=DETECTION_CHUNK_ROWS):
+    """Upsert keyed records under a manifest entry; returns (rows read, rows changed), or None if unchanged."""
+    with conn.cursor() as cur:
+        if is_loaded(cur, path, checksum, target=DETECTIONS_TABLE):
+            conn.rollback()
+            return None
+    rows = changed = 0
+    for chunk in iter_chunks(records, chunk_rows):
+        with conn.cursor() as cur:
+            detections = [r for r in chunk if r["detected_object_class"] is not None]
+            copied, chunk_changed = upsert_detections(cur, detections, {r["media_path"] for r in chunk})
+        conn.commit()
+        rows += copied
+        changed += chunk_changed
+    # Recorded once everything is in; an interrupted load starts over, which is harmless.
+    with conn.cursor() as cur:
+        record_loaded(cur, path, checksum, rows, target=DETECTIONS_TABLE)
+    conn.commit()
+    return rows, changed
+
+def load_detection_file(conn, path, chunk_rows=DETECTION_CHUNK_ROWS):
+    """Upsert one detections file; returns (rows read, rows changed), or None if unchanged."""
+    return load_records(conn, path, file_checksum(path), iter_file_records(path), chunk_rows)
+
+def load_parquet_partition(conn, part_dir, files, chunk_rows=DETECTION_CHUNK_ROWS):
+    """Upsert one lake partition from its part files; returns (rows read, rows changed), or None if unchanged."""
+    digest = hashlib.sha256()
+    for path in files:
+        digest.update(f"{os.path.basename(path)} {file_checksum(path)}\n".encode())
+    records = iter_keyed_records(iter_lake_records(files), part_dir)
+    return load_records(conn, part_dir, digest.hexdigest(), records, chunk_rows)
+
+def iter_detection_files(paths):
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path.replace(os.sep, "/")
+            continue
+        for full_dir, dirs, files in os.walk(path):
+            dirs.sort()
+            for file in sorted(files):
+                if file.endswith((".json", ".ndjson")):
+                    yield os.path.join(full_dir, file).replace(os.sep, "/")
+
+def load_paths(conn, sources, load):
+    # sources: (path, *args) tuples; load(conn, path, *args) loads one of them.
+    started = time.perf_counter()
+    totals = {"files": 0, "skipped": 0, "rows": 0, "changed": 0}
+    for path, *args in sources:
+        result = load(conn, path, *args)
+        if result is None:
+            totals["skipped"] += 1
+            continue
+        rows, changed = result
+        totals["files"] += 1
+        totals["rows"] += rows
+        totals["changed"] += changed
+        print(f"Loaded {path}: {rows} detections ({changed} new/changed)")
+    if totals["changed"]:
+        invalidate_cache()
+    totals.update(observe_stage("detections", time.perf_counter() - started,
+                                rows=totals["rows"], files=totals["files"]))
+    return totals
 
-load_dotenv()
-PGUSER = os.getenv("POSTGRES_USER")
-PGPASS = os.getenv("POSTGRES_PASSWORD")
-PGDB = os.getenv("POSTGRES_DB")
-PGHOST = os.getenv("POSTGRES_HOST", "localhost")
-PGPORT = os.getenv("POSTGRES_PORT", "5432")
+def load_image_detections(conn, paths=(DETECTIONS_DIR,)):
+    """Load detection files (or directories of them); returns run totals."""
+    apply_migrations(conn)
+    files = [(path,) for path in iter_detection_files(paths) if os.path.exists(path)]
+    return load_paths(conn, files, load_detection_file)
 
-engine = sqlalchemy.create_engine(f"postgresql+psycopg2://{PGUSER}:{PGPASS}@{PGHOST}:{PGPORT}/{PGDB}")
+def load_parquet(conn, day_from=None, day_to=None, channels=None):
+    """Load the selected partitions of the detections lake (day_to exclusive); returns run totals."""
+    require_pyarrow()
+    apply_migrations(conn)
+    by_dir = {}
+    for path in iter_lake_files("detections", day_from, day_to, channels):
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+    return load_paths(conn, sorted(by_dir.items()), load_parquet_partition)
 
-df = pd.read_json("data/image_detections.json")
-df.to_sql("image_detections", engine, if_exists="append", index=False, method="multi")
\ No newline at end of file
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load YOLO detection files into PostgreSQL.")
+    parser.add_argument("paths", nargs="*", default=[DETECTIONS_DIR], help="files or directories to load")
+    parser.add_argument("--from-parquet", action="store_true", help="load the Parquet lake instead of the files")
+    parser.add_argument("--day-from", help="with --from-parquet: first day to load (YYYY-MM-DD)")
+    parser.add_argument("--day-to", help="with --from-parquet: day to stop before (YYYY-MM-DD)")
+    parser.add_argument("--channel", action="append", help="with --from-parquet: channel to load (repeatable)")
+    args = parser.parse_args()
+    conn = connect()
+    try:
+        if args.from_parquet:
+            totals = load_parquet(conn, args.day_from, args.day_to, args.channel)
+        else:
+            totals = load_image_detections(conn, args.paths)
+    finally:
+        conn.close()
+    print(f"{totals['rows']} detections from {totals['files']} files ({totals['changed']} rows changed, "
+          f"{totals['skipped']} unchanged files skipped)")
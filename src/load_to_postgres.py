@@ -1,31 +1,283 @@
+# Loads preprocessed message partitions into raw_telegram_messages.
+#
+# Each file is streamed into a temp staging table with COPY and merged with
+# INSERT ... ON CONFLICT (id), so reloading a file never duplicates rows.
+# Files are recorded in load_manifest by path and checksum; unchanged files
+# are skipped on the next run. Every file is loaded in its own transaction
+# together with its manifest entry. New entries of the media store manifest
+# are copied into message_media the same way.
+#
+# --from-parquet loads the Parquet lake instead: Arrow applies the
+# preprocessing filter while reading and writes the COPY input itself, so no
+# row is turned into a Python object.
+#
+#   python -m src.load_to_postgres
+#   python -m src.load_to_postgres --from-parquet --day-from 2025-07-01
+
+import io
 import os
-import json
-import pandas as pd
-import psycopg2
-from dotenv import load_dotenv
-
-load_dotenv()
-PGUSER = os.getenv("POSTGRES_USER")
-PGPASS = os.getenv("POSTGRES_PASSWORD")
-PGDB = os.getenv("POSTGRES_DB")
-PGHOST = os.getenv("POSTGRES_HOST", "localhost")
-PGPORT = os.getenv("POSTGRES_PORT", "5432")
-
-def load_json_to_postgres(json_path, table_name, conn):
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-    df = pd.DataFrame(data)
-    df.to_sql(table_name, conn, if_exists='append', index=False, method='multi')
+import time
+import hashlib
+import argparse
+from datetime import timedelta
+from .database import connect
+from .raw_store import PREPROCESSED_DIR, iter_file
+from .parquet_lake import iter_files as iter_lake_files, require_pyarrow
+from .migrate import apply_migrations
+from .media_store import MANIFEST_PATH, MediaStore
+from .cache import invalidate as invalidate_cache
+from .metrics import observe_stage
+
+TABLE = "raw_telegram_messages"
+STAGE_TABLE = "stage_raw_telegram_messages"
+COLUMNS = ["id", "date", "text", "media", "channel_name", "channel_url", "sender_id", "is_reply"]
+COPY_CHUNK_ROWS = 50000  # rows buffered per COPY call
+MEDIA_TABLE = "message_media"
+MEDIA_STAGE_TABLE = "stage_message_media"
+MEDIA_COLUMNS = ["channel_name", "message_id", "photo_id", "media_path"]
+# loaded_at is the merging transaction's start time, so a load that commits
+# late adds rows behind ones another load already committed. Readers that page
+# by loaded_at re-read this much behind their watermark (dbt's load_lookback).
+LOAD_LOOKBACK = timedelta(minutes=int(os.getenv("LOAD_LOOKBACK_MINUTES", "60")))
+
+_column_list = ", ".join(COLUMNS)
+_update_columns = [c for c in COLUMNS if c != "id"]
+
+CREATE_STAGE_SQL = f"""
+    CREATE TEMP TABLE IF NOT EXISTS {STAGE_TABLE}
+    (LIKE {TABLE} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS
+"""
+
+# DISTINCT ON: a segment can repeat an id after an interrupted scrape, and
+# ON CONFLICT may not touch the same row twice; the last copy (highest ctid) wins.
+# Unchanged rows are left alone so loaded_at only moves when data changes.
+MERGE_SQL = f"""
+    INSERT INTO {TABLE} ({_column_list})
+    SELECT DISTINCT ON (id) {_column_list}
+    FROM {STAGE_TABLE}
+    WHERE id IS NOT NULL
+    ORDER BY id, ctid DESC
+    ON CONFLICT (id) DO UPDATE SET
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in _update_columns)},
+        loaded_at = now()
+    WHERE ({", ".join(f"{TABLE}.{c}" for c in _update_columns)})
+        IS DISTINCT FROM ({", ".join(f"EXCLUDED.{c}" for c in _update_columns)})
+"""
+
+MERGE_MEDIA_SQL = f"""
+    INSERT INTO {MEDIA_TABLE} ({", ".join(MEDIA_COLUMNS)})
+    SELECT DISTINCT ON (channel_name, message_id) {", ".join(MEDIA_COLUMNS)}
+    FROM {MEDIA_STAGE_TABLE}
+    ORDER BY channel_name, message_id, ctid DESC
+    ON CONFLICT (channel_name, message_id) DO UPDATE SET
+        photo_id = EXCLUDED.photo_id,
+        media_path = EXCLUDED.media_path,
+        loaded_at = now()
+"""
+
+def file_checksum(path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def copy_value(value):
+    # COPY text format: \N is NULL; backslash and control characters are escaped.
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+def copy_records(cur, records, table, columns):
+    """COPY an iterable of dicts into `table` in bounded chunks; returns the row count."""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    total = 0
+    buf = io.StringIO()
+    pending = 0
+    for record in records:
+        buf.write("\t".join(copy_value(record.get(c)) for c in columns))
+        buf.write("\n")
+        pending += 1
+        if pending >= COPY_CHUNK_ROWS:
+            buf.seek(0)
+            cur.copy_expert(sql, buf)
+            total += pending
+            buf = io.StringIO()
+            pending = 0
+    if pending:
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        total += pending
+    return total
+
+def is_loaded(cur, path, checksum, target=TABLE):
+    cur.execute("SELECT checksum FROM load_manifest WHERE target = %s AND path = %s", (target, path))
+    row = cur.fetchone()
+    return row is not None and row[0] == checksum
+
+def record_loaded(cur, path, checksum, row_count, target=TABLE):
+    cur.execute(
+        """
+        INSERT INTO load_manifest (target, path, checksum, row_count)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (target, path) DO UPDATE SET
+            checksum = EXCLUDED.checksum,
+            row_count = EXCLUDED.row_count,
+            loaded_at = now()
+        """,
+        (target, path, checksum, row_count),
+    )
+
+def load_file_to_postgres(conn, path):
+    """Load one JSON/NDJSON file; returns (rows copied, rows merged), or None if unchanged."""
+    checksum = file_checksum(path)
+    with conn.cursor() as cur:
+        if is_loaded(cur, path, checksum):
+            conn.rollback()
+            return None
+        cur.execute(CREATE_STAGE_SQL)
+        copied = copy_records(cur, iter_file(path), STAGE_TABLE, COLUMNS)
+        cur.execute(MERGE_SQL)
+        merged = cur.rowcount
+        record_loaded(cur, path, checksum, copied)
+    conn.commit()
+    return copied, merged
+
+def load_media_manifest(conn, manifest_path=MANIFEST_PATH):
+    """Copy manifest rows added since the last load into message_media; returns the row count."""
+    if not os.path.exists(manifest_path):
+        return 0
+    # The manifest's rowid is the watermark; a re-linked message gets a new rowid.
+    store = MediaStore(manifest_path)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT checksum FROM load_manifest WHERE target = %s AND path = %s",
+                        (MEDIA_TABLE, manifest_path))
+            row = cur.fetchone()
+            last_rowid = int(row[0]) if row else 0
+            rows = store.iter_message_media(last_rowid)
+            watermark = [last_rowid]
+
+            def records():
+                for rowid, channel_name, message_id, pid, media_path in rows:
+                    watermark[0] = rowid
+                    yield {"channel_name": channel_name, "message_id": message_id,
+                           "photo_id": pid, "media_path": media_path}
+
+            cur.execute(f"CREATE TEMP TABLE IF NOT EXISTS {MEDIA_STAGE_TABLE} "
+                        f"(LIKE {MEDIA_TABLE} INCLUDING DEFAULTS) ON COMMIT DELETE ROWS")
+            copied = copy_records(cur, records(), MEDIA_STAGE_TABLE, MEDIA_COLUMNS)
+            if copied:
+                cur.execute(MERGE_MEDIA_SQL)
+                record_loaded(cur, manifest_path, str(watermark[0]), copied, target=MEDIA_TABLE)
+        conn.commit()
+    finally:
+        store.close()
+    return copied
+
+def iter_input_files(pre_dir=PREPROCESSED_DIR):
+    for full_dir, dirs, files in os.walk(pre_dir):
+        dirs.sort()
+        for file in sorted(files):
+            if file.endswith((".json", ".ndjson")):
+                yield os.path.join(full_dir, file).replace(os.sep, "/")
+
+def copy_parquet(cur, path, table, columns=COLUMNS):
+    """COPY the preprocessed rows of a lake part file into `table`; returns the row count."""
+    import pyarrow.csv as pacsv
+    import pyarrow.dataset as ds
+    # Same filter as the scraper's preprocessing: non-empty text, with media.
+    keep = (ds.field("text") != "") & (ds.field("media") == True)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+    total = 0
+    for batch in ds.dataset(path, format="parquet").to_batches(columns=columns, filter=keep,
+                                                              batch_size=COPY_CHUNK_ROWS):
+        if not batch.num_rows:
+            continue
+        # Arrow's CSV keeps "" and NULL apart, as COPY's csv format expects.
+        buf = io.BytesIO()
+        pacsv.write_csv(batch, buf)
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        total += batch.num_rows
+    return total
+
+def load_parquet_file(conn, path):
+    """Load one lake part file; returns (rows copied, rows merged), or None if unchanged."""
+    checksum = file_checksum(path)
+    with conn.cursor() as cur:
+        if is_loaded(cur, path, checksum):
+            conn.rollback()
+            return None
+        cur.execute(CREATE_STAGE_SQL)
+        copied = copy_parquet(cur, path, STAGE_TABLE)
+        cur.execute(MERGE_SQL)
+        merged = cur.rowcount
+        record_loaded(cur, path, checksum, copied)
+    conn.commit()
+    return copied, merged
+
+def load_paths(conn, paths, load_file=load_file_to_postgres):
+    totals = {"files": 0, "skipped": 0, "rows": 0, "merged": 0}
+    for path in paths:
+        file_started = time.perf_counter()
+        result = load_file(conn, path)
+        if result is None:
+            totals["skipped"] += 1
+            continue
+        copied, merged = result
+        elapsed = time.perf_counter() - file_started
+        totals["files"] += 1
+        totals["rows"] += copied
+        totals["merged"] += merged
+        print(f"Loaded {path}: {copied} rows ({merged} new/changed) in {elapsed:.2f}s "
+              f"({copied / elapsed if elapsed else 0:.0f} rows/s)")
+    return totals
+
+def load_preprocessed(conn, pre_dir=PREPROCESSED_DIR):
+    apply_migrations(conn)
+    started = time.perf_counter()
+    totals = load_paths(conn, iter_input_files(pre_dir))
+    totals["media"] = load_media_manifest(conn)
+    totals.update(observe_stage("load", time.perf_counter() - started, rows=totals["rows"], files=totals["files"]))
+    return totals
+
+def load_parquet(conn, day_from=None, day_to=None, channels=None):
+    """Load the selected partitions of the messages lake (day_to exclusive)."""
+    require_pyarrow()
+    apply_migrations(conn)
+    started = time.perf_counter()
+    totals = load_paths(conn, iter_lake_files("messages", day_from, day_to, channels), load_parquet_file)
+    totals["media"] = load_media_manifest(conn)
+    totals.update(observe_stage("load", time.perf_counter() - started, rows=totals["rows"], files=totals["files"]))
+    return totals
 
 if __name__ == "__main__":
-    import sqlalchemy
-    engine = sqlalchemy.create_engine(f"postgresql+psycopg2://{PGUSER}:{PGPASS}@{PGHOST}:{PGPORT}/{PGDB}")
-    pre_dir = "data/preprocessed"
-    for date_dir in os.listdir(pre_dir):
-        full_dir = os.path.join(pre_dir, date_dir)
-        for file in os.listdir(full_dir):
-            if file.endswith(".json"):
-                path = os.path.join(full_dir, file)
-                table = "raw_telegram_messages"
-                print(f"Loading {path} into {table}")
-                load_json_to_postgres(path, table, engine)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Load scraped messages into PostgreSQL.")
+    parser.add_argument("--from-parquet", action="store_true", help="load the Parquet lake instead of the JSON files")
+    parser.add_argument("--day-from", help="with --from-parquet: first day to load (YYYY-MM-DD)")
+    parser.add_argument("--day-to", help="with --from-parquet: day to stop before (YYYY-MM-DD)")
+    parser.add_argument("--channel", action="append", help="with --from-parquet: channel to load (repeatable)")
+    args = parser.parse_args()
+    conn = connect()
+    try:
+        if args.from_parquet:
+            totals = load_parquet(conn, args.day_from, args.day_to, args.channel)
+        else:
+            totals = load_preprocessed(conn)
+    finally:
+        conn.close()
+    if totals["merged"] or totals["media"]:
+        invalidate_cache()
+    rate = totals["rows"] / totals["seconds"] if totals["seconds"] else 0
+    print(f"Loaded {totals['rows']} rows from {totals['files']} files into {TABLE} "
+          f"({totals['merged']} new/changed, {totals['skipped']} unchanged files skipped) "
+          f"in {totals['seconds']:.2f}s, {rate:.0f} rows/s; {totals['media']} media links")
@@ -1,41 +1,224 @@
-from fastapi import FastAPI, Query
+import io
+import csv
+import json
+import time
+from datetime import date, datetime
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from typing import List
-from .schemas import MediaReport, ChannelActivity, MessageSearchResult, ChannelOverview,Message
-from .crud import get_top_media, get_channel_activity, search_messages, get_top_questions, get_channel_overview
+from .schemas import MediaReport, ProductReport, ChannelActivity, MessageSearchResult, ChannelOverview,Message, ActivityBucket
+from .schemas import ChannelActivityBucket
+from .crud import get_top_media, get_top_products, get_channel_activity, search_messages, get_top_questions, get_channel_overview
+from .crud import get_channel_timeseries, get_messages_page, iter_messages, list_channels, MESSAGE_COLUMNS
+from .crud import get_channels_activity, get_channels_timeseries
+from .cache import get_or_compute, CACHE_CLIENT_MAX_AGE
+from .responses import ARROW_MEDIA_TYPE, FORMAT_PATTERN, arrow_bytes, dumps, rows_response
+from .metrics import HTTP_SECONDS, render as render_metrics
 from pydantic import BaseModel
 
 app = FastAPI()
 
+MAX_BATCH_CHANNELS = 200  # channel names accepted by one batch request
+
+@app.middleware("http")
+async def record_latency(request: Request, call_next):
+    # Labelled by route template, so /api/channels/{channel_name}/activity is one series.
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_SECONDS.labels(request.method, route.path if route else "unmatched",
+                            str(status)).observe(time.perf_counter() - started)
+
+@app.get("/metrics", include_in_schema=False)
+def metrics():
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 class TopQuestion(BaseModel):
     text: str
     count: int
 
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    # If-None-Match is "*" or a comma-separated list of tags, compared weakly:
+    # a W/ prefix on either side is ignored.
+    tag = etag.removeprefix("W/")
+    return any(t == "*" or t.removeprefix("W/") == tag for t in (t.strip() for t in if_none_match.split(",")))
+
+async def cached_response(request: Request, namespace: str, compute, *args, format="json", model=None):
+    # Report responses are served from the cache with an ETag; a matching
+    # If-None-Match gets a bodiless 304. Arrow bodies are cached separately.
+    if format == "arrow":
+        etag, body = await get_or_compute(f"{namespace}:arrow", compute, *args,
+                                          encode=lambda rows: arrow_bytes(rows, model))
+        media_type = ARROW_MEDIA_TYPE
+    else:
+        etag, body = await get_or_compute(namespace, compute, *args, encode=dumps)
+        media_type = "application/json"
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={CACHE_CLIENT_MAX_AGE}"}
+    if etag_matches(etag, request.headers.get("if-none-match", "")):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type=media_type, headers=headers)
+
+def batch_channel_names(channel_name: List[str]):
+    names = list(dict.fromkeys(channel_name))  # drop repeats, keep the order
+    if len(names) > MAX_BATCH_CHANNELS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_CHANNELS} channels per request")
+    return names
+
 @app.get("/api/reports/top-media", response_model=List[MediaReport])
-def top_media(limit: int = Query(10, gt=0)):
-    return get_top_media(limit)
+async def top_media(request: Request, limit: int = Query(10, gt=0),
+                    format: str = Query("json", pattern=FORMAT_PATTERN)):
+    return await cached_response(request, "top-media", get_top_media, limit, format=format, model=MediaReport)
+
+@app.get("/api/reports/top-products", response_model=List[ProductReport])
+async def top_products(request: Request, limit: int = Query(10, gt=0),
+                       format: str = Query("json", pattern=FORMAT_PATTERN)):
+    # Filled by src/product_mentions.py; mentions counts messages naming the product.
+    return await cached_response(request, "top-products", get_top_products, limit, format=format,
+                                 model=ProductReport)
+
+@app.get("/api/channels/activity", response_model=List[ChannelActivity])
+async def channels_activity(
+    channel_name: List[str] = Query(..., description="repeat for each channel"),
+    format: str = Query("json", pattern=FORMAT_PATTERN),
+):
+    # Batch form of /api/channels/{channel_name}/activity: one query for all
+    # channels, results in the order asked.
+    activity = await get_channels_activity(batch_channel_names(channel_name))
+    return rows_response(activity, format, ChannelActivity) or activity
+
+@app.get("/api/channels/activity/timeseries", response_model=List[ChannelActivityBucket])
+async def channels_activity_timeseries(
+    channel_name: List[str] = Query(..., description="repeat for each channel"),
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    date_from: date | None = None,
+    date_to: date | None = None,
+    format: str = Query("json", pattern=FORMAT_PATTERN),
+):
+    buckets = await get_channels_timeseries(batch_channel_names(channel_name), bucket, date_from, date_to)
+    return rows_response(buckets, format, ChannelActivityBucket) or buckets
 
 @app.get("/api/channels/{channel_name}/activity", response_model=ChannelActivity)
-def channel_activity(channel_name: str):
-    return get_channel_activity(channel_name)
+async def channel_activity(channel_name: str):
+    activity = await get_channel_activity(channel_name)
+    return rows_response(activity, "json", ChannelActivity) or activity
+
+@app.get("/api/channels/{channel_name}/activity/timeseries", response_model=List[ActivityBucket])
+async def channel_activity_timeseries(
+    channel_name: str,
+    bucket: str = Query("day", pattern="^(day|week|month)$"),
+    date_from: date | None = None,
+    date_to: date | None = None,
+    format: str = Query("json", pattern=FORMAT_PATTERN),
+):
+    buckets = await get_channel_timeseries(channel_name, bucket, date_from, date_to)
+    return rows_response(buckets, format, ActivityBucket) or buckets
 
 @app.get("/api/search/messages", response_model=List[MessageSearchResult])
-def search_messages_endpoint(query: str):
-    return search_messages(query)
+async def search_messages_endpoint(
+    response: Response,
+    query: str = Query(..., min_length=1),
+    channel_name: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    cursor: str | None = None,
+    limit: int = Query(50, gt=0, le=200),
+    format: str = Query("json", pattern=FORMAT_PATTERN),
+):
+    # The cursor for the next page is returned in the X-Next-Cursor header.
+    if not query.strip():
+        raise HTTPException(status_code=422, detail="query must not be blank")
+    try:
+        results, next_cursor = await search_messages(query, channel_name, date_from, date_to, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    fast = rows_response(results, format, MessageSearchResult, headers)
+    if fast is not None:
+        return fast
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return results
 
 @app.get("/api/channels", response_model=List[str])
-def get_channels():
-    from .crud import list_channels
-    return list_channels()
+async def get_channels(request: Request):
+    return await cached_response(request, "channels", list_channels)
 
 @app.get("/api/reports/top-questions", response_model=List[TopQuestion])
-def top_questions(limit: int = 10):
-    return get_top_questions(limit)
+async def top_questions(request: Request, limit: int = 10, format: str = Query("json", pattern=FORMAT_PATTERN)):
+    return await cached_response(request, "top-questions", get_top_questions, limit, format=format,
+                                 model=TopQuestion)
 
 @app.get("/api/channels/overview", response_model=List[ChannelOverview])
-def channel_overview():
-    return get_channel_overview()
+async def channel_overview(request: Request, format: str = Query("json", pattern=FORMAT_PATTERN)):
+    return await cached_response(request, "channels-overview", get_channel_overview, format=format,
+                                 model=ChannelOverview)
 
 @app.get("/api/messages", response_model=List[Message])
-def get_all_messages():
-    from .crud import get_all_messages
-    return get_all_messages()
\ No newline at end of file
+async def get_all_messages(
+    response: Response,
+    limit: int = Query(1000, gt=0, le=5000),
+    cursor: str | None = None,
+    channel_name: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+    format: str = Query("json", pattern=FORMAT_PATTERN),
+):
+    # Ordered by (date, id); pass X-Next-Cursor back as `cursor` for the next page.
+    try:
+        messages, next_cursor = await get_messages_page(limit, cursor, channel_name, date_from, date_to)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    fast = rows_response(messages, format, Message, headers)
+    if fast is not None:
+        return fast
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return messages
+
+EXPORT_CHUNK_ROWS = 500  # rows joined into one chunk of the streamed body
+
+async def _export_ndjson(rows):
+    chunk = []
+    async for row in rows:
+        chunk.append(json.dumps(row, ensure_ascii=False))
+        if len(chunk) >= EXPORT_CHUNK_ROWS:
+            yield "\n".join(chunk) + "\n"
+            chunk = []
+    if chunk:
+        yield "\n".join(chunk) + "\n"
+
+async def _export_csv(rows):
+    columns = [c.strip() for c in MESSAGE_COLUMNS.split(",")]
+    buf = io.StringIO()
+    writer = csv.DictWriter(buf, fieldnames=columns)
+    writer.writeheader()
+    i = 0
+    async for row in rows:
+        writer.writerow(row)
+        i += 1
+        if i % EXPORT_CHUNK_ROWS == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+@app.get("/api/messages/export")
+async def export_messages(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    channel_name: str | None = None,
+    date_from: datetime | None = None,
+    date_to: datetime | None = None,
+):
+    # Streams every matching message; memory use does not depend on the row count.
+    rows = iter_messages(channel_name, date_from, date_to)
+    if format == "csv":
+        return StreamingResponse(_export_csv(rows), media_type="text/csv",
+                                 headers={"Content-Disposition": "attachment; filename=messages.csv"})
+    return StreamingResponse(_export_ndjson(rows), media_type="application/x-ndjson")
@@ -0,0 +1,110 @@
+# Photo store keyed by Telegram photo id.
+#
+# Every photo is downloaded once, to media/photos/<photo_id>.jpg; Telegram
+# reuses the id when a photo is forwarded or reposted, so later copies are
+# recognised before any bytes are fetched. Each message that carries the photo
+# gets a hard link media/<date>/<channel>/<message_id>.jpg, which keeps the
+# date partitions browsable without storing the bytes again.
+#
+# The manifest (data/media_manifest.sqlite) maps (channel, message id) to the
+# photo id and linked path; load_to_postgres copies it into message_media.
+# Newly linked paths are also handed to the detection queue (detection_queue.py).
+
+import os
+import shutil
+import sqlite3
+
+MEDIA_DIR = "media"
+PHOTOS_DIR = os.path.join(MEDIA_DIR, "photos")
+MANIFEST_PATH = os.getenv("MEDIA_MANIFEST_PATH", "data/media_manifest.sqlite")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    photo_id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    downloaded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE IF NOT EXISTS message_media (
+    channel_name TEXT NOT NULL,
+    message_id INTEGER NOT NULL,
+    photo_id INTEGER NOT NULL,
+    media_path TEXT NOT NULL,
+    PRIMARY KEY (channel_name, message_id)
+);
+"""
+
+def photo_id(message):
+    photo = getattr(message, "photo", None)
+    return photo.id if photo is not None else None
+
+def message_media_path(date_str, channel_name, message_id):
+    return "/".join([MEDIA_DIR, date_str, channel_name, f"{message_id}.jpg"])
+
+class MediaStore:
+    def __init__(self, path=MANIFEST_PATH, photos_dir=PHOTOS_DIR):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.photos_dir = photos_dir
+        # WAL and a busy timeout let parallel partition runs share the manifest.
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.linked = []  # (channel_name, message_id, media_path) linked since the last take_linked()
+
+    def photo_path(self, pid):
+        return "/".join([self.photos_dir.replace(os.sep, "/"), f"{pid}.jpg"])
+
+    def has_photo(self, pid):
+        row = self.conn.execute("SELECT path FROM photos WHERE photo_id = ?", (pid,)).fetchone()
+        return row is not None and os.path.exists(row[0])
+
+    def add_photo(self, pid, tmp_path):
+        """Move a finished download into the store under its photo id."""
+        path = self.photo_path(pid)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+        self.conn.execute(
+            "INSERT OR REPLACE INTO photos (photo_id, path, size) VALUES (?, ?, ?)",
+            (pid, path, os.path.getsize(path)),
+        )
+        self.conn.commit()
+        return path
+
+    def download_target(self, pid):
+        # Telethon writes here; add_photo renames it once the download is complete.
+        os.makedirs(self.photos_dir, exist_ok=True)
+        return os.path.join(self.photos_dir, f"{pid}.jpg.part")
+
+    def link_message(self, pid, channel_name, message_id, date_str):
+        """Link a stored photo into the message's partition and record it; returns the path."""
+        dst = message_media_path(date_str, channel_name, message_id)
+        if not os.path.exists(dst):
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            try:
+                os.link(self.photo_path(pid), dst)
+            except OSError:
+                shutil.copyfile(self.photo_path(pid), dst)  # no hard links on this filesystem
+        self.conn.execute(
+            "INSERT OR REPLACE INTO message_media (channel_name, message_id, photo_id, media_path) "
+            "VALUES (?, ?, ?, ?)",
+            (channel_name, message_id, pid, dst),
+        )
+        self.conn.commit()
+        self.linked.append((channel_name, message_id, dst))
+        return dst
+
+    def take_linked(self):
+        """Return and forget the messages linked since the last call (for the detection queue)."""
+        linked, self.linked = self.linked, []
+        return linked
+
+    def iter_message_media(self, after_rowid=0):
+        # (rowid, channel_name, message_id, photo_id, media_path), oldest first.
+        return self.conn.execute(
+            "SELECT rowid, channel_name, message_id, photo_id, media_path FROM message_media "
+            "WHERE rowid > ? ORDER BY rowid",
+            (after_rowid,),
+        )
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,103 @@
+# Prometheus metrics for the pipeline stages, the API and its SQL.
+#
+# Batch stages (scrape, load, products, clusters, yolo, dbt) report through
+# observe_stage(): run duration, items processed and the last run's throughput,
+# returned as well so Dagster assets can attach it as metadata. The API records
+# per-endpoint latency in main.py and per-statement latency in crud.py.
+#
+# The scraper, loaders and workers are separate processes. To see their metrics
+# on the API's /metrics, point PROMETHEUS_MULTIPROC_DIR at a directory shared
+# by all of them (prometheus_client's multiprocess mode; clear it when the API
+# restarts). Alternatively, PROMETHEUS_PUSHGATEWAY sends every stage's metrics
+# to a Pushgateway when the stage finishes.
+#
+# Statements slower than SLOW_QUERY_MS are logged with their EXPLAIN plan, at
+# most once per statement every SLOW_QUERY_EXPLAIN_INTERVAL seconds.
+
+import os
+import time
+import logging
+import threading
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest,
+    push_to_gateway,
+)
+
+PUSHGATEWAY = os.getenv("PROMETHEUS_PUSHGATEWAY")
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+SLOW_QUERY_EXPLAIN_INTERVAL = float(os.getenv("SLOW_QUERY_EXPLAIN_INTERVAL", "300"))
+
+# Batch runs take seconds to hours; requests and queries milliseconds to seconds.
+STAGE_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600, 7200)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+STAGE_SECONDS = Histogram("pipeline_stage_duration_seconds", "Duration of a pipeline stage run",
+                          ["stage"], buckets=STAGE_BUCKETS)
+STAGE_ITEMS = Counter("pipeline_stage_items_total", "Items processed by pipeline stages", ["stage", "unit"])
+STAGE_THROUGHPUT = Gauge("pipeline_stage_throughput", "Items per second of the stage's last run",
+                         ["stage", "unit"], multiprocess_mode="mostrecent")
+STAGE_LAST_SUCCESS = Gauge("pipeline_stage_last_success_timestamp_seconds", "End of the stage's last run",
+                           ["stage"], multiprocess_mode="mostrecent")
+SCRAPED_MESSAGES = Counter("scrape_messages_total", "New messages stored by the scraper", ["channel"])
+DOWNLOADED_BYTES = Counter("scrape_downloaded_bytes_total", "Photo bytes downloaded from Telegram", ["channel"])
+YOLO_BATCH_SECONDS = Histogram("yolo_batch_duration_seconds", "Inference time of one YOLO batch",
+                               buckets=LATENCY_BUCKETS)
+YOLO_IMAGES = Counter("yolo_images_total", "Images run through the YOLO model")
+HTTP_SECONDS = Histogram("http_request_duration_seconds", "API request latency",
+                         ["method", "route", "status"], buckets=LATENCY_BUCKETS)
+QUERY_SECONDS = Histogram("db_query_duration_seconds", "API SQL statement latency", ["query"],
+                          buckets=LATENCY_BUCKETS)
+SLOW_QUERIES = Counter("db_slow_queries_total", "API SQL statements slower than SLOW_QUERY_MS", ["query"])
+
+def observe_stage(stage, seconds, **counts):
+    """Record a finished stage run; returns {seconds, <unit>, <unit>_per_second} for run metadata."""
+    STAGE_SECONDS.labels(stage).observe(seconds)
+    STAGE_LAST_SUCCESS.labels(stage).set_to_current_time()
+    summary = {"seconds": round(seconds, 3)}
+    for unit, count in counts.items():
+        STAGE_ITEMS.labels(stage, unit).inc(count)
+        rate = count / seconds if seconds else 0.0
+        STAGE_THROUGHPUT.labels(stage, unit).set(rate)
+        summary[unit] = count
+        summary[f"{unit}_per_second"] = round(rate, 1)
+    push_metrics(stage)
+    return summary
+
+def push_metrics(job):
+    if not PUSHGATEWAY:
+        return
+    try:
+        push_to_gateway(PUSHGATEWAY, job=job, registry=REGISTRY)
+    except OSError as e:
+        logging.warning(f"Could not push metrics to {PUSHGATEWAY}: {e}")
+
+def render():
+    """(body, content type) of the /metrics page."""
+    registry = REGISTRY
+    if MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+_last_explained = {}
+_explain_lock = threading.Lock()
+
+def observe_query(name, seconds):
+    """Record a statement's latency; True when it was slow and its plan is due for logging."""
+    QUERY_SECONDS.labels(name).observe(seconds)
+    if seconds * 1000 < SLOW_QUERY_MS:
+        return False
+    SLOW_QUERIES.labels(name).inc()
+    now = time.monotonic()
+    with _explain_lock:
+        if now - _last_explained.get(name, -SLOW_QUERY_EXPLAIN_INTERVAL) < SLOW_QUERY_EXPLAIN_INTERVAL:
+            logging.warning(f"Slow query {name}: {seconds * 1000:.0f} ms")
+            return False
+        _last_explained[name] = now
+    return True
+
+def log_plan(name, seconds, sql, plan):
+    plan = "\n".join(plan)
+    logging.warning(f"Slow query {name}: {seconds * 1000:.0f} ms\n{sql.strip()}\n{plan}")
@@ -0,0 +1,47 @@
+# Applies the SQL files in sql/migrations/ in name order, once each.
+# Applied versions are recorded in schema_migrations; an advisory lock keeps
+# two loaders starting at the same time from applying the same file twice.
+#
+#   python -m src.migrate
+
+import os
+from .database import connect
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "sql", "migrations")
+MIGRATION_LOCK_ID = 7345021  # arbitrary key for pg_advisory_xact_lock
+
+def list_migrations():
+    return sorted(f for f in os.listdir(MIGRATIONS_DIR) if f.endswith(".sql"))
+
+def apply_migrations(conn):
+    """Apply pending migrations on a psycopg2 connection; returns their names."""
+    applied_now = []
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK_ID,))
+        cur.execute(
+            "CREATE TABLE IF NOT EXISTS schema_migrations ("
+            " version TEXT PRIMARY KEY,"
+            " applied_at TIMESTAMPTZ NOT NULL DEFAULT now())"
+        )
+        cur.execute("SELECT version FROM schema_migrations")
+        applied = {row[0] for row in cur.fetchall()}
+        for name in list_migrations():
+            if name in applied:
+                continue
+            with open(os.path.join(MIGRATIONS_DIR, name), "r", encoding="utf-8") as f:
+                cur.execute(f.read())
+            cur.execute("INSERT INTO schema_migrations (version) VALUES (%s)", (name,))
+            applied_now.append(name)
+    conn.commit()
+    return applied_now
+
+if __name__ == "__main__":
+    conn = connect()
+    try:
+        applied = apply_migrations(conn)
+    finally:
+        conn.close()
+    for name in applied:
+        print(f"Applied {name}")
+    if not applied:
+        print("Database schema is up to date.")
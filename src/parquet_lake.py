@@ -0,0 +1,242 @@
+# Columnar copy of the raw messages and YOLO detections.
+#
+# Datasets live under data/lake/<dataset>/day=YYYY-MM-DD/channel=<name>/ as
+# zstd-compressed Parquet with fixed column types; day is the UTC day a
+# message was posted. Each write adds new part files, so the scraper and the
+# detector can write while readers run. Readers get column projection and
+# predicate pushdown: partition filters skip whole directories, column filters
+# use the Parquet row-group statistics.
+#
+# A detections partition holds the latest detections of every image the
+# detector saw in it, an image without any as one row with a null class (as
+# in the detection files); load_image_detections --from-parquet loads them.
+#
+# pyarrow is optional: without it, lake_enabled() is False and the writers
+# are skipped.
+#
+#   python -m src.parquet_lake import-raw      # copy existing raw JSON partitions in
+#   python -m src.parquet_lake compact         # merge small part files per partition
+#   python -m src.parquet_lake stats --dataset messages
+
+import os
+import time
+import shutil
+import argparse
+from itertools import islice
+from urllib.parse import quote
+from datetime import datetime
+
+LAKE_DIR = os.getenv("PARQUET_LAKE_DIR", "data/lake")
+LAKE_ENABLED = os.getenv("PARQUET_LAKE", "true").lower() in ("1", "true", "yes")
+WRITE_CHUNK_ROWS = 100000  # records per Arrow table when writing
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = ds = pq = None
+
+def lake_enabled():
+    return LAKE_ENABLED and pa is not None
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The Parquet lake needs pyarrow: pip install pyarrow")
+
+def _schemas():
+    return {
+        "messages": pa.schema([
+            ("id", pa.int64()),
+            ("date", pa.timestamp("us", tz="UTC")),
+            ("text", pa.string()),
+            ("media", pa.bool_()),
+            ("channel_name", pa.string()),
+            ("channel_url", pa.string()),
+            ("sender_id", pa.int64()),
+            ("is_reply", pa.bool_()),
+        ]),
+        "detections": pa.schema([
+            ("message_id", pa.int64()),
+            ("media_path", pa.string()),
+            ("detected_object_class", pa.string()),
+            ("confidence_score", pa.float32()),
+            ("box_x1", pa.float64()),
+            ("box_y1", pa.float64()),
+            ("box_x2", pa.float64()),
+            ("box_y2", pa.float64()),
+        ]),
+    }
+
+def partitioning():
+    return ds.partitioning(pa.schema([("day", pa.string()), ("channel", pa.string())]), flavor="hive")
+
+def dataset_dir(name, base_dir=LAKE_DIR):
+    return os.path.join(base_dir, name)
+
+def partition_path(name, day, channel, base_dir=LAKE_DIR):
+    # Hive directory names, percent-encoded the way Arrow writes them.
+    return os.path.join(dataset_dir(name, base_dir), f"day={quote(day, safe='')}", f"channel={quote(channel, safe='')}")
+
+def write_records(name, records, day_of, channel_of, base_dir=LAKE_DIR, replace=False, chunk_rows=WRITE_CHUNK_ROWS):
+    """Append dicts to a dataset, partitioned by day_of(record) and channel_of(record).
+
+    `records` may be any iterable; it is written chunk_rows at a time. With
+    replace=True the partitions written to are emptied first. Returns the
+    number of rows written.
+    """
+    require_pyarrow()
+    schema = _schemas()[name]
+    records = iter(records)
+    written, emptied = 0, set()
+    while True:
+        chunk = list(islice(records, chunk_rows))
+        if not chunk:
+            return written
+        days = [day_of(r) for r in chunk]
+        channels = [channel_of(r) for r in chunk]
+        if replace:
+            # Once per call: later chunks add to the partitions earlier ones wrote.
+            for day, channel in set(zip(days, channels)) - emptied:
+                shutil.rmtree(partition_path(name, day, channel, base_dir), ignore_errors=True)
+                emptied.add((day, channel))
+        table = pa.Table.from_pylist(chunk, schema=schema)
+        table = table.append_column("day", pa.array(days, pa.string()))
+        table = table.append_column("channel", pa.array(channels, pa.string()))
+        ds.write_dataset(
+            table,
+            dataset_dir(name, base_dir),
+            format="parquet",
+            partitioning=partitioning(),
+            basename_template=f"part-{time.time_ns()}-{os.getpid()}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+            file_options=ds.ParquetFileFormat().make_write_options(compression="zstd"),
+        )
+        written += len(chunk)
+
+def write_messages(messages, base_dir=LAKE_DIR):
+    # Scraped dicts carry the date as str(datetime); Arrow wants datetimes.
+    rows = [dict(m, date=datetime.fromisoformat(m["date"]) if m.get("date") else None) for m in messages]
+    return write_records(
+        "messages", rows,
+        day_of=lambda r: r["date"].strftime("%Y-%m-%d") if r["date"] else "unknown",
+        channel_of=lambda r: r["channel_name"] or "unknown",
+        base_dir=base_dir,
+    )
+
+def media_partition(media_path):
+    # media/<date>/<channel>/<file> -> (date, channel); anything else is "unknown".
+    parts = media_path.replace("\\", "/").split("/")
+    if len(parts) >= 4 and parts[-4] == "media":
+        return parts[-3], parts[-2]
+    return "unknown", "unknown"
+
+def write_detections(detections, base_dir=LAKE_DIR):
+    # A detection run covers every image of the partitions it saw, so it
+    # replaces them instead of appending another copy.
+    return write_records(
+        "detections", detections,
+        day_of=lambda r: media_partition(r["media_path"])[0],
+        channel_of=lambda r: media_partition(r["media_path"])[1],
+        base_dir=base_dir,
+        replace=True,
+    )
+
+def open_dataset(name, base_dir=LAKE_DIR):
+    require_pyarrow()
+    return ds.dataset(dataset_dir(name, base_dir), format="parquet", partitioning=partitioning())
+
+def build_filter(day_from=None, day_to=None, channels=None, where=None):
+    """Combine partition bounds (day_from inclusive, day_to exclusive) with an optional expression."""
+    expr = where
+    terms = []
+    if day_from:
+        terms.append(ds.field("day") >= day_from)
+    if day_to:
+        terms.append(ds.field("day") < day_to)
+    if channels:
+        terms.append(ds.field("channel").isin(list(channels)))
+    for term in terms:
+        expr = term if expr is None else expr & term
+    return expr
+
+def read_table(name, columns=None, day_from=None, day_to=None, channels=None, where=None, base_dir=LAKE_DIR):
+    """Read a dataset into an Arrow table, e.g.
+
+    read_table("messages", columns=["id", "text"], day_from="2025-07-01",
+               where=ds.field("media") == True)
+    """
+    dataset = open_dataset(name, base_dir)
+    return dataset.to_table(columns=columns, filter=build_filter(day_from, day_to, channels, where))
+
+def iter_batches(name, columns=None, day_from=None, day_to=None, channels=None, where=None,
+                 batch_size=65536, base_dir=LAKE_DIR):
+    dataset = open_dataset(name, base_dir)
+    yield from dataset.to_batches(columns=columns, filter=build_filter(day_from, day_to, channels, where),
+                                  batch_size=batch_size)
+
+def iter_file_batches(name, files, columns=None, batch_size=65536):
+    # Read with the dataset's schema, so columns that older part files lack come back null.
+    require_pyarrow()
+    dataset = ds.dataset(files, schema=_schemas()[name], format="parquet")
+    yield from dataset.to_batches(columns=columns, batch_size=batch_size)
+
+def iter_files(name, day_from=None, day_to=None, channels=None, base_dir=LAKE_DIR):
+    """Paths of the part files in the selected partitions, in path order."""
+    if not os.path.isdir(dataset_dir(name, base_dir)):
+        return []
+    dataset = open_dataset(name, base_dir)
+    fragments = dataset.get_fragments(filter=build_filter(day_from, day_to, channels))
+    return sorted(f.path.replace(os.sep, "/") for f in fragments)
+
+def compact_partitions(name="messages", day_from=None, day_to=None, channels=None, base_dir=LAKE_DIR):
+    """Rewrite each partition with several part files as one file, keeping the last row per id."""
+    by_dir = {}
+    for path in iter_files(name, day_from, day_to, channels, base_dir):
+        by_dir.setdefault(os.path.dirname(path), []).append(path)
+    compacted = 0
+    for part_dir, files in sorted(by_dir.items()):
+        if len(files) < 2:
+            continue
+        table = ds.dataset(files, format="parquet").to_table()
+        if name == "messages":
+            # A message scraped twice (e.g. nightly and by a per-day run) keeps its latest copy.
+            rows = table.append_column("_row", pa.array(range(table.num_rows), pa.int64()))
+            keep = rows.group_by("id").aggregate([("_row", "max")])["_row_max"]
+            # Sorted by id, the row-group statistics make id filters selective.
+            table = table.take(keep).sort_by("id")
+        tmp = os.path.join(part_dir, f".compact-{os.getpid()}.parquet.tmp")
+        pq.write_table(table, tmp, compression="zstd")
+        os.replace(tmp, os.path.join(part_dir, f"part-{time.time_ns()}-{os.getpid()}-compacted.parquet"))
+        for path in files:
+            os.remove(path)
+        compacted += 1
+        print(f"Compacted {part_dir}: {len(files)} files -> 1 ({table.num_rows} rows)")
+    return compacted
+
+def import_raw(date_str=None, channel_name=None, base_dir=LAKE_DIR):
+    """Copy raw store partitions (segments and legacy JSON) into the messages dataset."""
+    from .raw_store import RAW_DATA_DIR, iter_partition, iter_partition_dirs
+    total = 0
+    for part_dir in iter_partition_dirs(RAW_DATA_DIR, date_str, channel_name, include_legacy=True):
+        total += write_messages(iter_partition(part_dir), base_dir)
+    return total
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or compact the Parquet lake.")
+    parser.add_argument("command", choices=["stats", "compact", "import-raw"])
+    parser.add_argument("--dataset", default="messages", choices=["messages", "detections"])
+    parser.add_argument("--day-from")
+    parser.add_argument("--day-to")
+    parser.add_argument("--channel", action="append")
+    args = parser.parse_args()
+    if args.command == "import-raw":
+        print(f"Imported {import_raw()} raw messages")
+    if args.command == "compact":
+        compact_partitions(args.dataset, args.day_from, args.day_to, args.channel)
+    files = iter_files(args.dataset, args.day_from, args.day_to, args.channel)
+    size = sum(os.path.getsize(f) for f in files)
+    started = time.perf_counter()
+    table = read_table(args.dataset, day_from=args.day_from, day_to=args.day_to, channels=args.channel)
+    print(f"{args.dataset}: {table.num_rows} rows in {len(files)} files, {size / 1e6:.2f} MB, "
+          f"read in {time.perf_counter() - started:.2f}s")
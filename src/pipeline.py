@@ -1,59 +1,206 @@
-from dagster import job, op, ScheduleDefinition, Definitions, asset, sensor, RunRequest, resource
+# Dagster definitions for the pipeline.
+#
+# Raw messages, their Postgres load and the YOLO detections are assets
+# partitioned by (date, channel): every run handles one channel-day, so
+# channels are processed in parallel and a backfill over a date range only
+# materializes the partitions that are missing. dbt runs as one unpartitioned
+# asset downstream of the loaded partitions. Every asset reports its duration
+# and throughput as run metadata (and to Prometheus, see metrics.py).
+#
+#   dagster dev -m src.pipeline
+
+import os
+import time
+import asyncio
 import subprocess
-import sys
+from datetime import datetime, timedelta
+from dagster import (
+    AssetExecutionContext, DailyPartitionsDefinition, Definitions, Failure, MaterializeResult,
+    MultiPartitionKey, MultiPartitionsDefinition, RunRequest, ScheduleDefinition, SkipReason,
+    StaticPartitionsDefinition, asset, define_asset_job, schedule, sensor,
+)
+from .scrape_telegram import CHANNELS, main_async as scrape_async
+from .raw_store import RAW_DATA_DIR, PREPROCESSED_DIR, partition_dir, iter_partition_dirs
+from .load_to_postgres import load_preprocessed
+from .product_mentions import extract_product_mentions
+from .text_clusters import cluster_messages
+from .database import connect
+from .cache import invalidate as invalidate_cache
+from .metrics import observe_stage
+
+PIPELINE_START_DATE = os.getenv("PIPELINE_START_DATE", "2022-09-01")
+DETECTIONS_DIR = "data/image_detections"
+CHANNEL_URLS = {url.split('/')[-1]: url for url in CHANNELS}
+
+# end_offset=1 includes today, which the nightly scraper writes to.
+date_partitions = DailyPartitionsDefinition(start_date=PIPELINE_START_DATE, end_offset=1)
+channel_partitions = StaticPartitionsDefinition(list(CHANNEL_URLS))
+partitions = MultiPartitionsDefinition({"date": date_partitions, "channel": channel_partitions})
+
+def partition_keys(context):
+    keys = context.partition_key.keys_by_dimension
+    return keys["date"], keys["channel"]
+
+@asset(partitions_def=partitions, group_name="telegram")
+def raw_messages(context: AssetExecutionContext):
+    """Messages posted on the partition's day, appended to the raw and preprocessed stores."""
+    date_str, channel_name = partition_keys(context)
+    started = time.perf_counter()
+    [summary] = asyncio.run(scrape_async([CHANNEL_URLS[channel_name]], date_str=date_str, posted_on=True))
+    if "error" in summary:
+        raise Failure(f"Scraping {channel_name} for {date_str} failed: {summary['error']}")
+    return MaterializeResult(metadata={
+        "messages": summary["messages"],
+        "images": summary["images"],
+        "downloaded": summary["downloaded"],
+        "downloaded_bytes": summary["downloaded_bytes"],
+        "seconds": round(time.perf_counter() - started, 3),
+    })
+
+@asset(partitions_def=partitions, deps=[raw_messages], group_name="telegram")
+def loaded_messages(context: AssetExecutionContext):
+    """The partition's preprocessed files merged into raw_telegram_messages."""
+    date_str, channel_name = partition_keys(context)
+    conn = connect()
+    try:
+        totals = load_preprocessed(conn, partition_dir(PREPROCESSED_DIR, date_str, channel_name))
+    finally:
+        conn.close()
+    if totals["merged"]:
+        invalidate_cache()
+    return MaterializeResult(metadata={
+        "files": totals["files"],
+        "skipped_files": totals["skipped"],
+        "rows": totals["rows"],
+        "new_or_changed": totals["merged"],
+        "seconds": totals["seconds"],
+        "rows_per_second": totals["rows_per_second"],
+    })
 
-@op
-def scrape_telegram_data_op():
-    subprocess.run([sys.executable, "src/scrape_telegram.py"], check=True)
+@asset(partitions_def=partitions, deps=[raw_messages], group_name="telegram")
+def image_detections(context: AssetExecutionContext):
+    """YOLO detections for the partition's downloaded images, loaded into image_detections."""
+    # Imported here: loading the model is only worth it in runs that use it.
+    from .yolo_detection import detect_objects_in_images
+    from .load_image_detections import load_image_detections
+    date_str, channel_name = partition_keys(context)
+    output_dir = os.path.join(DETECTIONS_DIR, date_str, channel_name)
+    started = time.perf_counter()
+    detected = detect_objects_in_images(os.path.join("media", date_str, channel_name), output_dir)
+    seconds = time.perf_counter() - started
+    conn = connect()
+    try:
+        # Earlier runs' files are skipped by their manifest entries.
+        totals = load_image_detections(conn, [output_dir])
+    finally:
+        conn.close()
+    return MaterializeResult(metadata={
+        "detections": detected["detections"],
+        "new_or_changed": totals["changed"],
+        "images": detected["images"],
+        "seconds": round(seconds, 3),
+        # Cached images included: this is the partition's rate, not the model's.
+        "images_per_second": round(detected["images"] / seconds, 1) if seconds else 0.0,
+    })
 
-@op
-def load_raw_to_postgres_op():
-    subprocess.run([sys.executable, "src/load_to_postgres.py"], check=True)
+@asset(deps=[loaded_messages], group_name="telegram")
+def product_mentions():
+    """Dictionary matches in the messages loaded since the previous run."""
+    conn = connect()
+    try:
+        totals = extract_product_mentions(conn)
+    finally:
+        conn.close()
+    if totals["messages"]:
+        invalidate_cache()
+    return MaterializeResult(metadata={
+        "messages": totals["messages"],
+        "mentions": totals["mentions"],
+        "seconds": totals["seconds"],
+        "messages_per_second": totals["messages_per_second"],
+    })
 
-@op
-def run_dbt_transformations_op():
+@asset(deps=[loaded_messages], group_name="telegram")
+def text_clusters():
+    """Near-duplicate clusters of the messages loaded since the previous run."""
+    conn = connect()
+    try:
+        totals = cluster_messages(conn)
+    finally:
+        conn.close()
+    if totals["messages"]:
+        invalidate_cache()
+    return MaterializeResult(metadata={
+        "messages": totals["messages"],
+        "new_clusters": totals["clusters"],
+        "seconds": totals["seconds"],
+        "messages_per_second": totals["messages_per_second"],
+    })
+
+@asset(deps=[loaded_messages], group_name="telegram")
+def dbt_models():
+    """Staging and mart models; incremental, so a run only processes newly loaded rows."""
+    started = time.perf_counter()
     subprocess.run(["dbt", "run"], check=True)
+    # Channel endpoints read the dbt rollups, so cached reports are stale now.
+    invalidate_cache()
+    return MaterializeResult(metadata=observe_stage("dbt", time.perf_counter() - started))
 
-@op
-def run_yolo_enrichment_op():
-    subprocess.run([sys.executable, "src/yolo_detection.py"], check=True)
-
-@op
-def run_load_image_detections_op():
-    subprocess.run([sys.executable, "src/load_image_detections.py"], check=True)
-
-@asset
-def my_asset():
-    # Example asset logic: just returns a string
-    return "Asset loaded successfully!"
-
-@resource
-def my_resource(_):
-    # Example resource logic: returns a simple dictionary
-    return {"resource_key": "resource_value"}
-
-@job
-def telegram_analytics_pipeline():
-    scrape_telegram_data_op()
-    load_raw_to_postgres_op()
-    run_dbt_transformations_op()
-    run_yolo_enrichment_op()
-    run_load_image_detections_op()
-
-@sensor(job=telegram_analytics_pipeline)
-def my_sensor(context):
-    # Example sensor logic: always triggers a run
-    yield RunRequest(run_key=None, run_config={})
-
-telegram_analytics_schedule = ScheduleDefinition(
-    job=telegram_analytics_pipeline,
-    cron_schedule="0 2 * * *",  # Runs daily at 2am
-)
+# Scrape runs share one Telegram account; cap them with a tag concurrency
+# limit on telegram=scrape in dagster.yaml.
+scrape_job = define_asset_job("scrape_job", selection=[raw_messages], partitions_def=partitions,
+                              tags={"telegram": "scrape"})
+ingest_job = define_asset_job("ingest_job", selection=[loaded_messages, image_detections],
+                              partitions_def=partitions)
+transform_job = define_asset_job("transform_job", selection=[product_mentions, text_clusters, dbt_models])
+
+@schedule(job=scrape_job, cron_schedule="0 2 * * *")  # Runs daily at 2am
+def daily_scrape_schedule(context):
+    # One run per channel for the previous (complete) day.
+    date_str = (context.scheduled_execution_time - timedelta(days=1)).strftime("%Y-%m-%d")
+    for channel_name in CHANNEL_URLS:
+        yield RunRequest(
+            run_key=f"{date_str}|{channel_name}",
+            partition_key=MultiPartitionKey({"date": date_str, "channel": channel_name}),
+        )
+
+@sensor(job=ingest_job, minimum_interval_seconds=60)
+def raw_partition_sensor(context):
+    # The cursor is the newest raw partition directory mtime already requested.
+    # Appending a segment renames a file into the directory, bumping its mtime,
+    # so partitions written by scheduled runs and by the CLI scraper are both seen.
+    cursor = int(context.cursor or 0)
+    newest = cursor
+    requested = 0
+    for part_dir in iter_partition_dirs(RAW_DATA_DIR):
+        date_dir, channel_name = os.path.split(part_dir)
+        date_str = os.path.basename(date_dir)
+        if channel_name not in CHANNEL_URLS or date_str < PIPELINE_START_DATE:
+            continue
+        try:
+            datetime.strptime(date_str, "%Y-%m-%d")
+        except ValueError:
+            continue
+        mtime = os.stat(part_dir).st_mtime_ns
+        if mtime <= cursor:
+            continue
+        newest = max(newest, mtime)
+        requested += 1
+        yield RunRequest(
+            run_key=f"{date_str}|{channel_name}|{mtime}",
+            partition_key=MultiPartitionKey({"date": date_str, "channel": channel_name}),
+        )
+    context.update_cursor(str(newest))
+    if not requested:
+        yield SkipReason("No new raw partitions.")
+
+# dbt, the product extraction and the clustering are incremental, so running
+# them often only costs the new rows.
+transform_schedule = ScheduleDefinition(job=transform_job, cron_schedule="0 * * * *")
 
 defs = Definitions(
-    jobs=[telegram_analytics_pipeline],
-    schedules=[telegram_analytics_schedule],
-    assets=[my_asset],
-    sensors=[my_sensor],
-    resources={"my_resource": my_resource},
-)
\ No newline at end of file
+    assets=[raw_messages, loaded_messages, image_detections, product_mentions, text_clusters, dbt_models],
+    jobs=[scrape_job, ingest_job, transform_job],
+    schedules=[daily_scrape_schedule, transform_schedule],
+    sensors=[raw_partition_sensor],
+)
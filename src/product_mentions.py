@@ -0,0 +1,219 @@
+# Product mentions in message text, for /api/reports/top-products.
+#
+# The aliases in data/products.csv (English and Amharic, one row per alias)
+# are compiled into one Aho-Corasick automaton, so a message is scanned once
+# however many products the dictionary holds. Text and aliases get the same
+# normalization: compatibility forms and accents dropped, case folding, Amharic
+# homophone letters folded to one form (ሐ/ኀ -> ሀ, ሠ -> ሰ, ዐ -> አ, ፀ -> ጸ) and
+# punctuation collapsed to spaces.
+# Latin aliases must match whole words; Amharic words take prefixes and
+# suffixes (የ-, -ን), so Amharic aliases match inside words too.
+#
+# Extraction is incremental: messages are read in (loaded_at, id) order from a
+# watermark kept in load_manifest, so a run only scans rows loaded or changed
+# since the previous one, plus LOAD_LOOKBACK behind the watermark for loads
+# that committed out of order. Re-matching a message replaces its rows.
+# Changing the dictionary starts a full rescan.
+#
+#   python -m src.product_mentions
+#   python -m src.product_mentions --full
+
+import os
+import re
+import csv
+import json
+import time
+import argparse
+import unicodedata
+from datetime import datetime
+from collections import Counter, deque
+from .database import connect
+from .migrate import apply_migrations
+from .load_to_postgres import LOAD_LOOKBACK, copy_records, file_checksum, record_loaded
+from .cache import invalidate as invalidate_cache
+from .metrics import observe_stage
+
+DICTIONARY_PATH = os.getenv("PRODUCTS_DICTIONARY", "data/products.csv")
+BATCH_SIZE = int(os.getenv("PRODUCT_MENTIONS_BATCH_SIZE", "5000"))  # messages per transaction
+TABLE = "products_mentions"
+SOURCE_TABLE = "raw_telegram_messages"
+COLUMNS = ["message_id", "channel_name", "product", "mention_count", "message_date"]
+
+# First letter of each homophone series and the series it folds into; the
+# seven vowel orders follow at consecutive code points.
+_HOMOPHONES = {}
+for _src, _dst in ((0x1210, 0x1200), (0x1280, 0x1200), (0x1220, 0x1230), (0x12D0, 0x12A0), (0x1340, 0x1338)):
+    for _order in range(7):
+        _HOMOPHONES[_src + _order] = _dst + _order
+_SEPARATORS = re.compile(r"[\W_]+")
+
+def normalize(text):
+    if text.isascii():
+        text = text.lower()
+    else:
+        text = unicodedata.normalize("NFKD", text)
+        text = "".join(ch for ch in text if not unicodedata.combining(ch))
+        text = unicodedata.normalize("NFC", text).casefold().translate(_HOMOPHONES)
+    return _SEPARATORS.sub(" ", text).strip()
+
+def is_ethiopic(text):
+    return any("\u1200" <= ch <= "\u139f" for ch in text)
+
+class AhoCorasick:
+    """Finds every occurrence of a set of patterns in one pass over the text."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]  # (pattern length, value) of the patterns ending at each state
+
+    def add(self, pattern, value):
+        state = 0
+        for ch in pattern:
+            nxt = self.goto[state].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[state][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+            state = nxt
+        self.out[state].append((len(pattern), value))
+
+    def build(self):
+        # Breadth-first, so a state's failure link (the longest proper suffix
+        # of its path that is also in the trie) is set before its children's.
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+        return self
+
+    def iter_matches(self, text):
+        """Yield (end offset, pattern length, value) for every match."""
+        goto, fail, out = self.goto, self.fail, self.out
+        state = 0
+        for i, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, value in out[state]:
+                yield i + 1, length, value
+
+class ProductMatcher:
+    def __init__(self, aliases):
+        """aliases: (product, alias) pairs."""
+        self.automaton = AhoCorasick()
+        seen = set()
+        for product, alias in aliases:
+            key = normalize(alias)
+            if not key:
+                continue
+            # Padding Latin aliases with spaces makes them match whole words only.
+            pattern = key if is_ethiopic(key) else f" {key} "
+            if pattern not in seen:
+                seen.add(pattern)
+                self.automaton.add(pattern, product)
+        self.automaton.build()
+
+    def match(self, text):
+        """Mentions per product in `text`."""
+        if not text:
+            return {}
+        # An alias inside a longer matched alias ("sanitizer" in "hand
+        # sanitizer", "amoxicillin" in "amoxicillin clavulanate") doesn't count.
+        # By start, longest first, a match is inside an earlier one exactly
+        # when it doesn't reach past every earlier match's end.
+        spans = sorted(
+            (end - length, -length, product)
+            for end, length, product in self.automaton.iter_matches(f" {normalize(text)} ")
+        )
+        counts = Counter()
+        reach = 0
+        for start, neg_length, product in spans:
+            if start - neg_length > reach:
+                counts[product] += 1
+                reach = start - neg_length
+        return dict(counts)
+
+def load_matcher(path=DICTIONARY_PATH):
+    with open(path, newline="", encoding="utf-8") as f:
+        return ProductMatcher((row["product"], row["alias"]) for row in csv.DictReader(f))
+
+BATCH_SQL = f"""
+    SELECT id, channel_name, date, text, loaded_at
+    FROM {SOURCE_TABLE}
+    WHERE (loaded_at, id) > (%s::timestamptz, %s)
+    ORDER BY loaded_at, id
+    LIMIT %s
+"""
+
+def read_watermark(cur):
+    cur.execute("SELECT checksum FROM load_manifest WHERE target = %s AND path = %s", (TABLE, SOURCE_TABLE))
+    row = cur.fetchone()
+    return json.loads(row[0]) if row else None
+
+def extract_product_mentions(conn, dictionary_path=DICTIONARY_PATH, batch_size=BATCH_SIZE, full=False):
+    """Match the messages loaded since the last run; returns totals."""
+    apply_migrations(conn)
+    matcher = load_matcher(dictionary_path)
+    dictionary = file_checksum(dictionary_path)
+    totals = {"messages": 0, "mentions": 0}
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        state = read_watermark(cur)
+        if full or state is None or state["dictionary"] != dictionary:
+            # Results of an older dictionary can't be patched up: start over.
+            cur.execute(f"TRUNCATE {TABLE}")
+            state = {"dictionary": dictionary, "loaded_at": "-infinity"}
+            record_loaded(cur, SOURCE_TABLE, json.dumps(state), 0, target=TABLE)
+            conn.commit()
+        watermark = None if state["loaded_at"] == "-infinity" else datetime.fromisoformat(state["loaded_at"])
+        position = ("-infinity", 0) if watermark is None else (watermark - LOAD_LOOKBACK, 0)
+        while True:
+            cur.execute(BATCH_SQL, (*position, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            records = [
+                {"message_id": message_id, "channel_name": channel_name, "product": product,
+                 "mention_count": count, "message_date": date}
+                for message_id, channel_name, date, text, _ in rows
+                for product, count in matcher.match(text).items()
+            ]
+            # A changed message comes back with a newer loaded_at; its old mentions go.
+            cur.execute(f"DELETE FROM {TABLE} WHERE message_id = ANY(%s)", ([row[0] for row in rows],))
+            copy_records(cur, records, TABLE, COLUMNS)
+            position = (rows[-1][4], rows[-1][0])
+            if watermark is None or rows[-1][4] > watermark:
+                watermark = rows[-1][4]
+                state["loaded_at"] = watermark.isoformat()
+            totals["messages"] += len(rows)
+            totals["mentions"] += len(records)
+            record_loaded(cur, SOURCE_TABLE, json.dumps(state), totals["messages"], target=TABLE)
+            conn.commit()
+    conn.rollback()
+    return observe_stage("products", time.perf_counter() - started, **totals)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract product mentions from loaded messages.")
+    parser.add_argument("--dictionary", default=DICTIONARY_PATH, help="CSV of product,alias rows")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--full", action="store_true", help="rescan every message")
+    args = parser.parse_args()
+    conn = connect()
+    try:
+        totals = extract_product_mentions(conn, args.dictionary, args.batch_size, args.full)
+    finally:
+        conn.close()
+    if totals["messages"]:
+        invalidate_cache()
+    rate = totals["messages"] / totals["seconds"] if totals["seconds"] else 0
+    print(f"Scanned {totals['messages']} messages, {totals['mentions']} product mentions "
+          f"in {totals['seconds']:.2f}s, {rate:.0f} messages/s")
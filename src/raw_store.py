@@ -0,0 +1,228 @@
+# Append-only storage for scraped messages.
+#
+# Each (date, channel) partition is a directory of NDJSON segments plus a compact
+# id index:
+#
+#   data/raw/telegram_messages/<date>/<channel>/seg-<timestamp>-<pid>.ndjson
+#   data/raw/telegram_messages/<date>/<channel>/ids.idx   (int64 per stored id)
+#
+# A scrape only appends a segment with the messages that are not in the index
+# yet, so a run costs O(new messages) no matter how large the partition is.
+# The index is streamed in fixed-size chunks when deduping instead of being
+# loaded into a set. Segments accumulate until `compact_partition` merges them.
+#
+# Partitions written before this layout (<date>/<channel>.json holding a JSON
+# array) are still read, and their ids seed the index on first append.
+
+import os
+import json
+import argparse
+from array import array
+from datetime import datetime, timezone
+
+RAW_DATA_DIR = "data/raw/telegram_messages"
+PREPROCESSED_DIR = "data/preprocessed"
+
+INDEX_FILE = "ids.idx"
+SEGMENT_PREFIX = "seg-"
+SEGMENT_SUFFIX = ".ndjson"
+INDEX_CHUNK = 65536  # ids read per chunk when scanning the index
+
+def partition_dir(base_dir, date_str, channel_name):
+    return os.path.join(base_dir, date_str, channel_name)
+
+def legacy_paths(part_dir):
+    # Full-file JSON written by earlier versions of the scraper.
+    date_dir, channel_name = os.path.split(part_dir.rstrip(os.sep))
+    return [
+        os.path.join(date_dir, f"{channel_name}.json"),
+        os.path.join(date_dir, f"{channel_name}_preprocessed.json"),
+    ]
+
+def list_segments(part_dir):
+    if not os.path.isdir(part_dir):
+        return []
+    return sorted(
+        os.path.join(part_dir, f)
+        for f in os.listdir(part_dir)
+        if f.startswith(SEGMENT_PREFIX) and f.endswith(SEGMENT_SUFFIX)
+    )
+
+def iter_index_chunks(part_dir):
+    path = os.path.join(part_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        while True:
+            chunk = array("q")
+            try:
+                chunk.fromfile(f, INDEX_CHUNK)
+            except EOFError:
+                # fromfile keeps whatever it managed to read before EOF
+                if chunk:
+                    yield chunk
+                return
+            yield chunk
+
+def append_ids(part_dir, ids):
+    with open(os.path.join(part_dir, INDEX_FILE), "ab") as f:
+        array("q", ids).tofile(f)
+        f.flush()
+        os.fsync(f.fileno())
+
+def seed_index_from_legacy(part_dir):
+    if os.path.exists(os.path.join(part_dir, INDEX_FILE)):
+        return
+    os.makedirs(part_dir, exist_ok=True)
+    ids = [m["id"] for path in legacy_paths(part_dir)[:1] for m in iter_file(path)]
+    append_ids(part_dir, ids)
+
+def filter_new_messages(part_dir, messages):
+    """Return the messages whose ids are not stored in the partition yet.
+
+    Duplicates inside `messages` are dropped too (first occurrence wins).
+    Memory use is bounded by len(messages) plus one index chunk.
+    """
+    seed_index_from_legacy(part_dir)
+    pending = {}
+    for m in messages:
+        pending.setdefault(m["id"], m)
+    for chunk in iter_index_chunks(part_dir):
+        if not pending:
+            break
+        for msg_id in chunk:
+            pending.pop(msg_id, None)
+    return list(pending.values())
+
+def _segment_name():
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    return f"{SEGMENT_PREFIX}{stamp}-{os.getpid()}{SEGMENT_SUFFIX}"
+
+def write_segment(part_dir, messages, name=None):
+    # Written to a temp file and renamed so readers never see a partial segment.
+    os.makedirs(part_dir, exist_ok=True)
+    path = os.path.join(part_dir, name or _segment_name())
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for m in messages:
+            f.write(json.dumps(m, ensure_ascii=False))
+            f.write("\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return path
+
+def append_messages(part_dir, messages, index=True):
+    """Append `messages` as a new segment; returns its path, or None if empty.
+
+    Call `filter_new_messages` first: append does not dedupe. The id index
+    is only updated once the segment is in place, so an interrupted run at
+    worst re-appends a few messages, which compaction removes.
+    """
+    if not messages:
+        return None
+    path = write_segment(part_dir, messages)
+    if index:
+        append_ids(part_dir, [m["id"] for m in messages])
+    return path
+
+def iter_file(path):
+    if not os.path.exists(path):
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(SEGMENT_SUFFIX):
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from json.load(f)
+
+def iter_partition(part_dir, include_legacy=True):
+    # Legacy file first so that segment records (newer) come last.
+    if include_legacy:
+        for path in legacy_paths(part_dir):
+            yield from iter_file(path)
+    for path in list_segments(part_dir):
+        yield from iter_file(path)
+
+def compact_partition(part_dir, include_legacy=False):
+    """Merge all segments of a partition into one, deduped by id (last write wins).
+
+    Loads the partition into memory, so run it on request rather than on
+    every scrape. Returns the number of messages kept.
+    """
+    segments = list_segments(part_dir)
+    legacy = [p for p in legacy_paths(part_dir) if include_legacy and os.path.exists(p)]
+    if not legacy and len(segments) <= 1:
+        return None
+    index_path = os.path.join(part_dir, INDEX_FILE)
+    # Raw partitions keep an index; preprocessed ones never had one.
+    keep_index = os.path.exists(index_path) or legacy_paths(part_dir)[0] in legacy
+    merged = {}
+    for m in iter_partition(part_dir, include_legacy=include_legacy):
+        merged[m["id"]] = m
+    messages = sorted(merged.values(), key=lambda m: m["id"], reverse=True)
+    # Name sorts before any later appends, keeping segment order chronological.
+    write_segment(part_dir, messages, name=os.path.basename(segments[-1]) if segments else None)
+    for path in segments[:-1]:
+        os.remove(path)
+    if keep_index:
+        # Keep the old entries too: without include_legacy, the ids seeded from
+        # the legacy file are not among the segments' messages.
+        ids = [m["id"] for m in messages]
+        for chunk in iter_index_chunks(part_dir):
+            ids.extend(chunk)
+        tmp_path = index_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            array("q", sorted(set(ids), reverse=True)).tofile(f)
+        os.replace(tmp_path, index_path)
+    for path in legacy:
+        os.remove(path)
+    return len(messages)
+
+def _channel_from_entry(entry):
+    if entry.endswith("_preprocessed.json"):
+        return entry[: -len("_preprocessed.json")]
+    if entry.endswith(".json"):
+        return entry[: -len(".json")]
+    return entry
+
+def iter_partition_dirs(base_dir, date_str=None, channel_name=None, include_legacy=False):
+    # Yields <base>/<date>/<channel> paths; with include_legacy also those that
+    # only exist as an old <channel>.json file (the directory may not exist yet).
+    if not os.path.isdir(base_dir):
+        return
+    dates = [date_str] if date_str else sorted(os.listdir(base_dir))
+    for d in dates:
+        date_dir = os.path.join(base_dir, d)
+        if not os.path.isdir(date_dir):
+            continue
+        if channel_name:
+            channels = [channel_name]
+        else:
+            channels = sorted({
+                _channel_from_entry(e) for e in os.listdir(date_dir)
+                if os.path.isdir(os.path.join(date_dir, e)) or (include_legacy and e.endswith(".json"))
+            })
+        for c in channels:
+            part_dir = os.path.join(date_dir, c)
+            if os.path.isdir(part_dir) or (
+                include_legacy and any(os.path.exists(p) for p in legacy_paths(part_dir))
+            ):
+                yield part_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the NDJSON raw message store.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    compact = sub.add_parser("compact", help="merge segments of each partition into one")
+    compact.add_argument("--date", help="only compact this YYYY-MM-DD partition")
+    compact.add_argument("--channel", help="only compact this channel")
+    compact.add_argument("--include-legacy", action="store_true",
+                         help="fold old <channel>.json files into the segments and delete them")
+    args = parser.parse_args()
+
+    for base_dir in (RAW_DATA_DIR, PREPROCESSED_DIR):
+        for part_dir in iter_partition_dirs(base_dir, args.date, args.channel, args.include_legacy):
+            kept = compact_partition(part_dir, include_legacy=args.include_legacy)
+            if kept is not None:
+                print(f"Compacted {part_dir}: {kept} messages")
@@ -0,0 +1,66 @@
+# Fast response bodies for the API.
+#
+# The crud functions already return plain dicts of str/int/bool values in the
+# shape of the response models, so re-validating every row through Pydantic
+# only costs time. With API_FAST_JSON=true the row endpoints serialize those
+# dicts straight to bytes (orjson when installed) and skip the validation;
+# the JSON is the same as the validated one. Independently, `format=arrow`
+# returns an Arrow IPC stream (pyarrow required) for notebook clients:
+#
+#   pyarrow.ipc.open_stream(requests.get(url, params={"format": "arrow"}).content).read_pandas()
+#
+# The column types come from the response model, so empty results keep the schema.
+# The cached reports accept `format=arrow` too; their JSON bodies are always
+# encoded here.
+
+import os
+import json
+import types
+import typing
+from fastapi import HTTPException, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+FAST_JSON = os.getenv("API_FAST_JSON", "false").lower() in ("1", "true", "yes")
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+FORMAT_PATTERN = "^(json|arrow)$"
+
+def dumps(obj):
+    """JSON bytes of `obj`; values json can't encode natively go through str()."""
+    if orjson is not None:
+        # Datetimes through str() as well, so both encoders give the same values.
+        return orjson.dumps(obj, default=str, option=orjson.OPT_PASSTHROUGH_DATETIME)
+    return json.dumps(obj, default=str, ensure_ascii=False).encode()
+
+def arrow_schema(model):
+    import pyarrow as pa
+    types_ = {int: pa.int64(), str: pa.string(), bool: pa.bool_(), float: pa.float64()}
+    fields = []
+    for name, field in model.model_fields.items():
+        annotation = field.annotation
+        if isinstance(annotation, types.UnionType) or typing.get_origin(annotation) is typing.Union:
+            annotation = next(a for a in typing.get_args(annotation) if a is not type(None))
+        fields.append(pa.field(name, types_[annotation]))
+    return pa.schema(fields)
+
+def arrow_bytes(rows, model):
+    try:
+        import pyarrow as pa
+    except ImportError:
+        raise HTTPException(status_code=406, detail="Arrow responses need pyarrow on the server")
+    table = pa.Table.from_pylist(rows, schema=arrow_schema(model))
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+def rows_response(rows, format, model, headers=None):
+    """An Arrow or fast JSON response for `rows`, or None to let FastAPI validate and encode them."""
+    if format == "arrow":
+        return Response(content=arrow_bytes(rows, model), media_type=ARROW_MEDIA_TYPE, headers=headers)
+    if FAST_JSON:
+        return Response(content=dumps(rows), media_type="application/json", headers=headers)
+    return None
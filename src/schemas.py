@@ -4,6 +4,10 @@ class MediaReport(BaseModel):
     media_path: str
     mentions: int
 
+class ProductReport(BaseModel):
+    product: str
+    mentions: int
+
 class ChannelActivity(BaseModel):
     channel_name: str
     post_count: int
@@ -11,6 +15,12 @@ class ChannelActivity(BaseModel):
     image_count: int
     reply_count: int
 
+class ActivityBucket(BaseModel):
+    bucket_start: str
+    post_count: int
+    media_count: int
+    reply_count: int
+
 class MessageSearchResult(BaseModel):
     message_id: str
     channel_name: str
@@ -36,4 +46,11 @@ class Message(BaseModel):
     channel_name: str
     channel_url: str | None = None
     sender_id: int | None = None
-    is_reply: bool | None = None
\ No newline at end of file
+    is_reply: bool | None = None
+
+class ChannelActivityBucket(BaseModel):
+    channel_name: str
+    bucket_start: str
+    post_count: int
+    media_count: int
+    reply_count: int
@@ -1,18 +1,39 @@
 # This script scrapes messages and images from public Telegram channels related to Ethiopian medical businesses.
 # It saves raw data in a partitioned directory structure for easy incremental processing and future loading into a database.
 # Environment variables are loaded securely from .env using python-dotenv.
+#
+# Two modes are available:
+#   python -m src.scrape_telegram          # channels one after another (blocking client)
+#   python -m src.scrape_telegram --async  # all channels concurrently over one client session
+#   python -m src.scrape_telegram --async --date 2024-05-01 --channel tikvahpharma
+#                                          # only messages posted on that day (one partition)
+#
+# Messages are appended to the NDJSON partition store in raw_store.py (and,
+# with pyarrow installed, to the Parquet lake in parquet_lake.py); photos go
+# through the media store in media_store.py and are queued for the YOLO
+# workers in detection_queue.py.
 
 import os
 import json
-from datetime import datetime
+import time
+import asyncio
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
 from telethon.sync import TelegramClient
 from telethon.tl.types import MessageMediaPhoto
+from telethon.sessions import SQLiteSession, StringSession
 from dotenv import load_dotenv
 import logging
+from .raw_store import RAW_DATA_DIR, PREPROCESSED_DIR, partition_dir, filter_new_messages, append_messages
+from .media_store import MediaStore, photo_id
+from .parquet_lake import lake_enabled, write_messages as write_lake_messages
+from .detection_queue import enqueue_media
+from .metrics import DOWNLOADED_BYTES, SCRAPED_MESSAGES, observe_stage
 
 # Load environment variables
 load_dotenv()
-API_ID = int(os.getenv("TELEGRAM_API_ID"))
+API_ID = int(os.getenv("TELEGRAM_API_ID", "0"))
 API_HASH = os.getenv("TELEGRAM_API_HASH")
 
 CHANNELS = [
@@ -21,7 +42,19 @@ CHANNELS = [
     "https://t.me/tikvahpharma"
 ]
 
-RAW_DATA_DIR = "data/raw/telegram_messages"
+# Per-channel limits for the async mode. DEFAULT_CHANNEL_LIMITS applies to every
+# channel; CHANNEL_LIMITS overrides individual keys by channel name, e.g.
+# CHANNEL_LIMITS = {"tikvahpharma": {"messages": 2000, "downloads": 4}}
+DEFAULT_CHANNEL_LIMITS = {
+    "messages": 500,  # messages fetched per run
+    "images": 100,  # photos downloaded per run
+    "downloads": 2,  # concurrent downloads for the channel
+}
+CHANNEL_LIMITS = {}
+
+# Shared media download queue: bounded so fetching pages can't run far ahead of downloads.
+DOWNLOAD_WORKERS = int(os.getenv("SCRAPE_DOWNLOAD_WORKERS", "8"))
+DOWNLOAD_QUEUE_SIZE = int(os.getenv("SCRAPE_DOWNLOAD_QUEUE_SIZE", "200"))
 
 # Set up logging
 logging.basicConfig(
@@ -33,18 +66,28 @@ logging.basicConfig(
 def ensure_dir(path):
     os.makedirs(path, exist_ok=True)
 
-def download_images(client, messages, img_out_dir, max_images=100):
-    os.makedirs(img_out_dir, exist_ok=True)
+def download_images(client, messages, channel_name, store, max_images=100):
+    # Photos the store already holds are only linked, not downloaded again.
+    # Each is linked into the partition of the day its message was posted.
+    # Returns the bytes downloaded.
     count = 0
+    downloaded_bytes = 0
     for msg in messages:
         if count >= max_images:
             break
-        if msg.media and isinstance(msg.media, MessageMediaPhoto):
+        if is_photo(msg):
+            pid = photo_id(msg)
             try:
-                client.download_media(msg, file=img_out_dir)
+                if not store.has_photo(pid):
+                    store.add_photo(pid, client.download_media(msg, file=store.download_target(pid)))
+                    size = os.path.getsize(store.photo_path(pid))
+                    DOWNLOADED_BYTES.labels(channel_name).inc(size)
+                    downloaded_bytes += size
+                store.link_message(pid, channel_name, msg.id, posted_day(msg))
                 count += 1
             except Exception as e:
                 logging.error(f"Failed to download image {msg.id}: {e}")
+    return downloaded_bytes
 
 def get_last_message_id(channel_name):
     last_id_path = os.path.join("data", "last_scraped", f"{channel_name}.json")
@@ -59,71 +102,244 @@ def set_last_message_id(channel_name, last_id):
     with open(last_id_path, "w") as f:
         json.dump({"last_id": last_id}, f)
 
+def get_channel_limits(channel_name):
+    limits = dict(DEFAULT_CHANNEL_LIMITS)
+    limits.update(CHANNEL_LIMITS.get(channel_name, {}))
+    return limits
+
+def message_to_dict(message, channel_name, channel_url):
+    return {
+        "id": message.id,
+        "date": str(message.date),
+        "text": message.text,
+        "media": bool(message.media),
+        "channel_name": channel_name,
+        "channel_url": channel_url,
+        "sender_id": message.sender_id,
+        "is_reply": message.is_reply,
+    }
+
+def posted_day(message):
+    # Every scrape path partitions by the UTC day a message was posted, so a
+    # message fetched by several of them lands in one partition and is deduped there.
+    return message.date.astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+def group_by_day(messages):
+    by_day = defaultdict(list)
+    for message in messages:
+        by_day[posted_day(message)].append(message)
+    return sorted(by_day.items())
+
+def is_photo(message):
+    return isinstance(message.media, MessageMediaPhoto) and photo_id(message) is not None
+
+def save_messages(channel_name, date_str, messages):
+    # Append only the messages this partition hasn't stored yet; returns
+    # (new messages, new preprocessed messages).
+    raw_dir = partition_dir(RAW_DATA_DIR, date_str, channel_name)
+    new_messages = filter_new_messages(raw_dir, messages)
+    # Preprocess: filter out messages with null/empty text or media==False
+    preprocessed = [m for m in new_messages if m["text"] not in (None, "") and m["media"] is True]
+    append_messages(partition_dir(PREPROCESSED_DIR, date_str, channel_name), preprocessed, index=False)
+    if lake_enabled():
+        write_lake_messages(new_messages)
+    # Raw segment last: its id index marks the messages as stored.
+    append_messages(raw_dir, new_messages)
+    # Update last scraped id
+    SCRAPED_MESSAGES.labels(channel_name).inc(len(new_messages))
+    if new_messages:
+        last_id = get_last_message_id(channel_name) or 0
+        set_last_message_id(channel_name, max(last_id, max(m["id"] for m in new_messages)))
+    return new_messages, preprocessed
+
+def save_by_day(channel_name, channel_url, messages):
+    # Stores fetched messages in the partitions of the days they were posted;
+    # returns (new messages, new preprocessed messages) over all of them.
+    new_messages, preprocessed = [], []
+    for date_str, day_messages in group_by_day(messages):
+        stored, kept = save_messages(
+            channel_name, date_str, [message_to_dict(m, channel_name, channel_url) for m in day_messages]
+        )
+        new_messages.extend(stored)
+        preprocessed.extend(kept)
+    return new_messages, preprocessed
+
 def scrape_channel(channel_url):
     channel_name = channel_url.split('/')[-1]
-    date_str = datetime.now().strftime("%Y-%m-%d")
-    out_dir = os.path.join(RAW_DATA_DIR, date_str)
-    img_out_dir = os.path.join("media", date_str, channel_name)
-    pre_dir = os.path.join("data", "preprocessed", date_str)
-    ensure_dir(out_dir)
-    ensure_dir(img_out_dir)
-    ensure_dir(pre_dir)
-    out_path = os.path.join(out_dir, f"{channel_name}.json")
-    preprocessed_path = os.path.join(pre_dir, f"{channel_name}_preprocessed.json")
-
-    # Load previous messages if exist
-    prev_messages = []
-    if os.path.exists(out_path):
-        with open(out_path, "r", encoding="utf-8") as f:
-            prev_messages = json.load(f)
-        prev_ids = {m["id"] for m in prev_messages}
-    else:
-        prev_ids = set()
-
     last_id = get_last_message_id(channel_name)
+    started = time.perf_counter()
 
+    store = MediaStore()
     with TelegramClient('anon', API_ID, API_HASH) as client:
-        messages = []
-        image_msgs = []
+        fetched = []
         for message in client.iter_messages(channel_url, limit=500, min_id=last_id or 0):
-            if message.id in prev_ids:
-                continue
-            msg = {
-                "id": message.id,
-                "date": str(message.date),
-                "text": message.text,
-                "media": bool(message.media),
-                "channel_name": channel_name,
-                "channel_url": channel_url,
-                "sender_id": message.sender_id,
-                "is_reply": message.is_reply,
-            }
-            messages.append(msg)
-            if message.media and isinstance(message.media, MessageMediaPhoto):
-                image_msgs.append(message)
-        # Combine previous and new messages, sort by id
-        all_messages = prev_messages + messages
-        all_messages = {m["id"]: m for m in all_messages}.values()  # deduplicate by id
-        all_messages = sorted(all_messages, key=lambda x: x["id"], reverse=True)
-        # Save as JSON (raw)
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(list(all_messages), f, ensure_ascii=False, indent=2)
-        # Preprocess: filter out messages with null/empty text or media==False
-        preprocessed = [m for m in all_messages if m["text"] not in (None, "") and m["media"] is True]
-        with open(preprocessed_path, "w", encoding="utf-8") as f:
-            json.dump(preprocessed, f, ensure_ascii=False, indent=2)
+            fetched.append(message)
+        messages, preprocessed = save_by_day(channel_name, channel_url, fetched)
+        new_ids = {m["id"] for m in messages}
+        image_msgs = [m for m in fetched if m.id in new_ids and is_photo(m)]
         # Download only top 100 new images
-        download_images(client, image_msgs, img_out_dir, max_images=100)
-        # Update last scraped id
-        if all_messages:
-            set_last_message_id(channel_name, max(m["id"] for m in all_messages))
+        downloaded_bytes = download_images(client, image_msgs, channel_name, store, max_images=100)
+    enqueue_media(store.take_linked())
+    store.close()
+    observe_stage("scrape", time.perf_counter() - started, messages=len(messages),
+                  images=min(len(image_msgs), 100), bytes=downloaded_bytes)
     logging.info(f"Scraped {len(messages)} new messages, {len(preprocessed)} preprocessed, and {min(len(image_msgs), 100)} images from {channel_url}")
 
-if __name__ == "__main__":
-    for channel in CHANNELS:
+async def download_worker(client, queue, semaphores, store, photo_locks, downloaded, downloaded_bytes):
+    # Pulls (channel_name, message, date_str) items until it receives None.
+    while True:
+        item = await queue.get()
+        try:
+            if item is None:
+                return
+            channel_name, message, date_str = item
+            pid = photo_id(message)
+            # The lock keeps two messages carrying the same photo from both fetching it.
+            async with photo_locks[pid]:
+                if not store.has_photo(pid):
+                    async with semaphores[channel_name]:
+                        tmp_path = await client.download_media(message, file=store.download_target(pid))
+                    store.add_photo(pid, tmp_path)
+                    size = os.path.getsize(store.photo_path(pid))
+                    DOWNLOADED_BYTES.labels(channel_name).inc(size)
+                    downloaded[channel_name] += 1
+                    downloaded_bytes[channel_name] += size
+            store.link_message(pid, channel_name, message.id, date_str)
+        except Exception as e:
+            logging.error(f"Failed to download image {message.id}: {e}")
+        finally:
+            queue.task_done()
+
+async def iter_messages_posted_on(client, channel_url, date_str):
+    # Newest first from the end of the day, stopping at the first older message.
+    day_start = datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    async for message in client.iter_messages(channel_url, offset_date=day_start + timedelta(days=1)):
+        if message.date < day_start:
+            break
+        yield message
+
+async def scrape_channel_async(client, channel_url, queue, store, date_str=None, posted_on=False):
+    # posted_on: fetch the messages posted on date_str (UTC) instead of those
+    # newer than the last scraped id, so a date partition can be (re)built.
+    # Either way messages are stored under the day they were posted.
+    channel_name = channel_url.split('/')[-1]
+    date_str = date_str or datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    limits = get_channel_limits(channel_name)
+    last_id = get_last_message_id(channel_name)
+
+    if posted_on:
+        messages_iter = iter_messages_posted_on(client, channel_url, date_str)
+    else:
+        messages_iter = client.iter_messages(channel_url, limit=limits["messages"], min_id=last_id or 0)
+    fetched = []
+    async for message in messages_iter:
+        fetched.append(message)
+    messages, preprocessed = save_by_day(channel_name, channel_url, fetched)
+    new_ids = {m["id"] for m in messages}
+    image_msgs = [m for m in fetched if m.id in new_ids and is_photo(m)][: limits["images"]]
+
+    queued = 0
+    for message in image_msgs:
+        if store.has_photo(photo_id(message)):
+            store.link_message(photo_id(message), channel_name, message.id, posted_day(message))
+            continue
+        # Blocks while the shared queue is full, so page fetching is paced by downloads.
+        await queue.put((channel_name, message, posted_day(message)))
+        queued += 1
+    logging.info(f"Scraped {len(messages)} new messages, {len(preprocessed)} preprocessed, and queued {queued} of {len(image_msgs)} images from {channel_url}")
+    return {"channel": channel_name, "messages": len(messages), "images": len(image_msgs)}
+
+async def scrape_all_channels(client, channels=CHANNELS, download_workers=DOWNLOAD_WORKERS,
+                              queue_size=DOWNLOAD_QUEUE_SIZE, date_str=None, posted_on=False, store=None):
+    """Scrape all channels concurrently over one connected client.
+
+    The client only needs an async-iterable ``iter_messages`` and an awaitable
+    ``download_media``, so an in-process fake can stand in for Telegram.
+    Returns one summary dict per channel; a failing channel is logged and
+    reported with an ``error`` key without stopping the others.
+    """
+    channel_names = [c.split('/')[-1] for c in channels]
+    queue = asyncio.Queue(maxsize=queue_size)
+    semaphores = {name: asyncio.Semaphore(get_channel_limits(name)["downloads"]) for name in channel_names}
+    downloaded = {name: 0 for name in channel_names}
+    downloaded_bytes = {name: 0 for name in channel_names}
+    started = time.perf_counter()
+    own_store = store is None
+    store = store or MediaStore()
+    photo_locks = defaultdict(asyncio.Lock)
+    workers = [
+        asyncio.create_task(download_worker(client, queue, semaphores, store, photo_locks, downloaded,
+                                           downloaded_bytes))
+        for _ in range(max(1, download_workers))
+    ]
+
+    async def scrape_one(channel_url):
+        try:
+            return await scrape_channel_async(client, channel_url, queue, store, date_str=date_str,
+                                              posted_on=posted_on)
+        except Exception as e:
+            logging.error(f"Error scraping {channel_url}: {e}")
+            return {"channel": channel_url.split('/')[-1], "error": str(e)}
+
+    try:
+        summaries = await asyncio.gather(*(scrape_one(c) for c in channels))
+        await queue.join()
+    finally:
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers, return_exceptions=True)
+        enqueue_media(store.take_linked())
+        if own_store:
+            store.close()
+
+    for summary in summaries:
+        summary["downloaded"] = downloaded[summary["channel"]]
+        summary["downloaded_bytes"] = downloaded_bytes[summary["channel"]]
+    observe_stage("scrape", time.perf_counter() - started,
+                  messages=sum(s.get("messages", 0) for s in summaries),
+                  images=sum(s.get("images", 0) for s in summaries),
+                  bytes=sum(downloaded_bytes.values()))
+    return summaries
+
+def worker_session(name="anon"):
+    # Parallel runs can't share the SQLite session file; each gets an in-memory copy of its login.
+    session = SQLiteSession(name)
+    try:
+        if session.auth_key is None:
+            return name  # not logged in yet: let Telethon log in and save the session file
+        return StringSession(StringSession.save(session))
+    finally:
+        session.close()
+
+async def main_async(channels=CHANNELS, date_str=None, posted_on=False):
+    async with TelegramClient(worker_session(), API_ID, API_HASH) as client:
+        return await scrape_all_channels(client, channels, date_str=date_str, posted_on=posted_on)
+
+def main(channels=CHANNELS):
+    for channel in channels:
         try:
             scrape_channel(channel)
             print(f"Scraped {channel} successfully.")
         except Exception as e:
             logging.error(f"Error scraping {channel}: {e}")
             print(f"Error scraping {channel}: {e}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Scrape Telegram channels into the raw data lake.")
+    parser.add_argument("--async", dest="use_async", action="store_true",
+                        help="scrape all channels concurrently over one client session")
+    parser.add_argument("--date", help="with --async: only messages posted on this day (YYYY-MM-DD, UTC)")
+    parser.add_argument("--channel", action="append", help="with --async: channel name to scrape (repeatable)")
+    args = parser.parse_args()
+    if args.use_async:
+        channels = [c for c in CHANNELS if not args.channel or c.split('/')[-1] in args.channel]
+        summaries = asyncio.run(main_async(channels, date_str=args.date, posted_on=bool(args.date)))
+        for summary in summaries:
+            if "error" in summary:
+                print(f"Error scraping {summary['channel']}: {summary['error']}")
+            else:
+                print(f"Scraped {summary['channel']}: {summary['messages']} new messages, "
+                      f"{summary['images']} images ({summary['downloaded']} downloaded, "
+                      f"the rest already stored).")
+    else:
+        main()
@@ -0,0 +1,245 @@
+# Near-duplicate clusters of message text, for /api/reports/top-questions.
+#
+# Reposted promos differ in whitespace, emoji or a price, so texts are first
+# normalized (see product_mentions.normalize, with digits masked) and
+# fingerprinted: equal fingerprints always share a cluster. A new fingerprint
+# gets a MinHash signature over character shingles, and LSH banding looks up
+# the existing clusters that may be similar; the closest one above
+# SIMILARITY_THRESHOLD takes the message, otherwise it founds a new cluster.
+#
+# Channels end every post with the same long footer (address, phones, opening
+# hours), which would make all of a channel's promos look alike. Lines that
+# occur in BOILERPLATE_MIN_TEXTS or more distinct texts are counted in
+# text_lines and left out of the signatures.
+# Clusters, their band buckets and the message assignments live in Postgres,
+# so each run only processes messages loaded or changed since the last one,
+# using the same (loaded_at, id) watermark and LOAD_LOOKBACK re-read as the
+# product extraction. A re-read message keeps its known fingerprint, so its
+# lines aren't counted twice and its assignment is simply rewritten.
+#
+#   python -m src.text_clusters
+#   python -m src.text_clusters --full
+
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import argparse
+import numpy as np
+from datetime import datetime
+from collections import Counter
+from .database import connect
+from .migrate import apply_migrations
+from .load_to_postgres import LOAD_LOOKBACK, copy_records, record_loaded
+from .product_mentions import normalize
+from .cache import invalidate as invalidate_cache
+from .metrics import observe_stage
+
+BATCH_SIZE = int(os.getenv("TEXT_CLUSTERS_BATCH_SIZE", "5000"))  # messages per transaction
+SIMILARITY_THRESHOLD = float(os.getenv("TEXT_CLUSTERS_THRESHOLD", "0.8"))  # estimated Jaccard
+BOILERPLATE_MIN_TEXTS = int(os.getenv("TEXT_CLUSTERS_BOILERPLATE_MIN", "10"))
+SHINGLE_SIZE = 5  # characters; works without word segmentation for Amharic too
+NUM_PERM = 128
+BANDS = 16  # 16 bands of 8 rows: pairs at 0.8 similarity share a bucket ~95% of the time
+ROWS = NUM_PERM // BANDS
+TABLE = "text_clusters"
+SOURCE_TABLE = "raw_telegram_messages"
+PARAMS = f"{BOILERPLATE_MIN_TEXTS}:{SHINGLE_SIZE}:{NUM_PERM}x{BANDS}:{SIMILARITY_THRESHOLD}"
+
+# Multiply-shift hash functions with fixed seeds: signatures stored by one run
+# must be comparable with the next run's.
+_rng = np.random.RandomState(20240601)
+_A = _rng.randint(1, 2**63 - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64) | np.uint64(1)
+_B = _rng.randint(0, 2**63 - 1, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_DIGITS = re.compile(r"\d+")
+
+def cluster_text(text):
+    # Prices, phone numbers and dates vary between reposts of the same promo.
+    return _DIGITS.sub("0", normalize(text))
+
+def fingerprint(normalized):
+    # Signed 64-bit, to fit a BIGINT column.
+    return int.from_bytes(hashlib.blake2b(normalized.encode(), digest_size=8).digest(), "big", signed=True)
+
+def minhash(normalized):
+    if len(normalized) <= SHINGLE_SIZE:
+        shingles = {normalized}
+    else:
+        shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    x = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    with np.errstate(over="ignore"):
+        hashed = (_A[:, None] * x[None, :] + _B[:, None]) >> np.uint64(32)
+    return hashed.min(axis=1).astype(np.uint32)
+
+def band_buckets(signature):
+    """(band, bucket) keys; texts sharing any of them are candidate duplicates."""
+    return [
+        (band, int.from_bytes(hashlib.blake2b(signature[band * ROWS:(band + 1) * ROWS].tobytes(),
+                                              digest_size=8).digest(), "big", signed=True))
+        for band in range(BANDS)
+    ]
+
+def similarity(a, b):
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+BATCH_SQL = f"""
+    SELECT id, text, loaded_at
+    FROM {SOURCE_TABLE}
+    WHERE (loaded_at, id) > (%s::timestamptz, %s)
+    ORDER BY loaded_at, id
+    LIMIT %s
+"""
+
+CANDIDATES_SQL = f"""
+    SELECT b.band, b.bucket, c.cluster_id, c.signature
+    FROM text_cluster_bands b
+    JOIN {TABLE} c USING (cluster_id)
+    JOIN unnest(%s::smallint[], %s::bigint[]) AS k(band, bucket)
+      ON b.band = k.band AND b.bucket = k.bucket
+"""
+
+COUNT_LINES_SQL = """
+    INSERT INTO text_lines (line_hash, text_count)
+    SELECT * FROM unnest(%s::bigint[], %s::bigint[])
+    ON CONFLICT (line_hash) DO UPDATE SET text_count = text_lines.text_count + EXCLUDED.text_count
+    RETURNING line_hash, text_count
+"""
+
+REFRESH_COUNTS_SQL = f"""
+    UPDATE {TABLE} c
+    SET message_count = (SELECT COUNT(*) FROM message_clusters m WHERE m.cluster_id = c.cluster_id),
+        updated_at = now()
+    WHERE c.cluster_id = ANY(%s)
+"""
+
+def read_watermark(cur):
+    cur.execute("SELECT checksum FROM load_manifest WHERE target = %s AND path = %s", (TABLE, SOURCE_TABLE))
+    row = cur.fetchone()
+    return json.loads(row[0]) if row else None
+
+def bytea(array):
+    # COPY text input for bytea; copy_value doubles the backslash.
+    return "\\x" + array.tobytes().hex()
+
+def assign_batch(cur, rows):
+    """Cluster one batch of (id, text) rows; returns (assignments, new clusters)."""
+    normalized = {}
+    for message_id, text in rows:
+        key = cluster_text(text) if text else ""
+        if key:
+            normalized[message_id] = (key, fingerprint(key), text)
+    cur.execute("SELECT fingerprint, cluster_id FROM text_fingerprints WHERE fingerprint = ANY(%s)",
+                ([fp for _, fp, _ in normalized.values()],))
+    known = dict(cur.fetchall())
+
+    # Count the lines of the texts seen for the first time, then sign each
+    # of them without its boilerplate lines.
+    lines = {}
+    for key, fp, text in normalized.values():
+        if fp not in known and fp not in lines:
+            lines[fp] = list(dict.fromkeys(filter(None, map(cluster_text, text.splitlines()))))
+    line_counts = Counter(line for fp_lines in lines.values() for line in fp_lines)
+    boilerplate = set()
+    if line_counts:
+        hashes = {fingerprint(line): line for line in line_counts}
+        cur.execute(COUNT_LINES_SQL, (list(hashes), [line_counts[line] for line in hashes.values()]))
+        boilerplate = {hashes[h] for h, count in cur.fetchall() if count >= BOILERPLATE_MIN_TEXTS}
+    signatures = {}
+    for key, fp, _ in normalized.values():
+        if fp in lines:
+            content = " ".join(line for line in lines[fp] if line not in boilerplate)
+            signatures[fp] = minhash(content or key)
+
+    # Band lookups for all unseen texts in one query; clusters founded by
+    # this batch are added to the same maps as they appear.
+    keys = {k for sig in signatures.values() for k in band_buckets(sig)}
+    buckets, cluster_signatures = {}, {}
+    if keys:
+        cur.execute(CANDIDATES_SQL, ([k[0] for k in keys], [k[1] for k in keys]))
+        for band, bucket, cluster_id, signature in cur.fetchall():
+            buckets.setdefault((band, bucket), set()).add(cluster_id)
+            cluster_signatures[cluster_id] = np.frombuffer(bytes(signature), dtype=np.uint32)
+
+    assignments, clusters, fingerprints, bands = [], [], [], []
+    for message_id, (key, fp, text) in normalized.items():
+        if fp not in known:
+            sig = signatures[fp]
+            sig_buckets = band_buckets(sig)
+            candidates = {c for k in sig_buckets for c in buckets.get(k, ())}
+            best, best_score = None, SIMILARITY_THRESHOLD
+            for cluster_id in candidates:
+                score = similarity(sig, cluster_signatures[cluster_id])
+                if score >= best_score:
+                    best, best_score = cluster_id, score
+            if best is None:
+                # A new cluster is named after its first text's fingerprint.
+                best = fp
+                clusters.append({"cluster_id": fp, "representative": text, "signature": bytea(sig)})
+                cluster_signatures[fp] = sig
+                for band, bucket in sig_buckets:
+                    buckets.setdefault((band, bucket), set()).add(fp)
+                    bands.append({"band": band, "bucket": bucket, "cluster_id": fp})
+            known[fp] = best
+            fingerprints.append({"fingerprint": fp, "cluster_id": best})
+        assignments.append({"message_id": message_id, "fingerprint": fp, "cluster_id": known[fp]})
+    copy_records(cur, clusters, TABLE, ["cluster_id", "representative", "signature"])
+    copy_records(cur, bands, "text_cluster_bands", ["band", "bucket", "cluster_id"])
+    copy_records(cur, fingerprints, "text_fingerprints", ["fingerprint", "cluster_id"])
+    return assignments, len(clusters)
+
+def cluster_messages(conn, batch_size=BATCH_SIZE, full=False):
+    """Cluster the messages loaded since the last run; returns totals."""
+    apply_migrations(conn)
+    totals = {"messages": 0, "clusters": 0}
+    started = time.perf_counter()
+    with conn.cursor() as cur:
+        state = read_watermark(cur)
+        if full or state is None or state["params"] != PARAMS:
+            # Signatures made with other parameters aren't comparable: start over.
+            cur.execute(f"TRUNCATE {TABLE}, text_cluster_bands, text_fingerprints, text_lines, message_clusters")
+            state = {"params": PARAMS, "loaded_at": "-infinity"}
+            record_loaded(cur, SOURCE_TABLE, json.dumps(state), 0, target=TABLE)
+            conn.commit()
+        watermark = None if state["loaded_at"] == "-infinity" else datetime.fromisoformat(state["loaded_at"])
+        position = ("-infinity", 0) if watermark is None else (watermark - LOAD_LOOKBACK, 0)
+        while True:
+            cur.execute(BATCH_SQL, (*position, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                break
+            # A changed message is re-assigned; its old cluster is recounted too.
+            cur.execute("DELETE FROM message_clusters WHERE message_id = ANY(%s) RETURNING cluster_id",
+                        ([row[0] for row in rows],))
+            touched = {row[0] for row in cur.fetchall()}
+            assignments, new_clusters = assign_batch(cur, [(row[0], row[1]) for row in rows])
+            copy_records(cur, assignments, "message_clusters", ["message_id", "fingerprint", "cluster_id"])
+            touched.update(a["cluster_id"] for a in assignments)
+            cur.execute(REFRESH_COUNTS_SQL, (list(touched),))
+            position = (rows[-1][2], rows[-1][0])
+            if watermark is None or rows[-1][2] > watermark:
+                watermark = rows[-1][2]
+                state["loaded_at"] = watermark.isoformat()
+            totals["messages"] += len(rows)
+            totals["clusters"] += new_clusters
+            record_loaded(cur, SOURCE_TABLE, json.dumps(state), totals["messages"], target=TABLE)
+            conn.commit()
+    conn.rollback()
+    return observe_stage("clusters", time.perf_counter() - started, **totals)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cluster near-duplicate message texts.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--full", action="store_true", help="recluster every message")
+    args = parser.parse_args()
+    conn = connect()
+    try:
+        totals = cluster_messages(conn, args.batch_size, args.full)
+    finally:
+        conn.close()
+    if totals["messages"]:
+        invalidate_cache()
+    rate = totals["messages"] / totals["seconds"] if totals["seconds"] else 0
+    print(f"Clustered {totals['messages']} messages into {totals['clusters']} new clusters "
+          f"in {totals['seconds']:.2f}s, {rate:.0f} messages/s")
@@ -1,60 +1,286 @@
+# Runs YOLOv8 object detection over the downloaded media and writes the
+# detections to data/image_detections/ (loaded by load_image_detections.py).
+# Each run adds one file with just the images that are new to that directory,
+# or whose content or model changed; the cache remembers what was written.
+#
+# Images are decoded and letterboxed by a thread pool (OpenCV releases the GIL)
+# a few batches ahead of the model, and the model is fed whole batches, so the
+# CPU keeps inferring while the next images are read from disk.
+#
+# Detections are cached by image content hash and model (detection_cache.py):
+# only images whose bytes haven't been seen by this model are inferred, and
+# duplicate copies reuse the stored detections.
+#
+# The model is loaded on first use, through the backend YOLO_BACKEND selects
+# (PyTorch, ONNX Runtime or OpenVINO, optionally INT8; see inference_backend.py).
+#
+# This module runs over a whole media tree; detection_queue.py's workers use
+# detect_files() to process newly scraped photos continuously.
+#
+#   python -m src.yolo_detection --batch-size 16 --workers 4
+
 import os
 import json
-from ultralytics import YOLO
+import time
+import argparse
+from datetime import datetime, timezone
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import ultralytics
+from .media_store import PHOTOS_DIR
+from .parquet_lake import lake_enabled, write_detections as write_lake_detections
+from .detection_cache import CACHE_PATH, DetectionCache, sha256_file
+from .metrics import YOLO_BATCH_SECONDS, YOLO_IMAGES, observe_stage
+from .inference_backend import BACKEND, INT8, IMG_SIZE, MODEL_WEIGHTS, backend_tag, load_model
+from .load_image_detections import DETECTIONS_DIR, detection_records, normalize_media_path
+
+_model = None
 
-model = YOLO('yolov8n.pt')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+BATCH_SIZE = int(os.getenv("YOLO_BATCH_SIZE", "16"))
+DECODE_WORKERS = int(os.getenv("YOLO_DECODE_WORKERS", str(min(8, os.cpu_count() or 2))))
+PREFETCH_BATCHES = 2  # batches decoded ahead of the one being inferred
 
 def extract_message_id(img_path):
-    basename = os.path.basename(img_path)
-    msg_id = os.path.splitext(basename)[0]
-    return msg_id
+    # The media store names files <message_id>.jpg; older downloads kept
+    # Telethon's photo_<timestamp> names, which carry no message id.
+    stem = os.path.splitext(os.path.basename(img_path))[0]
+    return int(stem) if stem.isdigit() else None
 
-def detect_objects_in_images(media_dir, output_json, detected_dir="media/detected", max_images=20):
-    results = []
-    os.makedirs(detected_dir, exist_ok=True)
-    detected_count = 0
-    for root, _, files in os.walk(media_dir):
-        for file in files:
-            if detected_count >= max_images:
-                break
-            if file.lower().endswith(('.jpg', '.jpeg', '.png')):
-                img_path = os.path.join(root, file)
-                # Skip missing/corrupt/empty files
-                if not os.path.exists(img_path) or os.path.getsize(img_path) == 0:
-                    continue
+def get_model(threads=None):
+    # `threads` only applies to the first call, which loads the model.
+    global _model
+    if _model is None:
+        _model = load_model(threads=threads)
+    return _model
+
+def get_model_key():
+    # (name, version) the cache is keyed on; anything that changes the output belongs in the version.
+    # "+xyxy": entries cached before the boxes were stored lack them.
+    weights = MODEL_WEIGHTS if os.path.exists(MODEL_WEIGHTS) else getattr(get_model(), "ckpt_path", None) or MODEL_WEIGHTS
+    weights_hash = sha256_file(weights)[:12] if os.path.exists(weights) else "unknown"
+    version = f"ultralytics-{ultralytics.__version__}+{weights_hash}+imgsz{IMG_SIZE}+xyxy"
+    if BACKEND != "torch":
+        version += f"+{backend_tag(BACKEND, INT8)}"
+    return os.path.basename(MODEL_WEIGHTS), version
+
+def iter_image_paths(media_dir, exclude_dirs=()):
+    excluded = {os.path.abspath(d) for d in exclude_dirs}
+    for root, dirs, files in os.walk(media_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) not in excluded)
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, file)
+
+def letterbox(img, new_shape=IMG_SIZE, color=(114, 114, 114)):
+    # Resize keeping aspect ratio and pad to a square, as YOLO does internally.
+    h, w = img.shape[:2]
+    ratio = min(new_shape / h, new_shape / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+    pad_w, pad_h = (new_shape - new_w) // 2, (new_shape - new_h) // 2
+    if (new_w, new_h) != (w, h):
+        img = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    img = cv2.copyMakeBorder(
+        img, pad_h, new_shape - new_h - pad_h, pad_w, new_shape - new_w - pad_w,
+        cv2.BORDER_CONSTANT, value=color,
+    )
+    return img, (pad_w, pad_h, new_w, new_h)
+
+def load_image(img_path):
+    # Returns (path, letterboxed image, letterbox geometry, original (h, w)), or None if unreadable.
+    if not os.path.exists(img_path) or os.path.getsize(img_path) == 0:
+        return None
+    img = cv2.imread(img_path)
+    if img is None:
+        return None
+    boxed, geometry = letterbox(img)
+    return img_path, boxed, geometry, img.shape[:2]
+
+def iter_decoded_batches(paths, batch_size=BATCH_SIZE, workers=DECODE_WORKERS, prefetch=PREFETCH_BATCHES):
+    """Yield lists of decoded images, keeping at most `prefetch` batches in flight."""
+    max_in_flight = batch_size * (prefetch + 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        batch = []
+        paths = iter(paths)
+        exhausted = False
+        while pending or not exhausted:
+            while not exhausted and len(pending) < max_in_flight:
                 try:
-                    detections = model(img_path)
-                except Exception as e:
-                    print(f"Error processing {img_path}: {e}")
-                    continue
-                for r in detections:
-                    # Only save if there are detections
-                    if len(r.boxes) > 0:
-                        # Save annotated image with boxes, labels, and confidence scores
-                        r.save(detected_dir)
-                        subfolder = os.path.join(detected_dir, os.path.splitext(file)[0])
-                        if os.path.exists(subfolder):
-                            for f in os.listdir(subfolder):
-                                src = os.path.join(subfolder, f)
-                                dst = os.path.join(detected_dir, f"detected_{file}")
-                                os.rename(src, dst)
-                                print(f"Saved detected image: {dst}")
-                            os.rmdir(subfolder)
-                        detected_count += 1
-                    # Collect detection metadata
-                    for box in r.boxes:
-                        results.append({
-                            "message_id": extract_message_id(img_path),
-                            "media_path": img_path,
-                            "detected_object_class": model.names[int(box.cls)],
-                            "confidence_score": float(box.conf)
-                        })
-        if detected_count >= max_images:
-            break
-    # Save detection results to JSON
-    os.makedirs(os.path.dirname(output_json), exist_ok=True)
-    with open(output_json, "w") as f:
-        json.dump(results, f, indent=2)
+                    pending.append(pool.submit(load_image, next(paths)))
+                except StopIteration:
+                    exhausted = True
+            if not pending:
+                break
+            item = pending.popleft().result()
+            if item is None:
+                continue
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def save_annotated(result, geometry, orig_shape, out_path):
+    # Draw on the letterboxed frame, then crop the padding and restore the original size.
+    pad_w, pad_h, new_w, new_h = geometry
+    plotted = result.plot()[pad_h:pad_h + new_h, pad_w:pad_w + new_w]
+    plotted = cv2.resize(plotted, (orig_shape[1], orig_shape[0]), interpolation=cv2.INTER_LINEAR)
+    cv2.imwrite(out_path, plotted)
+
+def original_box(xyxy, geometry, orig_shape):
+    # A box on the letterboxed frame -> box columns in the original image's
+    # pixels, rounded to 0.1 px so the same detection always gets the same key.
+    pad_w, pad_h, new_w, new_h = geometry
+    h, w = orig_shape
+    x1, y1, x2, y2 = xyxy
+    return {
+        "box_x1": round(min(max((x1 - pad_w) * w / new_w, 0.0), w), 1),
+        "box_y1": round(min(max((y1 - pad_h) * h / new_h, 0.0), h), 1),
+        "box_x2": round(min(max((x2 - pad_w) * w / new_w, 0.0), w), 1),
+        "box_y2": round(min(max((y2 - pad_h) * h / new_h, 0.0), h), 1),
+    }
+
+def store_results(batch, detections, hashes, known, cache, model_key, detected_dir, save_detected):
+    # Records one inferred batch in `known` and the cache, committing it so an
+    # interrupted run keeps what it has inferred.
+    names = get_model().names
+    for (img_path, _, geometry, orig_shape), r in zip(batch, detections):
+        # Only save if there are detections
+        if save_detected and len(r.boxes) > 0:
+            # Save annotated image with boxes, labels, and confidence scores
+            dst = os.path.join(detected_dir, f"detected_{os.path.basename(img_path)}")
+            save_annotated(r, geometry, orig_shape, dst)
+        found = [
+            {"detected_object_class": names[int(box.cls)], "confidence_score": float(box.conf),
+             **original_box(box.xyxy[0].tolist(), geometry, orig_shape)}
+            for box in r.boxes
+        ]
+        known[hashes[img_path]] = found
+        cache.put(hashes[img_path], *model_key, found)
+    cache.commit()
+
+def detect_files(paths, cache, model_key=None, detected_dir="media/detected", save_detected=True,
+                 workers=DECODE_WORKERS):
+    """Return {path: detections} for a batch of images, inferring only those the cache lacks.
+
+    Missing and unreadable images are left out of the result.
+    """
+    model_key = model_key or get_model_key()
+    os.makedirs(detected_dir, exist_ok=True)
+    hashes = cache.hash_files(paths, workers)
+    known = cache.get_many(set(hashes.values()), *model_key)
+    unique = {}
+    for img_path, digest in hashes.items():
+        if digest not in known:
+            unique.setdefault(digest, img_path)
+    batch = [item for item in map(load_image, unique.values()) if item is not None]
+    if batch:
+        with YOLO_BATCH_SECONDS.time():
+            detections = get_model().predict([item[1] for item in batch], imgsz=IMG_SIZE, verbose=False)
+        YOLO_IMAGES.inc(len(batch))
+        store_results(batch, detections, hashes, known, cache, model_key, detected_dir, save_detected)
+    return {img_path: known[digest] for img_path, digest in hashes.items() if digest in known}
+
+def detect_objects_in_images(media_dir, output_dir=DETECTIONS_DIR, detected_dir="media/detected", max_images=None,
+                             batch_size=BATCH_SIZE, workers=DECODE_WORKERS, save_detected=True,
+                             cache_path=CACHE_PATH, write_lake=True):
+    """Detect objects in every image under media_dir; returns counts and the run's file under output_dir.
+
+    The file (None if nothing is new) only holds the images output_dir hasn't
+    been given with their current content and model.
+    """
+    os.makedirs(detected_dir, exist_ok=True)
+    # media/photos holds the store's originals; every message links them into its partition.
+    paths = list(iter_image_paths(media_dir, exclude_dirs=[detected_dir, PHOTOS_DIR]))[:max_images]
+    model_name, model_version = get_model_key()
+    cache = DetectionCache(cache_path)
+
+    hashes = cache.hash_files(paths, workers)
+    unique = {}
+    for img_path, digest in hashes.items():
+        unique.setdefault(digest, img_path)
+    known = cache.get_many(unique, model_name, model_version)
+    todo = [img_path for digest, img_path in unique.items() if digest not in known]
+    print(f"{len(paths)} images, {len(unique)} unique, {len(known)} cached, {len(todo)} to infer")
+
+    processed = 0
+    started = time.perf_counter()
+    for batch_no, batch in enumerate(iter_decoded_batches(todo, batch_size, workers), start=1):
+        batch_started = time.perf_counter()
+        try:
+            detections = get_model().predict([item[1] for item in batch], imgsz=IMG_SIZE, verbose=False)
+        except Exception as e:
+            print(f"Error processing batch starting at {batch[0][0]}: {e}")
+            continue
+        YOLO_BATCH_SECONDS.observe(time.perf_counter() - batch_started)
+        YOLO_IMAGES.inc(len(batch))
+        store_results(batch, detections, hashes, known, cache, (model_name, model_version),
+                      detected_dir, save_detected)
+        processed += len(batch)
+        if batch_no % 10 == 0:
+            elapsed = time.perf_counter() - started
+            print(f"{processed} images, {processed / elapsed:.1f} images/s "
+                  f"(last batch {time.perf_counter() - batch_started:.2f}s)")
+    elapsed = time.perf_counter() - started
+    print(f"Inferred {processed} images in {elapsed:.1f}s: "
+          f"{processed / elapsed if elapsed else 0:.1f} images/s "
+          f"(batch_size={batch_size}, workers={workers})")
+    observe_stage("yolo", elapsed, images=processed)
+
+    def iter_records(img_paths):
+        for img_path in img_paths:
+            yield img_path, detection_records(extract_message_id(img_path), img_path, known[hashes[img_path]])
+
+    # Images whose inference failed are left for the next run.
+    done = {img_path: hashes[img_path] for img_path in paths if hashes.get(img_path) in known}
+    output = os.path.normpath(output_dir)
+    pending = cache.unemitted(output, done, model_version)
+    totals = {"images": len(paths), "detections": sum(len(known[digest]) for digest in done.values()),
+              "written": len(pending), "path": None}
+    if pending:
+        # One NDJSON line per detection (one without a class for an image that
+        # has none), renamed into place so the loader never reads half a file.
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, f"detections-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.ndjson")
+        with open(path + ".part", "w", encoding="utf-8") as f:
+            for img_path, records in iter_records(pending):
+                for record in records or [{"media_path": normalize_media_path(img_path)}]:
+                    f.write(json.dumps(record) + "\n")
+        os.replace(path + ".part", path)
+        cache.mark_emitted(output, {img_path: done[img_path] for img_path in pending}, model_version)
+        totals["path"] = path.replace(os.sep, "/")
+    cache.close()
+    # The lake partitions are replaced with all their images' detections,
+    # streamed rather than collected, with the same rows for images without any.
+    if lake_enabled() and write_lake:
+        write_lake_detections(record for img_path, records in iter_records(done)
+                              for record in records or [{"media_path": normalize_media_path(img_path)}])
+    return totals
+
+def prune_cache(cache_path=CACHE_PATH):
+    cache = DetectionCache(cache_path)
+    try:
+        return cache.prune(*get_model_key())
+    finally:
+        cache.close()
 
 if __name__ == "__main__":
-    detect_objects_in_images("media", "data/image_detections.json", detected_dir="media/detected", max_images=20)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run YOLO object detection over downloaded media.")
+    parser.add_argument("--media-dir", default="media")
+    parser.add_argument("--output", default=DETECTIONS_DIR, help="directory for this run's detections file")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=DECODE_WORKERS, help="image decoding threads")
+    parser.add_argument("--max-images", type=int, default=None, help="stop after this many images (default: all)")
+    parser.add_argument("--no-save", action="store_true", help="don't write annotated images")
+    parser.add_argument("--prune-cache", action="store_true",
+                        help="drop cached detections of other model versions before running")
+    args = parser.parse_args()
+    if args.prune_cache:
+        print(f"Pruned {prune_cache()} cached detections from other models")
+    detect_objects_in_images(
+        args.media_dir, args.output, detected_dir="media/detected", max_images=args.max_images,
+        batch_size=args.batch_size, workers=args.workers, save_detected=not args.no_save,
+    )
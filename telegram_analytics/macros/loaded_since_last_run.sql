@@ -0,0 +1,14 @@
+{#
+  Incremental filter on raw_telegram_messages.loaded_at. loaded_at is the
+  loading transaction's now(), i.e. its start: partition loads run in
+  parallel, so a load that started before the last dbt run can commit after
+  it with older stamps. Re-reading the last `load_lookback` (longer than any
+  load transaction) picks those rows up; the models' delete+insert makes the
+  overlap idempotent.
+#}
+{% macro loaded_since_last_run(column='loaded_at', watermark_column='loaded_at') %}
+{{ column }} > (
+    select coalesce(max({{ watermark_column }}), '-infinity') - interval '{{ var("load_lookback") }}'
+    from {{ this }}
+)
+{% endmacro %}
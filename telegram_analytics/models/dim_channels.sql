@@ -1,4 +0,0 @@
-select
-    channel_id,
-    channel_name
-from {{ source('public', 'channels') }}
@@ -0,0 +1,42 @@
+-- One row per channel per day. Incremental runs recompute only the
+-- (channel, day) pairs that received rows loaded since the last run (with
+-- a lookback, see macros/loaded_since_last_run.sql).
+{{ config(
+    materialized='incremental',
+    unique_key=['channel_name', 'activity_date'],
+    incremental_strategy='delete+insert',
+    indexes=[
+        {'columns': ['channel_name', 'activity_date'], 'unique': True},
+        {'columns': ['activity_date']},
+    ]
+) }}
+
+with raw as (
+    select channel_name, date, media, is_reply, loaded_at
+    from {{ source('public', 'raw_telegram_messages') }}
+    where channel_name is not null
+      and date is not null
+)
+{% if is_incremental() %}
+, touched as (
+    select distinct channel_name, date::date as activity_date
+    from raw
+    where {{ loaded_since_last_run(watermark_column='max_loaded_at') }}
+)
+{% endif %}
+select
+    raw.channel_name,
+    raw.date::date as activity_date,
+    count(*) as post_count,
+    count(*) filter (where raw.media) as media_count,
+    count(*) filter (where raw.is_reply) as reply_count,
+    max(raw.date) as last_post_at,
+    max(raw.loaded_at) as max_loaded_at
+from raw
+{% if is_incremental() %}
+join touched
+  on touched.channel_name = raw.channel_name
+ and raw.date >= touched.activity_date
+ and raw.date < touched.activity_date + 1
+{% endif %}
+group by 1, 2
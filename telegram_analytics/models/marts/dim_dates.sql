@@ -1,6 +1,21 @@
-select distinct
+{{ config(
+    materialized='incremental',
+    unique_key='date_id',
+    incremental_strategy='delete+insert',
+    indexes=[
+        {'columns': ['date_id'], 'unique': True},
+    ]
+) }}
+
+select
     date::date as date_id,
-    extract(year from date) as year,
-    extract(month from date) as month,
-    extract(day from date) as day
-from {{ ref('stg_telegram_messages') }}
\ No newline at end of file
+    extract(year from date::date) as year,
+    extract(month from date::date) as month,
+    extract(day from date::date) as day,
+    max(loaded_at) as max_loaded_at
+from {{ ref('stg_telegram_messages') }}
+where date is not null
+{% if is_incremental() %}
+  and {{ loaded_since_last_run(watermark_column='max_loaded_at') }}
+{% endif %}
+group by 1, 2, 3, 4
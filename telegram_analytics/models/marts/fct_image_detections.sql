@@ -1,6 +1,18 @@
+-- message_media (loaded from the media store manifest) gives the exact message
+-- of each image; detections of older files fall back to a numeric filename stem.
 select
-    cast(message_id as bigint) as message_id,
-    media_path,
-    detected_object_class,
-    confidence_score
-from {{ source('public', 'image_detections') }}
\ No newline at end of file
+    coalesce(
+        mm.message_id,
+        case when d.message_id::text ~ '^[0-9]+$' then d.message_id::text::bigint end
+    ) as message_id,
+    mm.channel_name,
+    d.media_path,
+    d.detected_object_class,
+    d.confidence_score,
+    d.box_x1,
+    d.box_y1,
+    d.box_x2,
+    d.box_y2
+from {{ source('public', 'image_detections') }} d
+left join {{ source('public', 'message_media') }} mm
+  on mm.media_path = d.media_path
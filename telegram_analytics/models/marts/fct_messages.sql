@@ -1,3 +1,14 @@
+{{ config(
+    materialized='incremental',
+    unique_key='message_id',
+    incremental_strategy='delete+insert',
+    indexes=[
+        {'columns': ['message_id'], 'unique': True},
+        {'columns': ['channel_id', 'date']},
+        {'columns': ['date']},
+    ]
+) }}
+
 select
     id as message_id,
     date,
@@ -8,5 +19,9 @@ select
     channel_name,
     channel_url,
     message_length,
-    has_image
-from {{ ref('stg_telegram_messages') }}
\ No newline at end of file
+    has_image,
+    loaded_at
+from {{ ref('stg_telegram_messages') }}
+{% if is_incremental() %}
+where {{ loaded_since_last_run() }}
+{% endif %}
@@ -1,23 +1,43 @@
-with raw as (
-    select
-        *,
-        row_number() over (partition by id order by date desc) as rn
-    from {{ source('public', 'raw_telegram_messages') }}
-)
+-- Incremental: each run only reads raw rows loaded since the newest loaded_at
+-- already staged, less a lookback for loads that committed late (see
+-- macros/loaded_since_last_run.sql). raw_telegram_messages is unique on id,
+-- and delete+insert on id replaces earlier versions of re-loaded messages.
+-- media_path comes from message_media (the media store manifest). A photo
+-- linked after its message was loaded re-stages the message, and loaded_at
+-- is the later of the two loads so fct_messages picks the path up as well.
+{{ config(
+    materialized='incremental',
+    unique_key='id',
+    incremental_strategy='delete+insert',
+    indexes=[
+        {'columns': ['id'], 'unique': True},
+        {'columns': ['channel_id', 'date']},
+        {'columns': ['date']},
+        {'columns': ['loaded_at']},
+    ]
+) }}
+
 select
-    id::bigint,
-    date::timestamp,
-    text,
-    media,
-    media_path,
-    channel_id,
-    channel_name,
-    channel_url,
+    m.id::bigint,
+    m.date::timestamp,
+    m.text,
+    m.media,
+    mm.media_path,
+    m.channel_name as channel_id,
+    m.channel_name,
+    m.channel_url,
 
-    length(text) as message_length,
-    case when media then 1 else 0 end as has_image
-from raw
-where text is not null
-  and text != ''
-  and channel_id is not null
-  and rn = 1
\ No newline at end of file
+    length(m.text) as message_length,
+    case when m.media then 1 else 0 end as has_image,
+    greatest(m.loaded_at, mm.loaded_at) as loaded_at
+from {{ source('public', 'raw_telegram_messages') }} m
+left join {{ source('public', 'message_media') }} mm
+  on mm.message_id = m.id
+ and mm.channel_name = m.channel_name
+where m.text is not null
+  and m.text != ''
+  and m.channel_name is not null
+{% if is_incremental() %}
+  and ({{ loaded_since_last_run('m.loaded_at') }}
+       or {{ loaded_since_last_run('mm.loaded_at') }})
+{% endif %}
@@ -0,0 +1,77 @@
+import os
+import asyncio
+import logging
+import tempfile
+import unittest
+from unittest import mock
+from collections import defaultdict
+
+from src import backfill, scrape_telegram
+from src.media_store import MediaStore
+from src.raw_store import RAW_DATA_DIR, iter_partition_dirs, iter_partition
+from benchmarks.synthetic import SyntheticDataset
+from benchmarks.fake_client import FakeTelegramClient
+
+class Killed(BaseException):
+    pass
+
+class PagedClient(FakeTelegramClient):
+    # Telethon's get_messages: newest first, ids below offset_id and above min_id.
+    async def get_messages(self, channel_url, limit=None, offset_id=0, min_id=0):
+        page = [m for m in self.messages[channel_url] if m.id > min_id and (not offset_id or m.id < offset_id)]
+        return page[:limit]
+
+class BackfillShardTest(unittest.TestCase):
+    def setUp(self):
+        # The stores and checkpoints use paths relative to the working directory.
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        for patcher in [mock.patch.object(backfill, "enqueue_media", mock.Mock(return_value=0)),
+                        mock.patch.object(scrape_telegram, "lake_enabled", mock.Mock(return_value=False)),
+                        mock.patch.object(backfill, "PAGE_SIZE", 10)]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.dataset = SyntheticDataset(30, channels=1, days=2, photo_ratio=0.5, photo_pool=30, seed=3)
+        self.client = PagedClient(self.dataset)
+        self.channel_url = self.dataset.channel_url(self.dataset.channel_names[0])
+        self.store = MediaStore("data/media_manifest.sqlite", photos_dir="media/photos")
+        self.addCleanup(self.store.close)
+
+    def run_shard(self):
+        plan = backfill.load_plan(self.dataset.channel_names[0], 0, 30, 1)
+        shard = plan["shards"][0]
+        limiter = backfill.TokenBucket(1000)
+        asyncio.run(backfill.backfill_shard(self.client, self.channel_url, plan, shard, limiter,
+                                            self.store, defaultdict(asyncio.Lock)))
+
+    def stored_ids(self):
+        return sorted(m["id"] for d in iter_partition_dirs(RAW_DATA_DIR) for m in iter_partition(d))
+
+    def linked_ids(self):
+        return sorted(r[0] for r in self.store.conn.execute("SELECT message_id FROM message_media"))
+
+    def photo_ids(self):
+        return sorted(m.id for m in self.client.messages[self.channel_url] if m.photo is not None)
+
+    def test_backfills_messages_and_photos(self):
+        self.run_shard()
+        self.assertEqual(self.stored_ids(), list(range(1, 31)))
+        self.assertEqual(self.linked_ids(), self.photo_ids())
+
+    def test_crash_during_a_download_refetches_the_page(self):
+        # The process dies while the first page's photos are downloading.
+        with mock.patch.object(self.client, "download_media", side_effect=Killed):
+            with self.assertRaises(Killed):
+                self.run_shard()
+        self.assertEqual(self.stored_ids(), [])
+        self.run_shard()
+        self.assertEqual(self.stored_ids(), list(range(1, 31)))
+        self.assertEqual(self.linked_ids(), self.photo_ids())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+import base64
+import asyncio
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+from src import crud
+from src.crud import decode_cursor, encode_cursor
+
+def raw_cursor(payload):
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+class CursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        cursor = encode_cursor(0.25, 42)
+        self.assertEqual(decode_cursor(cursor, 2), [0.25, 42])
+
+    def test_malformed_cursors_are_rejected(self):
+        for cursor in ["not base64!", raw_cursor("{"), raw_cursor('{"a": 1}'), encode_cursor(1, 2, 3)]:
+            with self.subTest(cursor=cursor), self.assertRaisesRegex(ValueError, "Invalid cursor"):
+                decode_cursor(cursor, 2)
+
+class SearchMessagesTest(unittest.TestCase):
+    def setUp(self):
+        self.fetch_all = mock.AsyncMock(return_value=[])
+        for target, value in [("fetch_all", self.fetch_all), ("has_trigram_index", mock.AsyncMock(return_value=False))]:
+            patcher = mock.patch.object(crud, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def search(self, **kwargs):
+        return asyncio.run(crud.search_messages("paracetamol", **kwargs))
+
+    def test_cursor_values_must_be_a_rank_and_an_id(self):
+        for values in [(None, None), ("high", 3), (0.5, "x"), ([1], 2)]:
+            with self.subTest(values=values), self.assertRaisesRegex(ValueError, "Invalid cursor"):
+                self.search(cursor=encode_cursor(*values))
+        self.fetch_all.assert_not_called()
+
+    def test_blank_query_is_rejected(self):
+        for query in ["", "   ", "\t\n"]:
+            with self.subTest(query=query), self.assertRaisesRegex(ValueError, "Empty search query"):
+                asyncio.run(crud.search_messages(query))
+        self.fetch_all.assert_not_called()
+
+    def test_query_is_stripped(self):
+        asyncio.run(crud.search_messages("  paracetamol "))
+        self.assertEqual(self.fetch_all.call_args.args[1]["query"], "paracetamol")
+
+    def test_next_cursor_points_after_the_last_row(self):
+        rows = [{"message_id": i, "channel_name": "chan", "content": "paracetamol", "date": "2025-01-01",
+                 "media": True, "channel_url": None, "sender_id": None, "is_reply": False, "rank": 1.0 / i}
+                for i in (1, 2, 3)]
+        self.fetch_all.return_value = rows
+        results, next_cursor = self.search(limit=2)
+        self.assertEqual([r["message_id"] for r in results], ["1", "2"])
+        self.assertEqual(decode_cursor(next_cursor, 2), [0.5, 2])
+        self.search(limit=2, cursor=next_cursor)
+        params = self.fetch_all.call_args.args[1]
+        self.assertEqual((params["cursor_rank"], params["cursor_id"], params["limit"]), (0.5, 2, 3))
+
+class MessagesPageTest(unittest.TestCase):
+    def setUp(self):
+        self.fetch_all = mock.AsyncMock(return_value=[])
+        patcher = mock.patch.object(crud, "fetch_all", self.fetch_all)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def page(self, **kwargs):
+        return asyncio.run(crud.get_messages_page(**kwargs))
+
+    def test_keyset_cursor(self):
+        self.fetch_all.return_value = [
+            {"id": i, "date": datetime(2025, 1, i, tzinfo=timezone.utc), "text": None, "media": None,
+             "channel_name": "chan", "channel_url": None, "sender_id": None, "is_reply": None}
+            for i in (1, 2, 3)
+        ]
+        messages, next_cursor = self.page(limit=2)
+        self.assertEqual([m["id"] for m in messages], [1, 2])
+        self.assertEqual(messages[0]["text"], "")
+        self.assertEqual(decode_cursor(next_cursor, 2), ["2025-01-02T00:00:00+00:00", 2])
+
+        self.fetch_all.return_value = []
+        self.assertEqual(self.page(limit=2, cursor=next_cursor), ([], None))
+        sql, params = self.fetch_all.call_args.args
+        self.assertIn("(date, id) > (:cursor_date, :cursor_id)", sql)
+        self.assertEqual(params["cursor_date"], datetime(2025, 1, 2, tzinfo=timezone.utc))
+        self.assertEqual(params["cursor_id"], 2)
+
+    def test_invalid_cursor_values(self):
+        for values in [(None, 1), ("yesterday", 1), ("2025-01-02T00:00:00+00:00", "x")]:
+            with self.subTest(values=values), self.assertRaisesRegex(ValueError, "Invalid cursor"):
+                self.page(cursor=encode_cursor(*values))
+        self.fetch_all.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()
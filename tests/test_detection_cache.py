@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+
+from src.detection_cache import DetectionCache
+
+class DetectionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.cache = DetectionCache(os.path.join(self.tmp.name, "cache.sqlite"))
+        self.addCleanup(self.cache.close)
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_copies_share_a_hash(self):
+        a, b = self.write("a.jpg", b"image"), self.write("b.jpg", b"image")
+        self.write("empty.jpg", b"")
+        hashes = self.cache.hash_files([a, b, os.path.join(self.tmp.name, "empty.jpg"), "missing.jpg"])
+        self.assertEqual(list(hashes), [a, b])
+        self.assertEqual(hashes[a], hashes[b])
+
+    def test_detections_are_kept_per_model(self):
+        self.cache.put("abc", "yolov8n.pt", "v1", [{"detected_object_class": "bottle"}])
+        self.cache.commit()
+        self.assertEqual(self.cache.get_many(["abc", "def"], "yolov8n.pt", "v1"),
+                         {"abc": [{"detected_object_class": "bottle"}]})
+        self.assertEqual(self.cache.get_many(["abc"], "yolov8n.pt", "v2"), {})
+
+    def test_only_new_or_changed_images_are_unemitted(self):
+        hashes = {"a.jpg": "h1", "b.jpg": "h2"}
+        self.assertEqual(self.cache.unemitted("out", hashes, "v1"), ["a.jpg", "b.jpg"])
+        self.cache.mark_emitted("out", hashes, "v1")
+        self.assertEqual(self.cache.unemitted("out", hashes, "v1"), [])
+        # New content, a new model, another output directory.
+        self.assertEqual(self.cache.unemitted("out", {"a.jpg": "h3", "b.jpg": "h2"}, "v1"), ["a.jpg"])
+        self.assertEqual(self.cache.unemitted("out", hashes, "v2"), ["a.jpg", "b.jpg"])
+        self.assertEqual(self.cache.unemitted("other", hashes, "v1"), ["a.jpg", "b.jpg"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,119 @@
+import os
+import unittest
+from unittest import mock
+
+import psycopg2
+from src import detection_queue
+from src.database import connect
+from src.detection_queue import claim, enqueue, fail
+
+# Two sessions have to see the same queue, so a temp table won't do: each
+# test gets a schema of its own, first on both connections' search_path.
+SCHEMA = f"test_detection_queue_{os.getpid()}"
+JOBS_SQL = """
+    CREATE TABLE detection_jobs (
+        id BIGSERIAL PRIMARY KEY, channel_name TEXT, message_id BIGINT, media_path TEXT NOT NULL UNIQUE,
+        status TEXT NOT NULL DEFAULT 'pending', attempts INTEGER NOT NULL DEFAULT 0,
+        available_at TIMESTAMPTZ NOT NULL DEFAULT now(), locked_by TEXT, locked_at TIMESTAMPTZ,
+        last_error TEXT, created_at TIMESTAMPTZ NOT NULL DEFAULT now(), finished_at TIMESTAMPTZ
+    );
+"""
+
+class DetectionQueueTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.conn = connect()
+        except psycopg2.OperationalError as e:
+            self.skipTest(f"PostgreSQL not available: {e}")
+        self.addCleanup(self.conn.close)
+        with self.conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+            cur.execute(f"SET search_path TO {SCHEMA}, public")
+            cur.execute(JOBS_SQL)
+        self.conn.commit()
+        self.addCleanup(self.drop_schema)
+        enqueue(self.conn, [("chan", i, f"media/d/chan/{i}.jpg") for i in range(1, 6)])
+
+    def drop_schema(self):
+        self.conn.rollback()
+        with self.conn.cursor() as cur:
+            cur.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+        self.conn.commit()
+
+    def second_connection(self):
+        conn = connect()
+        self.addCleanup(conn.close)
+        with conn.cursor() as cur:
+            cur.execute(f"SET search_path TO {SCHEMA}, public")
+            # A claimer blocked on the other's row locks fails instead of hanging the test.
+            cur.execute("SET lock_timeout = '5s'")
+        conn.commit()
+        return conn
+
+    def job(self, message_id):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT status, attempts, last_error, available_at - now() FROM detection_jobs "
+                        "WHERE message_id = %s", (message_id,))
+            row = cur.fetchone()
+        self.conn.commit()
+        return row
+
+    def make_available(self):
+        with self.conn.cursor() as cur:
+            cur.execute("UPDATE detection_jobs SET available_at = now() - interval '1 second'")
+        self.conn.commit()
+
+    def test_concurrent_claimers_get_disjoint_jobs(self):
+        # The first claimer's transaction is still open, holding its rows' locks.
+        with self.conn.cursor() as cur:
+            cur.execute(detection_queue.CLAIM_SQL, {"worker": "a", "limit": 2})
+            first = cur.fetchall()
+        second = claim(self.second_connection(), "b", 10)
+        self.conn.commit()
+        self.assertEqual(len(first), 2)
+        self.assertEqual(len(second), 3)
+        self.assertEqual(sorted(job[1] for job in first + second), [1, 2, 3, 4, 5])
+
+    def test_failed_job_waits_for_its_backoff(self):
+        jobs = claim(self.conn, "a", 1)
+        fail(self.conn, jobs, "boom")
+        status, attempts, error, wait = self.job(jobs[0][1])
+        self.assertEqual((status, attempts, error), ("pending", 1, "boom"))
+        self.assertAlmostEqual(wait.total_seconds(), detection_queue.RETRY_DELAY_SECONDS, delta=1)
+        # The other four are claimed; the failed one isn't visible yet.
+        self.assertEqual(sorted(job[1] for job in claim(self.conn, "a", 10)), [2, 3, 4, 5])
+        self.assertEqual(claim(self.conn, "a", 10), [])
+
+        self.make_available()
+        [retried] = claim(self.conn, "a", 10)
+        self.assertEqual(retried[1], jobs[0][1])
+        fail(self.conn, [retried], "boom again")
+        # The delay doubles with every attempt.
+        wait = self.job(retried[1])[3]
+        self.assertAlmostEqual(wait.total_seconds(), 2 * detection_queue.RETRY_DELAY_SECONDS, delta=1)
+
+    def test_job_is_dead_after_max_attempts(self):
+        with mock.patch.object(detection_queue, "MAX_ATTEMPTS", 3):
+            for attempt in range(3):
+                [job] = claim(self.conn, "a", 1)
+                self.assertEqual(job[1], 1)
+                fail(self.conn, [job], f"failure {attempt + 1}")
+                self.make_available()
+            self.assertEqual(self.job(1)[:3], ("dead", 3, "failure 3"))
+            self.assertNotIn(1, [job[1] for job in claim(self.conn, "a", 10)])
+
+    def test_expired_lease_is_reclaimed(self):
+        [job] = claim(self.conn, "dead-worker", 1)
+        claimed = claim(self.conn, "b", 10)
+        self.assertNotIn(job[1], [j[1] for j in claimed])
+        # The worker died holding the job; its lease runs out.
+        with self.conn.cursor() as cur:
+            cur.execute("UPDATE detection_jobs SET locked_at = now() - make_interval(secs => %s) WHERE id = %s",
+                        (detection_queue.LEASE_SECONDS + 1, job[0]))
+        self.conn.commit()
+        [reclaimed] = claim(self.second_connection(), "b", 10)
+        self.assertEqual(reclaimed, job)
+        self.assertEqual(self.job(job[1])[:3], ("running", 2, "lease expired"))
+
+if __name__ == "__main__":
+    unittest.main()
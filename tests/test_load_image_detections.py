@@ -0,0 +1,145 @@
+import os
+import json
+import logging
+import tempfile
+import unittest
+from functools import partial
+from unittest import mock
+
+import psycopg2
+from src import load_image_detections, parquet_lake
+from src.database import connect
+from src.load_image_detections import (
+    detection_records, iter_file_records, load_detection_file, normalize_media_path, upsert_detections,
+)
+
+# Temp tables shadow the real ones for the test's session (pg_temp is searched first).
+SCHEMA_SQL = """
+    CREATE TEMP TABLE image_detections (
+        message_id BIGINT, media_path TEXT NOT NULL, detected_object_class TEXT NOT NULL,
+        confidence_score DOUBLE PRECISION, box_x1 DOUBLE PRECISION NOT NULL, box_y1 DOUBLE PRECISION NOT NULL,
+        box_x2 DOUBLE PRECISION NOT NULL, box_y2 DOUBLE PRECISION NOT NULL
+    );
+    CREATE UNIQUE INDEX ON image_detections (media_path, detected_object_class, box_x1, box_y1, box_x2, box_y2);
+    CREATE TEMP TABLE load_manifest (
+        target TEXT NOT NULL, path TEXT NOT NULL, checksum TEXT NOT NULL, row_count BIGINT NOT NULL,
+        loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (target, path)
+    );
+"""
+
+def found(cls="bottle", conf=0.5, box=(10.0, 20.0, 110.0, 220.0)):
+    return {"detected_object_class": cls, "confidence_score": conf,
+            **dict(zip(["box_x1", "box_y1", "box_x2", "box_y2"], box))}
+
+class RecordsTest(unittest.TestCase):
+    def test_normalize_media_path(self):
+        self.assertEqual(normalize_media_path("media\\2025-07-10\\chan\\1.jpg"), "media/2025-07-10/chan/1.jpg")
+        self.assertEqual(normalize_media_path("./media/2025-07-10/chan/1.jpg"), "media/2025-07-10/chan/1.jpg")
+
+    def test_legacy_records_without_a_box_are_skipped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "image_detections.json")
+            with open(path, "w") as f:
+                json.dump([
+                    {"message_id": "photo_2022-09-05_09-57-09", "media_path": "media\\d\\c\\photo.jpg",
+                     "detected_object_class": "bottle", "confidence_score": 0.4},
+                    {"message_id": "12", "media_path": "media\\d\\c\\12.jpg", **found()},
+                ], f)
+            logging.disable(logging.CRITICAL)
+            self.addCleanup(logging.disable, logging.NOTSET)
+            records = list(iter_file_records(path))
+        self.assertEqual(records, [{"message_id": 12, "media_path": "media/d/c/12.jpg", **found()}])
+
+class DatabaseTestCase(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.conn = connect()
+        except psycopg2.OperationalError as e:
+            self.skipTest(f"PostgreSQL not available: {e}")
+        self.addCleanup(self.conn.close)
+        with self.conn.cursor() as cur:
+            cur.execute(SCHEMA_SQL)
+        self.conn.commit()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def rows(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT media_path, detected_object_class, confidence_score, box_x1 "
+                        "FROM image_detections ORDER BY 1, 2, 4")
+            return cur.fetchall()
+
+class UpsertTest(DatabaseTestCase):
+    def upsert(self, images):
+        records = [r for path, detections in images.items() for r in detection_records(1, path, detections)]
+        with self.conn.cursor() as cur:
+            result = upsert_detections(cur, records, list(images))
+        self.conn.commit()
+        return result
+
+    def test_equal_detections_with_different_boxes_are_kept(self):
+        # Two bottles with the same confidence: only the boxes tell them apart.
+        twins = [found(), found(box=(200.0, 20.0, 300.0, 220.0))]
+        self.assertEqual(self.upsert({"media/d/c/1.jpg": twins}), (2, 2))
+        self.assertEqual(self.upsert({"media/d/c/1.jpg": twins}), (2, 0))
+        self.assertEqual(self.rows(), [("media/d/c/1.jpg", "bottle", 0.5, 10.0), ("media/d/c/1.jpg", "bottle", 0.5, 200.0)])
+
+    def test_latest_detections_replace_an_images_rows(self):
+        self.upsert({"media/d/c/1.jpg": [found(), found("person", 0.9)], "media/d/c/2.jpg": [found()]})
+        # Re-detected: the bottle's confidence moved, the person is gone; 2.jpg now has nothing.
+        self.assertEqual(self.upsert({"media/d/c/1.jpg": [found(conf=0.6)], "media/d/c/2.jpg": []}), (1, 3))
+        self.assertEqual(self.rows(), [("media/d/c/1.jpg", "bottle", 0.6, 10.0)])
+
+    def test_load_file(self):
+        path = os.path.join(self.tmp.name, "run.ndjson")
+        with open(path, "w") as f:
+            for record in detection_records(1, "media\\d\\c\\1.jpg", [found(), found("person", 0.9)]):
+                f.write(json.dumps(record) + "\n")
+        self.assertEqual(load_detection_file(self.conn, path, chunk_rows=1), (2, 2))
+        self.assertIsNone(load_detection_file(self.conn, path))
+        self.assertEqual([r[:2] for r in self.rows()], [("media/d/c/1.jpg", "bottle"), ("media/d/c/1.jpg", "person")])
+
+    def test_image_without_detections_clears_its_rows(self):
+        self.upsert({"media/d/c/1.jpg": [found()], "media/d/c/2.jpg": [found()]})
+        # A later run's file: 1.jpg has no detections any more.
+        path = os.path.join(self.tmp.name, "run-2.ndjson")
+        with open(path, "w") as f:
+            f.write(json.dumps({"media_path": "media\\d\\c\\1.jpg"}) + "\n")
+        self.assertEqual(load_detection_file(self.conn, path), (0, 1))
+        self.assertEqual([r[0] for r in self.rows()], ["media/d/c/2.jpg"])
+
+@unittest.skipIf(parquet_lake.pa is None, "pyarrow not installed")
+class ParquetLoadTest(DatabaseTestCase):
+    def load(self):
+        lake_files = partial(parquet_lake.iter_files, base_dir=self.tmp.name)
+        with mock.patch.object(load_image_detections, "iter_lake_files", lake_files), \
+                mock.patch.object(load_image_detections, "apply_migrations"), \
+                mock.patch.object(load_image_detections, "invalidate_cache"):
+            totals = load_image_detections.load_parquet(self.conn)
+        return totals["files"], totals["rows"], totals["changed"]
+
+    def write(self, images):
+        # As yolo_detection writes the lake: a row without a class for an image without detections.
+        parquet_lake.write_detections(
+            (r for path, detections in images.items()
+             for r in detection_records(1, path, detections) or [{"media_path": path}]),
+            base_dir=self.tmp.name,
+        )
+
+    def test_load_partition_replaced_by_a_later_run(self):
+        self.write({"media/d/c/1.jpg": [found(), found("person", 0.75)], "media/d/c/2.jpg": [found()]})
+        self.assertEqual(self.load(), (1, 3, 3))
+        self.assertEqual(self.load(), (0, 0, 0))
+        # Re-detected: the bottle's confidence moved, the person is gone; 2.jpg now has nothing.
+        self.write({"media/d/c/1.jpg": [found(conf=0.625)], "media/d/c/2.jpg": []})
+        self.assertEqual(self.load(), (1, 1, 3))
+        self.assertEqual(self.rows(), [("media/d/c/1.jpg", "bottle", 0.625, 10.0)])
+
+    def test_boxes_are_kept_in_the_lake(self):
+        self.write({"media/d/c/1.jpg": [found(box=(1.5, 2.5, 3.5, 4.5))]})
+        table = parquet_lake.read_table("detections", columns=load_image_detections.BOX_COLUMNS,
+                                        base_dir=self.tmp.name)
+        self.assertEqual([list(row.values()) for row in table.to_pylist()], [[1.5, 2.5, 3.5, 4.5]])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+import os
+import json
+import tempfile
+import unittest
+
+import psycopg2
+from src.database import connect
+from src.load_to_postgres import TABLE, copy_value, load_file_to_postgres
+
+# Temp tables shadow the real ones for the test's session (pg_temp is searched
+# first), so the loader runs unchanged without touching the configured database.
+SCHEMA_SQL = f"""
+    CREATE TEMP TABLE {TABLE} (
+        id BIGINT, date TIMESTAMPTZ, text TEXT, media BOOLEAN, channel_name TEXT,
+        channel_url TEXT, sender_id BIGINT, is_reply BOOLEAN,
+        loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE UNIQUE INDEX ON {TABLE} (id);
+    CREATE TEMP TABLE load_manifest (
+        target TEXT NOT NULL, path TEXT NOT NULL, checksum TEXT NOT NULL, row_count BIGINT NOT NULL,
+        loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (target, path)
+    );
+"""
+
+def message(msg_id, text="Paracetamol 500mg", **fields):
+    return {"id": msg_id, "date": "2025-01-01 10:00:00+00:00", "text": text, "media": True,
+            "channel_name": "chan", "channel_url": "https://t.me/chan", "sender_id": None,
+            "is_reply": False, **fields}
+
+class CopyValueTest(unittest.TestCase):
+    def test_escapes_copy_text_format(self):
+        self.assertEqual(copy_value(None), "\\N")
+        self.assertEqual(copy_value(True), "t")
+        self.assertEqual(copy_value("a\tb\nc\\d\r"), "a\\tb\\nc\\\\d\\r")
+        self.assertEqual(copy_value(12), "12")
+
+class LoadFileTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.conn = connect()
+        except psycopg2.OperationalError as e:
+            self.skipTest(f"PostgreSQL not available: {e}")
+        self.addCleanup(self.conn.close)
+        with self.conn.cursor() as cur:
+            cur.execute(SCHEMA_SQL)
+        self.conn.commit()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, name, messages):
+        path = os.path.join(self.tmp.name, name)
+        with open(path, "w", encoding="utf-8") as f:
+            for m in messages:
+                f.write(json.dumps(m) + "\n")
+        return path
+
+    def rows(self):
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT id, text, loaded_at FROM {TABLE} ORDER BY id")
+            return cur.fetchall()
+
+    def test_reload_is_idempotent(self):
+        path = self.write("seg-1.ndjson", [message(1), message(2)])
+        self.assertEqual(load_file_to_postgres(self.conn, path), (2, 2))
+        self.assertIsNone(load_file_to_postgres(self.conn, path))
+        self.assertEqual([r[:2] for r in self.rows()], [(1, "Paracetamol 500mg"), (2, "Paracetamol 500mg")])
+
+    def test_merge_updates_changed_rows_only(self):
+        self.assertEqual(load_file_to_postgres(self.conn, self.write("seg-1.ndjson", [message(1), message(2)])),
+                         (2, 2))
+        before = {r[0]: r[2] for r in self.rows()}
+        # The same ids in another file: only the edited one counts as merged.
+        path = self.write("seg-2.ndjson", [message(1), message(2, "Amoxicillin")])
+        self.assertEqual(load_file_to_postgres(self.conn, path), (2, 1))
+        after = {r[0]: r for r in self.rows()}
+        self.assertEqual(after[1][2], before[1])
+        self.assertEqual(after[2][1], "Amoxicillin")
+
+    def test_repeated_id_in_a_file_keeps_the_last_copy(self):
+        path = self.write("seg-1.ndjson", [message(1, "first"), message(1, "second"), message(None)])
+        self.assertEqual(load_file_to_postgres(self.conn, path), (3, 1))
+        self.assertEqual([r[:2] for r in self.rows()], [(1, "second")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+import logging
+import unittest
+from unittest import mock
+
+from fastapi.testclient import TestClient
+from src import main
+from src.main import etag_matches
+
+ETAG = '"0a1b2c"'
+
+class EtagMatchesTest(unittest.TestCase):
+    def test_matching_headers(self):
+        for header in [ETAG, f'"ffff", {ETAG}', f' "ffff" ,W/{ETAG} ', "*"]:
+            with self.subTest(header=header):
+                self.assertTrue(etag_matches(ETAG, header))
+
+    def test_other_tags_do_not_match(self):
+        # Neither a tag containing ours nor one contained in it.
+        for header in ["", '"ffff"', '"0a1b2c0"', '"0a1b"', '"ffff", W/"0a1b2"', "0a1b2c"]:
+            with self.subTest(header=header):
+                self.assertFalse(etag_matches(ETAG, header))
+
+class CachedResponseTest(unittest.TestCase):
+    def setUp(self):
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        patcher = mock.patch.object(main, "get_or_compute", mock.AsyncMock(return_value=(ETAG, b"[]")))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(main.app)
+
+    def get(self, if_none_match):
+        return self.client.get("/api/reports/top-media", headers={"If-None-Match": if_none_match})
+
+    def test_tag_in_a_list_gets_304(self):
+        response = self.get(f'"ffff", W/{ETAG}')
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], ETAG)
+
+    def test_any_tag_gets_304(self):
+        self.assertEqual(self.get("*").status_code, 304)
+
+    def test_other_tag_gets_the_body(self):
+        response = self.get('"0a1b2c0", "0a1b"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"[]")
+
+class SearchEndpointTest(unittest.TestCase):
+    def setUp(self):
+        # Importing the scraper points logging at data/raw/telegram_messages/scraping.log.
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+
+    def test_blank_query_is_422(self):
+        search = mock.AsyncMock(return_value=([], None))
+        with mock.patch.object(main, "search_messages", search):
+            client = TestClient(main.app)
+            for query in [" ", "  \t "]:
+                with self.subTest(query=query):
+                    self.assertEqual(client.get("/api/search/messages", params={"query": query}).status_code, 422)
+            self.assertEqual(client.get("/api/search/messages", params={"query": " aspirin "}).status_code, 200)
+        search.assert_awaited_once()
+
+if __name__ == "__main__":
+    unittest.main()
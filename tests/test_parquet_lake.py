@@ -0,0 +1,35 @@
+import tempfile
+import unittest
+
+from src import parquet_lake
+from src.parquet_lake import media_partition, read_table, write_detections
+
+def detection(day, channel, no):
+    return {"message_id": no, "media_path": f"media/{day}/{channel}/{no}.jpg",
+            "detected_object_class": "bottle", "confidence_score": 0.5}
+
+@unittest.skipIf(parquet_lake.pa is None, "pyarrow not installed")
+class WriteDetectionsTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def message_ids(self):
+        table = read_table("detections", columns=["message_id", "channel"], base_dir=self.tmp.name)
+        return sorted(zip(table.column("channel").to_pylist(), table.column("message_id").to_pylist()))
+
+    def test_replaces_written_partitions_across_chunks(self):
+        write_detections([detection("2025-01-01", "a", 1), detection("2025-01-01", "b", 9)], base_dir=self.tmp.name)
+        # A generator, three chunks, partition "a" in all of them: only its old rows go.
+        records = (detection("2025-01-01", "a", i) for i in range(2, 7))
+        self.assertEqual(parquet_lake.write_records(
+            "detections", records, day_of=lambda r: media_partition(r["media_path"])[0],
+            channel_of=lambda r: media_partition(r["media_path"])[1], base_dir=self.tmp.name,
+            replace=True, chunk_rows=2), 5)
+        self.assertEqual(self.message_ids(), [("a", i) for i in range(2, 7)] + [("b", 9)])
+
+    def test_nothing_to_write(self):
+        self.assertEqual(write_detections(iter([]), base_dir=self.tmp.name), 0)
+
+if __name__ == "__main__":
+    unittest.main()
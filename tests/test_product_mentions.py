@@ -0,0 +1,114 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+from src import product_mentions
+from src.database import connect
+from src.product_mentions import ProductMatcher, extract_product_mentions, load_matcher, normalize
+
+# Temp tables shadow the real ones for the test's session (pg_temp is searched first).
+SCHEMA_SQL = """
+    CREATE TEMP TABLE raw_telegram_messages (
+        id BIGINT PRIMARY KEY, date TIMESTAMPTZ, text TEXT, channel_name TEXT,
+        loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE TEMP TABLE products_mentions (
+        message_id BIGINT NOT NULL, channel_name TEXT, product TEXT NOT NULL,
+        mention_count INTEGER NOT NULL, message_date TIMESTAMPTZ, PRIMARY KEY (message_id, product)
+    );
+    CREATE TEMP TABLE load_manifest (
+        target TEXT NOT NULL, path TEXT NOT NULL, checksum TEXT NOT NULL, row_count BIGINT NOT NULL,
+        loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (target, path)
+    );
+"""
+
+class NormalizeTest(unittest.TestCase):
+    def test_folds_case_accents_and_punctuation(self):
+        self.assertEqual(normalize("Paracétamol-500MG!"), "paracetamol 500mg")
+
+    def test_folds_amharic_homophones(self):
+        self.assertEqual(normalize("ሐኪም"), normalize("ሀኪም"))
+
+class ProductMatcherTest(unittest.TestCase):
+    def setUp(self):
+        self.matcher = ProductMatcher([
+            ("Amoxicillin", "amoxicillin"),
+            ("Amoxicillin-Clavulanate", "amoxicillin clavulanate"),
+            ("Hand Sanitizer", "hand sanitizer"),
+            ("Hand Sanitizer", "sanitizer"),
+            ("Paracetamol", "paracetamol"),
+            ("Paracetamol", "ፓራሲታሞል"),
+        ])
+
+    def test_counts_each_mention(self):
+        self.assertEqual(self.matcher.match("Paracetamol, paracetamol and a sanitizer"),
+                         {"Paracetamol": 2, "Hand Sanitizer": 1})
+
+    def test_latin_aliases_match_whole_words(self):
+        self.assertEqual(self.matcher.match("sanitizers and paracetamolx"), {})
+
+    def test_amharic_aliases_match_inside_words(self):
+        self.assertEqual(self.matcher.match("የፓራሲታሞልን ዋጋ"), {"Paracetamol": 1})
+
+    def test_alias_inside_a_longer_alias_does_not_count(self):
+        # One shares the longer alias's end, the other its start.
+        self.assertEqual(self.matcher.match("hand sanitizer"), {"Hand Sanitizer": 1})
+        self.assertEqual(self.matcher.match("Amoxicillin clavulanate 625mg"), {"Amoxicillin-Clavulanate": 1})
+        self.assertEqual(self.matcher.match("amoxicillin or amoxicillin clavulanate"),
+                         {"Amoxicillin": 1, "Amoxicillin-Clavulanate": 1})
+
+    def test_empty_text(self):
+        self.assertEqual(self.matcher.match(None), {})
+        self.assertEqual(self.matcher.match(""), {})
+
+    def test_dictionary_loads(self):
+        self.assertEqual(load_matcher().match("augmentin"), {"Amoxicillin-Clavulanate": 1})
+
+class ExtractProductMentionsTest(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.conn = connect()
+        except psycopg2.OperationalError as e:
+            self.skipTest(f"PostgreSQL not available: {e}")
+        self.addCleanup(self.conn.close)
+        with self.conn.cursor() as cur:
+            cur.execute(SCHEMA_SQL)
+        self.conn.commit()
+        patcher = mock.patch.object(product_mentions, "apply_migrations")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def insert(self, msg_id, text, loaded_at):
+        with self.conn.cursor() as cur:
+            cur.execute("INSERT INTO raw_telegram_messages (id, date, text, channel_name, loaded_at) "
+                        "VALUES (%s, now(), %s, 'chan', %s::timestamptz) "
+                        "ON CONFLICT (id) DO UPDATE SET text = EXCLUDED.text, loaded_at = EXCLUDED.loaded_at",
+                        (msg_id, text, loaded_at))
+        self.conn.commit()
+
+    def mentions(self):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT message_id, product, mention_count FROM products_mentions ORDER BY 1, 2")
+            return cur.fetchall()
+
+    def test_extracts_new_changed_and_late_rows(self):
+        self.insert(1, "paracetamol", "2025-01-01 10:00+00")
+        self.insert(2, "amoxicillin and paracetamol", "2025-01-01 11:00+00")
+        self.assertEqual(extract_product_mentions(self.conn, batch_size=1)["messages"], 2)
+        self.assertEqual(self.mentions(), [(1, "Paracetamol", 1), (2, "Amoxicillin", 1), (2, "Paracetamol", 1)])
+
+        # Committed by a slower load after the last run read past its loaded_at.
+        self.insert(3, "augmentin", "2025-01-01 10:50+00")
+        # Edited: comes back with a newer loaded_at.
+        self.insert(1, "sanitizer", "2025-01-01 12:00+00")
+        extract_product_mentions(self.conn)
+        expected = [(1, "Hand Sanitizer", 1), (2, "Amoxicillin", 1), (2, "Paracetamol", 1),
+                    (3, "Amoxicillin-Clavulanate", 1)]
+        self.assertEqual(self.mentions(), expected)
+
+        # Re-reading the lookback window changes nothing.
+        extract_product_mentions(self.conn)
+        self.assertEqual(self.mentions(), expected)
+
+if __name__ == "__main__":
+    unittest.main()
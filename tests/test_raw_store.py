@@ -0,0 +1,78 @@
+import os
+import json
+import tempfile
+import unittest
+from unittest import mock
+
+from src import raw_store
+from src.raw_store import (
+    append_messages, compact_partition, filter_new_messages, iter_index_chunks, iter_partition, list_segments,
+)
+
+def message(msg_id, text="hello"):
+    return {"id": msg_id, "text": text}
+
+def stored_ids(part_dir):
+    return sorted(i for chunk in iter_index_chunks(part_dir) for i in chunk)
+
+class RawStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.part_dir = os.path.join(self.tmp.name, "2025-01-01", "chan")
+
+    def store(self, messages):
+        new = filter_new_messages(self.part_dir, messages)
+        append_messages(self.part_dir, new)
+        return new
+
+    def write_legacy(self, messages):
+        os.makedirs(os.path.dirname(self.part_dir), exist_ok=True)
+        with open(os.path.join(os.path.dirname(self.part_dir), "chan.json"), "w") as f:
+            json.dump(messages, f)
+
+    def test_only_new_messages_are_appended(self):
+        self.assertEqual(len(self.store([message(1), message(2)])), 2)
+        new = self.store([message(2), message(3), message(3, "repeat")])
+        self.assertEqual(new, [message(3)])
+        self.assertEqual(sorted(m["id"] for m in iter_partition(self.part_dir)), [1, 2, 3])
+        self.assertEqual(stored_ids(self.part_dir), [1, 2, 3])
+
+    def test_index_is_scanned_in_chunks(self):
+        with mock.patch.object(raw_store, "INDEX_CHUNK", 2):
+            self.store([message(i) for i in range(1, 6)])
+            self.assertEqual(len(list(iter_index_chunks(self.part_dir))), 3)
+            self.assertEqual(self.store([message(5), message(6)]), [message(6)])
+
+    def test_legacy_ids_seed_the_index(self):
+        self.write_legacy([message(1), message(2)])
+        self.assertEqual(self.store([message(2), message(3)]), [message(3)])
+        self.assertEqual(sorted(m["id"] for m in iter_partition(self.part_dir)), [1, 2, 3])
+
+    def test_compaction_keeps_the_last_write(self):
+        self.store([message(1), message(2)])
+        append_messages(self.part_dir, [message(2, "edited")])
+        self.assertEqual(compact_partition(self.part_dir), 2)
+        self.assertEqual(len(list_segments(self.part_dir)), 1)
+        self.assertEqual(sorted((m["id"], m["text"]) for m in iter_partition(self.part_dir)),
+                         [(1, "hello"), (2, "edited")])
+        self.assertEqual(stored_ids(self.part_dir), [1, 2])
+
+    def test_compaction_without_legacy_keeps_legacy_ids(self):
+        self.write_legacy([message(1), message(2)])
+        self.store([message(3)])
+        self.store([message(4)])
+        self.assertEqual(compact_partition(self.part_dir), 2)
+        self.assertEqual(stored_ids(self.part_dir), [1, 2, 3, 4])
+        self.assertEqual(self.store([message(1), message(2), message(5)]), [message(5)])
+
+    def test_compaction_folds_in_legacy(self):
+        self.write_legacy([message(1), message(2)])
+        self.store([message(3)])
+        self.assertEqual(compact_partition(self.part_dir, include_legacy=True), 3)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.part_dir), "chan.json")))
+        self.assertEqual(sorted(m["id"] for m in iter_partition(self.part_dir)), [1, 2, 3])
+        self.assertEqual(stored_ids(self.part_dir), [1, 2, 3])
+
+if __name__ == "__main__":
+    unittest.main()
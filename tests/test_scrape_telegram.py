@@ -0,0 +1,135 @@
+import os
+import asyncio
+import logging
+import tempfile
+import unittest
+from unittest import mock
+
+from src import scrape_telegram
+from src.media_store import MediaStore
+from src.raw_store import RAW_DATA_DIR, partition_dir, iter_partition, iter_partition_dirs
+from benchmarks.synthetic import SyntheticDataset
+from benchmarks.fake_client import FakeTelegramClient
+
+DAY = "2025-01-01"
+
+class BlockingClient:
+    # The telethon.sync interface the CLI scraper uses, over the async fake.
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def iter_messages(self, *args, **kwargs):
+        async def collect():
+            return [m async for m in self.client.iter_messages(*args, **kwargs)]
+        return asyncio.run(collect())
+
+    def download_media(self, message, file):
+        return asyncio.run(self.client.download_media(message, file))
+
+class ScrapeAllChannelsTest(unittest.TestCase):
+    def setUp(self):
+        # The stores use paths relative to the working directory.
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+        self.addCleanup(self.tmp.cleanup)
+        self.addCleanup(os.chdir, self.cwd)
+        # The scraper logs to data/raw/telegram_messages/scraping.log in the checkout.
+        logging.disable(logging.CRITICAL)
+        self.addCleanup(logging.disable, logging.NOTSET)
+        for target, value in [("enqueue_media", mock.Mock(return_value=0)),
+                              ("lake_enabled", mock.Mock(return_value=False)),
+                              ("CHANNEL_LIMITS", {})]:
+            patcher = mock.patch.object(scrape_telegram, target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # One day of messages per channel, half of them with one of 4 photos.
+        self.dataset = SyntheticDataset(40, channels=2, days=1, photo_ratio=0.5, photo_pool=4, seed=7)
+        self.client = FakeTelegramClient(self.dataset)
+        self.channels = [self.dataset.channel_url(name) for name in self.dataset.channel_names]
+        self.store = MediaStore("data/media_manifest.sqlite", photos_dir="media/photos")
+        self.addCleanup(self.store.close)
+
+    def scrape(self, channels=None, **kwargs):
+        kwargs.setdefault("store", self.store)
+        kwargs.setdefault("date_str", DAY)
+        return asyncio.run(scrape_telegram.scrape_all_channels(self.client, channels or self.channels, **kwargs))
+
+    def test_scrapes_every_channel(self):
+        summaries = self.scrape()
+        self.assertEqual([s["channel"] for s in summaries], self.dataset.channel_names)
+        for summary in summaries:
+            self.assertEqual(summary["messages"], 20)
+            stored = list(iter_partition(partition_dir(RAW_DATA_DIR, DAY, summary["channel"])))
+            self.assertEqual(sorted(m["id"] for m in stored), list(range(1, 21)))
+        # Reposts share photo ids, so each photo is downloaded once.
+        self.assertGreater(self.client.downloads, 0)
+        self.assertEqual(sum(s["downloaded"] for s in summaries), len(os.listdir("media/photos")))
+        self.assertLessEqual(self.client.downloads, 4)
+
+    def test_channel_limits(self):
+        limits = {name: {"messages": 5, "images": 1} for name in self.dataset.channel_names}
+        with mock.patch.object(scrape_telegram, "CHANNEL_LIMITS", limits):
+            summaries = self.scrape()
+        for summary in summaries:
+            self.assertEqual(summary["messages"], 5)
+            self.assertLessEqual(summary["images"], 1)
+            self.assertLessEqual(summary["downloaded"], 1)
+
+    def test_rescraping_a_day_stores_nothing_new(self):
+        # posted_on fetches the whole day again, so only the partition's id index dedupes.
+        self.scrape(posted_on=True)
+        downloads = self.client.downloads
+        summaries = self.scrape(posted_on=True)
+        self.assertEqual([s["messages"] for s in summaries], [0, 0])
+        self.assertEqual(self.client.downloads, downloads)
+        for name in self.dataset.channel_names:
+            stored = list(iter_partition(partition_dir(RAW_DATA_DIR, DAY, name)))
+            self.assertEqual(len(stored), len({m["id"] for m in stored}))
+
+    def test_small_queue_drains_and_workers_stop(self):
+        async def run():
+            summaries = await scrape_telegram.scrape_all_channels(
+                self.client, self.channels, download_workers=3, queue_size=1, date_str=DAY, store=self.store)
+            return summaries, asyncio.all_tasks() - {asyncio.current_task()}
+
+        summaries, leftover = asyncio.run(run())
+        self.assertEqual(leftover, set())
+        linked = self.store.conn.execute("SELECT COUNT(*) FROM message_media").fetchone()[0]
+        self.assertEqual(linked, sum(s["images"] for s in summaries))
+        scrape_telegram.enqueue_media.assert_called_once()
+
+    def test_failing_channel_does_not_stop_the_others(self):
+        summaries = self.scrape(self.channels + ["https://t.me/missing_channel"])
+        self.assertIn("error", summaries[-1])
+        self.assertEqual([s["messages"] for s in summaries[:-1]], [20, 20])
+
+    def test_cli_and_partition_scrapes_store_a_message_once(self):
+        # The CLI scraper runs on a later day than the messages were posted;
+        # both paths must file them under the posting day.
+        channel_url = self.channels[0]
+        name = self.dataset.channel_names[0]
+        with mock.patch.object(scrape_telegram, "TelegramClient",
+                               mock.Mock(return_value=BlockingClient(self.client))):
+            scrape_telegram.scrape_channel(channel_url)
+        [summary] = self.scrape([channel_url], posted_on=True)
+        self.assertEqual(summary["messages"], 0)
+
+        self.assertEqual([os.path.basename(os.path.dirname(d)) for d in iter_partition_dirs(RAW_DATA_DIR)], [DAY])
+        stored = list(iter_partition(partition_dir(RAW_DATA_DIR, DAY, name)))
+        self.assertEqual(sorted(m["id"] for m in stored), list(range(1, 21)))
+        # One media link per photo message, all in the posting day's partition.
+        links = [os.path.join(root, f) for root, _, files in os.walk("media")
+                 if not root.startswith(os.path.join("media", "photos")) for f in files]
+        photo_messages = [m for m in self.client.messages[channel_url] if m.photo is not None]
+        self.assertEqual(len(links), len(photo_messages))
+        self.assertTrue(all(link.startswith(os.path.join("media", DAY, name)) for link in links))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+from unittest import mock
+
+import psycopg2
+from src import text_clusters
+from src.database import connect
+from src.text_clusters import assign_batch, cluster_messages, cluster_text, minhash, similarity
+
+# Temp tables shadow the real ones for the test's session (pg_temp is searched first).
+SCHEMA_SQL = """
+    CREATE TEMP TABLE raw_telegram_messages (
+        id BIGINT PRIMARY KEY, text TEXT, loaded_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE TEMP TABLE text_clusters (
+        cluster_id BIGINT PRIMARY KEY, representative TEXT NOT NULL, signature BYTEA NOT NULL,
+        message_count BIGINT NOT NULL DEFAULT 0, updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    );
+    CREATE TEMP TABLE text_cluster_bands (
+        band SMALLINT NOT NULL, bucket BIGINT NOT NULL, cluster_id BIGINT NOT NULL,
+        PRIMARY KEY (band, bucket, cluster_id)
+    );
+    CREATE TEMP TABLE text_fingerprints (fingerprint BIGINT PRIMARY KEY, cluster_id BIGINT NOT NULL);
+    CREATE TEMP TABLE text_lines (line_hash BIGINT PRIMARY KEY, text_count BIGINT NOT NULL);
+    CREATE TEMP TABLE message_clusters (
+        message_id BIGINT PRIMARY KEY, fingerprint BIGINT NOT NULL, cluster_id BIGINT NOT NULL
+    );
+    CREATE TEMP TABLE load_manifest (
+        target TEXT NOT NULL, path TEXT NOT NULL, checksum TEXT NOT NULL, row_count BIGINT NOT NULL,
+        loaded_at TIMESTAMPTZ NOT NULL DEFAULT now(), PRIMARY KEY (target, path)
+    );
+"""
+
+PROMO = ("Augmentin 625mg tablets now in stock, price {} birr per pack. "
+         "Free delivery inside Addis Ababa for orders above 500 birr.")
+OTHER = "Do you have insulin pens for children? Please call us back with the price and availability."
+
+class SignatureTest(unittest.TestCase):
+    def test_reposts_normalize_alike(self):
+        self.assertEqual(cluster_text(PROMO.format(450)), cluster_text(PROMO.format(1200) + " 🔥"))
+
+    def test_similar_texts_have_similar_signatures(self):
+        promo = minhash(cluster_text(PROMO.format(450)))
+        edited = minhash(cluster_text(PROMO.format(450).replace("now in stock", "available now")))
+        other = minhash(cluster_text(OTHER))
+        self.assertGreater(similarity(promo, edited), similarity(promo, other))
+        self.assertLess(similarity(promo, other), 0.2)
+
+class ClusterTestCase(unittest.TestCase):
+    def setUp(self):
+        try:
+            self.conn = connect()
+        except psycopg2.OperationalError as e:
+            self.skipTest(f"PostgreSQL not available: {e}")
+        self.addCleanup(self.conn.close)
+        with self.conn.cursor() as cur:
+            cur.execute(SCHEMA_SQL)
+        self.conn.commit()
+        patcher = mock.patch.object(text_clusters, "apply_migrations")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def query(self, sql):
+        with self.conn.cursor() as cur:
+            cur.execute(sql)
+            return cur.fetchall()
+
+class AssignBatchTest(ClusterTestCase):
+    def assign(self, rows):
+        with self.conn.cursor() as cur:
+            result = assign_batch(cur, rows)
+        self.conn.commit()
+        return result
+
+    def test_reposts_share_a_cluster(self):
+        assignments, new_clusters = self.assign([(1, PROMO.format(450)), (2, PROMO.format(500)), (3, OTHER)])
+        self.assertEqual(new_clusters, 2)
+        cluster = {a["message_id"]: a["cluster_id"] for a in assignments}
+        self.assertEqual(cluster[1], cluster[2])
+        self.assertNotEqual(cluster[1], cluster[3])
+
+    def test_near_duplicates_join_an_existing_cluster(self):
+        first, _ = self.assign([(1, PROMO.format(450))])
+        edited = PROMO.format(450).replace("tablets", "tabs")
+        assignments, new_clusters = self.assign([(2, edited), (3, None), (4, "  ")])
+        self.assertEqual(new_clusters, 0)
+        self.assertEqual([(a["message_id"], a["cluster_id"]) for a in assignments], [(2, first[0]["cluster_id"])])
+
+    def test_known_texts_are_not_counted_again(self):
+        self.assign([(1, PROMO.format(450))])
+        lines = self.query("SELECT line_hash, text_count FROM text_lines ORDER BY 1")
+        self.assign([(2, PROMO.format(450))])
+        self.assertEqual(self.query("SELECT line_hash, text_count FROM text_lines ORDER BY 1"), lines)
+
+class ClusterMessagesTest(ClusterTestCase):
+    def insert(self, msg_id, text, loaded_at):
+        with self.conn.cursor() as cur:
+            cur.execute("INSERT INTO raw_telegram_messages (id, text, loaded_at) VALUES (%s, %s, %s::timestamptz)",
+                        (msg_id, text, loaded_at))
+        self.conn.commit()
+
+    def counts(self):
+        return self.query("SELECT representative, message_count FROM text_clusters ORDER BY message_count DESC")
+
+    def test_late_rows_are_clustered_once(self):
+        self.insert(1, PROMO.format(450), "2025-01-01 10:00+00")
+        self.insert(2, OTHER, "2025-01-01 11:00+00")
+        self.assertEqual(cluster_messages(self.conn, batch_size=1)["clusters"], 2)
+        # Committed by a slower load after the last run read past its loaded_at.
+        self.insert(3, PROMO.format(500), "2025-01-01 10:30+00")
+        cluster_messages(self.conn)
+        expected = [(PROMO.format(450), 2), (OTHER, 1)]
+        self.assertEqual(self.counts(), expected)
+        lines = self.query("SELECT line_hash, text_count FROM text_lines ORDER BY 1")
+
+        # Re-reading the lookback window neither recounts clusters nor lines.
+        cluster_messages(self.conn)
+        self.assertEqual(self.counts(), expected)
+        self.assertEqual(self.query("SELECT line_hash, text_count FROM text_lines ORDER BY 1"), lines)
+        self.assertEqual(self.query("SELECT COUNT(*) FROM message_clusters"), [(3,)])
+
+if __name__ == "__main__":
+    unittest.main()